@@ -0,0 +1,3 @@
+"""
+Benchmarks for the patchers, run with python -m benchmarks.run
+"""
@@ -0,0 +1,163 @@
+"""
+Synthetic game libraries for benchmarking
+
+The real libraries can't be shipped, so these are made to look like them
+where it matters: a similar size, an AArch64 ELF header with loaded segments
+and .text and .rodata sections, the version string at the right place, and
+plausible instruction words at every patch site. The sections put every site
+in one it allows, so the section checks run on these like on real libraries.
+"""
+
+import os
+import random
+import struct
+
+from patchcore import arm64, elf
+from patchcore.games import GAMES
+from patchcore.registry import Encode
+
+NOP = 0xd503201f
+MOV_W0_1 = 0x52800020 # mov w0,#1
+CMP_W0_1 = 0x7100041f # cmp w0,#1
+
+# Values used for patches that take one
+VALUES = {
+	"key": "benchmark",
+	"balls": "25",
+	"hit": "3",
+	"fov": "90",
+	"seconds": "32",
+	"checkpoints": "26",
+	"sprites": "1",
+}
+
+def librarySize(game):
+	"""
+	Get a realistic size for a game's library, a bit past its last patch site
+	"""
+	
+	end = max([game.version_offset + 8] + [site.offset + site.size for patch in game.patches.values() for site in patch.sites])
+	end += 0x10000
+	
+	return end + (-end % 0x1000)
+
+def textEnd(game):
+	"""
+	Get where .text ends in a game's library: the first page past every site
+	that has to be in it
+	"""
+	
+	end = max(site.offset + site.size for patch in game.patches.values() for site in patch.sites if ".rodata" not in site.sections)
+	
+	return end + (-end % 0x1000)
+
+def writeHeaders(data, text_end):
+	"""
+	Write a 64-bit little endian AArch64 shared object ELF header into the
+	start of data, with an executable segment for .text from the start to
+	text_end and a read only one for .rodata from there to the last page,
+	which gets the section headers
+	"""
+	
+	size = len(data)
+	names = b"\x00.text\x00.rodata\x00.shstrtab\x00"
+	names_offset = size - 0x1000
+	section_offset = names_offset + 0x40
+	program_offset = elf.HEADER.size
+	
+	ident = b"\x7fELF" + bytes([2, 1, 1, 0]) + bytes(8)
+	data[0:elf.HEADER.size] = elf.HEADER.pack(ident, 3, 0xb7, 1, 0, program_offset, section_offset, 0, elf.HEADER.size, elf.PROGRAM_HEADER.size, 2, elf.SECTION_HEADER.size, 4, 3)
+	
+	segments = [(elf.PF_X | 4, 0, text_end), (4, text_end, names_offset)]
+	
+	for (i, (flags, start, end)) in enumerate(segments):
+		header = elf.PROGRAM_HEADER.pack(elf.PT_LOAD, flags, start, start, start, end - start, end - start, 0x1000)
+		data[program_offset + i * elf.PROGRAM_HEADER.size:program_offset + (i + 1) * elf.PROGRAM_HEADER.size] = header
+	
+	# Flags are SHF_ALLOC with SHF_EXECINSTR for .text
+	sections = [
+		(0, 0, 0, 0, 0),
+		(names.index(b".text"), 1, 2 | elf.SHF_EXECINSTR, 0x1000, text_end - 0x1000),
+		(names.index(b".rodata"), 1, 2, text_end, names_offset - text_end),
+		(names.index(b".shstrtab"), 3, 0, names_offset, len(names)),
+	]
+	
+	for (i, (name, type, flags, offset, length)) in enumerate(sections):
+		header = elf.SECTION_HEADER.pack(name, type, flags, offset if flags else 0, offset, length, 0, 0, 4, 0)
+		data[section_offset + i * elf.SECTION_HEADER.size:section_offset + (i + 1) * elf.SECTION_HEADER.size] = header
+	
+	data[names_offset:names_offset + len(names)] = names
+
+def siteWord(site):
+	"""
+	Pick a plausible word for a site that is encoded from the old bytes
+	"""
+	
+	if (site.encode is arm64.mov):
+		return MOV_W0_1
+	
+	return CMP_W0_1
+
+def makeLibrary(game, version = None, seed = 0):
+	"""
+	Make the contents of a synthetic library for a game
+	"""
+	
+	rng = random.Random(seed)
+	size = librarySize(game)
+	
+	# Random words look enough like code, and don't make signatures ambiguous
+	data = bytearray(rng.randbytes(size))
+	writeHeaders(data, textEnd(game))
+	
+	for patch in game.patches.values():
+		for site in patch.sites:
+			if (site.original):
+				data[site.offset:site.offset + site.size] = site.original
+			elif (isinstance(site, Encode) and site.size == 4):
+				data[site.offset:site.offset + 4] = struct.pack("<I", siteWord(site))
+			elif (site.size == 4 and site.offset % 4 == 0):
+				data[site.offset:site.offset + 4] = struct.pack("<I", NOP)
+			else:
+				data[site.offset:site.offset + site.size] = bytes(site.size)
+	
+	version = (version or game.versions[-1]).encode("utf-8")
+	data[game.version_offset:game.version_offset + 8] = version + bytes(8 - len(version))
+	
+	return bytes(data)
+
+def writeLibraries(directory, seed = 0):
+	"""
+	Write a synthetic library for every supported build into a directory,
+	returning a dict of (game, version) to path
+	"""
+	
+	os.makedirs(directory, exist_ok = True)
+	paths = {}
+	
+	for game in GAMES.values():
+		for version in game.versions:
+			path = os.path.join(directory, f"{game.name}-{version}", game.library)
+			os.makedirs(os.path.dirname(path), exist_ok = True)
+			
+			with open(path, "wb") as f:
+				f.write(makeLibrary(game, version, seed))
+			
+			paths[(game.name, version)] = path
+	
+	return paths
+
+def fullPreset(game):
+	"""
+	Get a patches dict selecting every patch of a game
+	"""
+	
+	patches = {}
+	
+	for name in game.patches:
+		patches[name] = True
+		
+		if (name in VALUES):
+			patches[name + "_val"] = VALUES[name]
+	
+	return patches
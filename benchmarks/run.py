@@ -0,0 +1,218 @@
+"""
+Benchmark suite for the patchers
+
+Times every patch on its own, every game's full preset, batch throughput
+and cold start time on synthetic libraries, and writes the results as JSON
+so runs can be compared.
+
+Example:
+	python -m benchmarks.run -o results.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.fixtures import VALUES, fullPreset, writeLibraries
+from patchcore import VERSION, ui
+from patchcore.games import GAMES
+from patchcore.output import cloneFile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+class Quiet():
+	"""
+	Message backend that ignores the warnings patches show
+	"""
+	
+	def showinfo(self, title, message):
+		pass
+	
+	def showwarning(self, title, message):
+		pass
+	
+	def showerror(self, title, message):
+		pass
+
+def summarise(times):
+	"""
+	Get statistics (in milliseconds) for a list of times in seconds
+	"""
+	
+	times = sorted(times)
+	
+	return {
+		"runs": len(times),
+		"min_ms": times[0] * 1000,
+		"median_ms": times[len(times) // 2] * 1000,
+		"mean_ms": sum(times) / len(times) * 1000,
+		"max_ms": times[-1] * 1000,
+	}
+
+def timeApply(game, source, work, patches, repeat, again = False):
+	"""
+	Time applyPatches on fresh copies of a library, not counting the copy.
+	With again, the copy is patched once first, so re-applying is timed.
+	"""
+	
+	from patchcore import registry
+	
+	times = []
+	
+	for i in range(repeat):
+		cloneFile(source, work)
+		
+		if (again):
+			registry.applyPatches(game, work, patches)
+		
+		start = time.perf_counter()
+		registry.applyPatches(game, work, patches)
+		times.append(time.perf_counter() - start)
+	
+	return summarise(times)
+
+def benchPatches(paths, directory, repeat):
+	"""
+	Time each patch on its own and the full preset of each game
+	"""
+	
+	results = {}
+	
+	for ((name, version), source) in paths.items():
+		game = GAMES[name]
+		work = os.path.join(directory, "work.so")
+		build = {}
+		
+		for patch in game.patches:
+			patches = {patch: True}
+			
+			if (patch in VALUES):
+				patches[patch + "_val"] = VALUES[patch]
+			
+			build[patch] = timeApply(game, source, work, patches, repeat)
+		
+		build["(full preset)"] = timeApply(game, source, work, fullPreset(game), repeat)
+		build["(full preset, already applied)"] = timeApply(game, source, work, fullPreset(game), repeat, True)
+		results[f"{name} {version}"] = build
+	
+	return results
+
+def benchBatch(paths, directory, count, jobs):
+	"""
+	Time the batch CLI over many copies of each library
+	"""
+	
+	from patchcore.batch import runBatch
+	
+	results = {}
+	
+	for ((name, version), source) in paths.items():
+		game = GAMES[name]
+		batch_dir = os.path.join(directory, "batch")
+		shutil.rmtree(batch_dir, ignore_errors = True)
+		os.makedirs(batch_dir)
+		
+		files = []
+		
+		for i in range(count):
+			files.append(os.path.join(batch_dir, f"{i}.so"))
+			cloneFile(source, files[-1])
+			
+			# Make every file different, otherwise only one would be patched
+			with open(files[-1], "r+b") as f:
+				f.seek(-8, 2)
+				f.write(struct.pack("<Q", i))
+		
+		start = time.perf_counter()
+		failed = sum(not ok for (path, ok, message) in runBatch(name, fullPreset(game), files, jobs))
+		elapsed = time.perf_counter() - start
+		
+		results[f"{name} {version}"] = {
+			"files": count,
+			"failed": failed,
+			"seconds": elapsed,
+			"files_per_second": count / elapsed,
+		}
+	
+	shutil.rmtree(os.path.join(directory, "batch"), ignore_errors = True)
+	
+	return results
+
+def benchColdStart(repeat):
+	"""
+	Time starting a new interpreter and loading everything needed to patch
+	without the GUI
+	"""
+	
+	commands = {
+		"python": "pass",
+		"headless patching": "import patchcore.registry, patchcore.games",
+		"batch CLI": "import patchcore.batch",
+	}
+	
+	results = {}
+	
+	for (name, code) in commands.items():
+		times = []
+		
+		for i in range(repeat):
+			start = time.perf_counter()
+			subprocess.run([sys.executable, "-c", code], cwd = ROOT, check = True)
+			times.append(time.perf_counter() - start)
+		
+		results[name] = summarise(times)
+	
+	return results
+
+def main(argv = None):
+	parser = argparse.ArgumentParser(prog = "python -m benchmarks.run", description = "Benchmark the patchers on synthetic libraries.")
+	parser.add_argument("-o", "--output", default = None, help = "Write the results to this JSON file (default: print them)")
+	parser.add_argument("-r", "--repeat", type = int, default = 20, help = "Runs of each single file benchmark")
+	parser.add_argument("-n", "--batch-files", type = int, default = 64, help = "Files in each batch benchmark")
+	parser.add_argument("-j", "--jobs", type = int, default = None, help = "Worker processes for the batch benchmark")
+	args = parser.parse_args(argv)
+	
+	ui.setBackend(Quiet())
+	
+	with tempfile.TemporaryDirectory() as directory:
+		# Keep the benchmark away from the real cache
+		os.environ["MISC_TOOLS_CACHE"] = os.path.join(directory, "cache")
+		
+		paths = writeLibraries(os.path.join(directory, "libraries"))
+		
+		# Record the originals so the checks are part of what gets timed
+		from patchcore import verify
+		
+		for ((name, version), path) in paths.items():
+			verify.recordOriginals(GAMES[name], path)
+		
+		results = {
+			"version": VERSION,
+			"python": platform.python_version(),
+			"platform": platform.platform(),
+			"cpus": os.cpu_count(),
+			"time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+			"patches": benchPatches(paths, directory, args.repeat),
+			"batch": benchBatch(paths, directory, args.batch_files, args.jobs),
+			"cold_start": benchColdStart(max(args.repeat // 4, 3)),
+		}
+	
+	text = json.dumps(results, indent = "\t")
+	
+	if (args.output):
+		with open(args.output, "w") as f:
+			f.write(text)
+	else:
+		print(text)
+	
+	return 0
+
+if (__name__ == "__main__"):
+	sys.exit(main())
@@ -0,0 +1,50 @@
+"""
+Shared code for the Smash Hit, Commute and PinOut patcher tools
+"""
+
+import os
+
+VERSION = (0, 3, 0)
+
+def defaultCacheDir():
+	"""
+	Get the cache directory, which can be set with MISC_TOOLS_CACHE
+	"""
+	
+	if ("MISC_TOOLS_CACHE" in os.environ):
+		return os.environ["MISC_TOOLS_CACHE"]
+	
+	base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+	
+	return os.path.join(base, "misc-tools")
+
+def defaultConfigDir():
+	"""
+	Get the directory for settings like presets, which can be set with
+	MISC_TOOLS_CONFIG
+	"""
+	
+	if ("MISC_TOOLS_CONFIG" in os.environ):
+		return os.environ["MISC_TOOLS_CONFIG"]
+	
+	base = os.environ.get("XDG_CONFIG_HOME") or os.path.join(os.path.expanduser("~"), ".config")
+	
+	return os.path.join(base, "misc-tools")
+
+numpy = False
+
+def loadNumpy():
+	"""
+	Import NumPy the first time it is needed, since it is slow to import and
+	optional. Returns None if it isn't installed.
+	"""
+	
+	global numpy
+	
+	if (numpy is False):
+		try:
+			import numpy
+		except ImportError:
+			numpy = None
+	
+	return numpy
@@ -0,0 +1,316 @@
+"""
+Patching native libraries inside an APK without unpacking it
+
+The entries are found through the zip central directory. Only the patched
+library is decompressed and compressed again; every other entry is copied
+byte for byte (in the kernel where possible), so writing the new APK is
+about as fast as copying it. The APK signature is dropped since it no longer
+matches, so the new APK has to be signed again (for example with apksigner)
+before it can be installed.
+"""
+
+import contextlib
+import os
+import shutil
+import struct
+import zlib
+
+from patchcore.file import File
+from patchcore.output import atomicOutput, atomicPath, copyRange
+from patchcore import trace
+
+LOCAL_HEADER = struct.Struct("<4sHHHHHIIIHH")
+CENTRAL_RECORD = struct.Struct("<4sHHHHHHIIIHHHHHII")
+END_RECORD = struct.Struct("<4sHHHHIIH")
+
+LOCAL_SIGNATURE = b"PK\x03\x04"
+CENTRAL_SIGNATURE = b"PK\x01\x02"
+END_SIGNATURE = b"PK\x05\x06"
+DESCRIPTOR_SIGNATURE = b"PK\x07\x08"
+
+STORED = 0
+DEFLATED = 8
+
+# Entries after a replaced one are kept at the same offsets modulo this, so
+# uncompressed libraries stay page aligned like zipalign -p leaves them
+ALIGNMENT = 4096
+
+# Extra field zipalign uses for padding
+ALIGNMENT_EXTRA_ID = 0xd935
+
+ABI_DIR = "lib/arm64-v8a/"
+
+class Entry():
+	"""
+	A file in the archive, from its central directory record
+	"""
+	
+	def __init__(self, record, name):
+		self.record = record
+		self.name = name
+		
+		fields = CENTRAL_RECORD.unpack_from(record)
+		self.flags = fields[3]
+		self.method = fields[4]
+		self.crc = fields[7]
+		self.compressed_size = fields[8]
+		self.size = fields[9]
+		self.local_offset = fields[16]
+		
+		# Filled in from the local header
+		self.data_offset = None
+		self.end = None
+
+class Apk():
+	"""
+	An APK (or any zip file) opened for reading
+	"""
+	
+	def __init__(self, path):
+		self.path = path
+		self.file = open(path, "rb")
+		
+		try:
+			self.entries = self.readEntries()
+		except BaseException:
+			self.file.close()
+			raise
+		
+		self.names = {entry.name: entry for entry in self.entries}
+	
+	def __enter__(self):
+		return self
+	
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+	
+	def close(self):
+		self.file.close()
+	
+	def pread(self, length, offset):
+		data = os.pread(self.file.fileno(), length, offset)
+		
+		if (len(data) != length):
+			raise Exception(f"{self.path} ends part way through an entry.")
+		
+		return data
+	
+	def readEntries(self):
+		"""
+		Find the end of central directory record and read every entry in the
+		central directory
+		"""
+		
+		size = os.fstat(self.file.fileno()).st_size
+		
+		# The end record is at the end unless there is a comment (up to 64 KiB)
+		tail_size = min(size, END_RECORD.size + 0xffff)
+		tail = self.pread(tail_size, size - tail_size)
+		end = tail.rfind(END_SIGNATURE)
+		
+		if (end < 0 or end + END_RECORD.size > len(tail)):
+			raise Exception(f"{self.path} is not a valid APK or zip file.")
+		
+		fields = END_RECORD.unpack_from(tail, end)
+		count, directory_size, directory_offset = fields[4], fields[5], fields[6]
+		self.comment = tail[end + END_RECORD.size:end + END_RECORD.size + fields[7]]
+		
+		if (count == 0xffff or directory_offset == 0xffffffff):
+			raise Exception(f"{self.path} is a zip64 file, which isn't supported.")
+		
+		directory = self.pread(directory_size, directory_offset)
+		entries = []
+		offset = 0
+		
+		for i in range(count):
+			if (directory[offset:offset + 4] != CENTRAL_SIGNATURE):
+				raise Exception(f"The central directory of {self.path} is damaged.")
+			
+			fields = CENTRAL_RECORD.unpack_from(directory, offset)
+			length = CENTRAL_RECORD.size + fields[10] + fields[11] + fields[12]
+			name = directory[offset + CENTRAL_RECORD.size:offset + CENTRAL_RECORD.size + fields[10]]
+			entry = Entry(bytearray(directory[offset:offset + length]), name.decode("utf-8" if fields[3] & 0x800 else "cp437"))
+			
+			if (0xffffffff in (entry.compressed_size, entry.size, entry.local_offset)):
+				raise Exception(f"{entry.name} in {self.path} is a zip64 entry, which isn't supported.")
+			
+			self.readLocalHeader(entry)
+			entries.append(entry)
+			offset += length
+		
+		return entries
+	
+	def readLocalHeader(self, entry):
+		"""
+		Find where the data of an entry starts and where the entry ends
+		"""
+		
+		header = self.pread(LOCAL_HEADER.size, entry.local_offset)
+		fields = LOCAL_HEADER.unpack(header)
+		
+		if (fields[0] != LOCAL_SIGNATURE):
+			raise Exception(f"The local header of {entry.name} in {self.path} is damaged.")
+		
+		entry.data_offset = entry.local_offset + LOCAL_HEADER.size + fields[9] + fields[10]
+		entry.end = entry.data_offset + entry.compressed_size
+		
+		# The sizes can also come after the data, with or without a signature
+		if (entry.flags & 0x8):
+			entry.end += 16 if self.pread(4, entry.end) == DESCRIPTOR_SIGNATURE else 12
+	
+	def find(self, name):
+		"""
+		Get the entry with the given name
+		"""
+		
+		if (name not in self.names):
+			raise Exception(f"{self.path} doesn't contain {name}.")
+		
+		return self.names[name]
+	
+	def read(self, entry):
+		"""
+		Get the uncompressed data of an entry
+		"""
+		
+		data = self.pread(entry.compressed_size, entry.data_offset)
+		
+		if (entry.method == DEFLATED):
+			data = zlib.decompress(data, -15)
+		elif (entry.method != STORED):
+			raise Exception(f"{entry.name} uses compression method {entry.method}, which isn't supported.")
+		
+		if (zlib.crc32(data) != entry.crc):
+			raise Exception(f"{entry.name} in {self.path} is damaged (CRC mismatch).")
+		
+		return data
+	
+	def write(self, path, replacements, sync = False):
+		"""
+		Write a copy of the archive to path with the data of some entries
+		replaced, given as a dict of name to new uncompressed data. Other
+		entries are copied raw. With sync, the copy is synced to disk before it
+		is renamed to path.
+		"""
+		
+		for name in replacements:
+			self.find(name)
+		
+		with atomicPath(path) as temp:
+			# Unbuffered, since entries are also copied straight to the descriptor
+			with open(temp, "wb", buffering = 0) as out:
+				self.writeTo(out, replacements)
+				
+				if (sync):
+					os.fsync(out.fileno())
+			
+			shutil.copymode(self.path, temp)
+	
+	def writeTo(self, out, replacements):
+		src = self.file.fileno()
+		dst = out.fileno()
+		records = {entry.name: bytearray(entry.record) for entry in self.entries}
+		position = 0
+		
+		for entry in sorted(self.entries, key = lambda e: e.local_offset):
+			struct.pack_into("<I", records[entry.name], 42, position)
+			
+			if (entry.name not in replacements):
+				with trace.span("copy entry", entry = entry.name):
+					copyRange(src, dst, entry.local_offset, entry.end - entry.local_offset)
+				
+				position += entry.end - entry.local_offset
+				continue
+			
+			with trace.span("write entry", entry = entry.name):
+				position += self.writeEntry(out, entry, records[entry.name], replacements[entry.name], position)
+		
+		directory_offset = position
+		
+		for entry in self.entries:
+			out.write(records[entry.name])
+			position += len(records[entry.name])
+		
+		out.write(END_RECORD.pack(END_SIGNATURE, 0, 0, len(self.entries), len(self.entries), position - directory_offset, directory_offset, len(self.comment)))
+		out.write(self.comment)
+	
+	def writeEntry(self, out, entry, record, data, position):
+		"""
+		Write a replaced entry at position and update its central directory
+		record, returning how many bytes it took
+		"""
+		
+		crc = zlib.crc32(data)
+		
+		if (entry.method == DEFLATED):
+			compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+			compressed = compressor.compress(data) + compressor.flush()
+		elif (entry.method == STORED):
+			compressed = data
+		else:
+			raise Exception(f"{entry.name} uses compression method {entry.method}, which isn't supported.")
+		
+		header = bytearray(self.pread(entry.data_offset - entry.local_offset, entry.local_offset))
+		descriptor = b""
+		
+		if (entry.flags & 0x8):
+			descriptor = DESCRIPTOR_SIGNATURE + struct.pack("<III", crc, len(compressed), len(data))
+		else:
+			struct.pack_into("<III", header, 14, crc, len(compressed), len(data))
+		
+		# Pad the extra field so everything after this entry keeps its alignment
+		length = len(header) + len(compressed) + len(descriptor)
+		padding = (entry.end - position - length) % ALIGNMENT
+		
+		if (0 < padding < 6):
+			padding += ALIGNMENT
+		
+		if (padding):
+			extra_length = struct.unpack_from("<H", header, 28)[0] + padding
+			
+			if (extra_length > 0xffff):
+				raise Exception(f"The extra field of {entry.name} is too long to pad.")
+			
+			struct.pack_into("<H", header, 28, extra_length)
+			header += struct.pack("<HHH", ALIGNMENT_EXTRA_ID, padding - 4, ALIGNMENT) + bytes(padding - 6)
+		
+		out.write(header)
+		out.write(compressed)
+		out.write(descriptor)
+		
+		struct.pack_into("<III", record, 16, crc, len(compressed), len(data))
+		
+		return len(header) + len(compressed) + len(descriptor)
+
+def isApk(path):
+	"""
+	Check if a path looks like an APK by its name
+	"""
+	
+	return path.lower().endswith((".apk", ".zip"))
+
+@contextlib.contextmanager
+def openLibrary(path, library, output = None, sync = False):
+	"""
+	Open the ARM64 library with the given file name in an APK as an in-memory
+	patchcore.file.File. If the block finishes without an exception, the
+	writes are flushed and the APK is written to output (or back over path).
+	If nothing was written the APK is only copied to output, and left alone
+	if there is no output. With sync, the new APK is synced to disk.
+	"""
+	
+	name = ABI_DIR + library
+	
+	with Apk(path) as archive:
+		with trace.span("read library", entry = name):
+			data = archive.read(archive.find(name))
+		
+		with File.fromBuffer(data, f"{path}!/{name}") as f:
+			yield f
+		
+		if (f.written):
+			with trace.span("write apk"):
+				archive.write(output or path, {name: bytes(f.map)}, sync)
+		elif (output and os.path.abspath(output) != os.path.abspath(path)):
+			with atomicOutput(path, output):
+				pass
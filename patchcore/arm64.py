@@ -0,0 +1,295 @@
+"""
+Helpers for patching ARM64 instructions
+"""
+
+import struct
+
+from patchcore import loadNumpy
+
+def check_immediate_arm64(value, length):
+	"""
+	Make sure a value fits in an unsigned immediate field
+	"""
+	
+	if (value < 0 or value >= (1 << length)):
+		raise Exception(f"The value {value} doesn't fit in a {length}-bit immediate (0 to {(1 << length) - 1}).")
+
+def patch_const_instruction_arm64(old, value, length, zeros): # The instruction is in little-endian
+	check_immediate_arm64(value, length)
+	
+	mask = int("1"*length, 2) << zeros
+	
+	old = old & (~mask)
+	
+	new = value << zeros
+	
+	return (old | new)
+
+def patch_const_mov_instruction_arm64(old, value):
+	return patch_const_instruction_arm64(old, value, 16, 5)
+
+def patch_const_subs_instruction_arm64(old, value):
+	return patch_const_instruction_arm64(old, value, 12, 10)
+
+def patch_const_cmp_instruction_arm64(old, value):
+	return patch_const_instruction_arm64(old, value, 12, 10)
+
+def patch_const_instructions_arm64(old, values, length, zeros):
+	"""
+	Patch many instructions at once. old and values are arrays (or a single
+	word and an array of values, to make many variants of one instruction),
+	and an array of uint32 words is returned. Without NumPy this falls back to
+	a list of ints.
+	"""
+	
+	numpy = loadNumpy()
+	
+	if (numpy is None):
+		if (isinstance(old, int)):
+			return [patch_const_instruction_arm64(old, int(v), length, zeros) for v in values]
+		
+		return [patch_const_instruction_arm64(int(o), int(v), length, zeros) for (o, v) in zip(old, values)]
+	
+	old = numpy.asarray(old, dtype = numpy.uint32)
+	values = numpy.asarray(values, dtype = numpy.int64)
+	
+	if (values.size and (values.min() < 0 or values.max() >= (1 << length))):
+		bad = values[(values < 0) | (values >= (1 << length))]
+		raise Exception(f"{bad.size} of the values don't fit in a {length}-bit immediate (0 to {(1 << length) - 1}), for example {bad[0]}.")
+	
+	mask = numpy.uint32(((1 << length) - 1) << zeros)
+	
+	return (old & ~mask) | (values.astype(numpy.uint32) << numpy.uint32(zeros))
+
+def patch_const_mov_instructions_arm64(old, values):
+	return patch_const_instructions_arm64(old, values, 16, 5)
+
+def patch_const_subs_instructions_arm64(old, values):
+	return patch_const_instructions_arm64(old, values, 12, 10)
+
+def patch_const_cmp_instructions_arm64(old, values):
+	return patch_const_instructions_arm64(old, values, 12, 10)
+
+def words_arm64(data):
+	"""
+	Turn little endian bytes into an array of instruction words
+	"""
+	
+	numpy = loadNumpy()
+	
+	if (numpy is None):
+		return list(struct.unpack(f"<{len(data) // 4}I", data))
+	
+	return numpy.frombuffer(data, dtype = "<u4")
+
+def words_to_bytes_arm64(words):
+	"""
+	Turn an array of instruction words back into little endian bytes
+	"""
+	
+	numpy = loadNumpy()
+	
+	if (numpy is None):
+		return struct.pack(f"<{len(words)}I", *words)
+	
+	return numpy.asarray(words, dtype = "<u4").tobytes()
+
+# Encoders for registry sites, these take the value and the old bytes at the
+# site and return the new bytes.
+
+def mov(value, old):
+	return struct.pack("<I", patch_const_mov_instruction_arm64(struct.unpack("<I", old)[0], value))
+
+def subs(value, old):
+	return struct.pack("<I", patch_const_subs_instruction_arm64(struct.unpack("<I", old)[0], value))
+
+def cmp(value, old):
+	return struct.pack("<I", patch_const_cmp_instruction_arm64(struct.unpack("<I", old)[0], value))
+
+def u32(value, old):
+	return struct.pack("<I", value)
+
+def f32(value, old):
+	return struct.pack("<f", value)
+
+# Array versions of the encoders above, taking the old word and an array of
+# values, for encoding one site for many values at once
+
+MANY_ENCODERS = {
+	mov: patch_const_mov_instructions_arm64,
+	subs: patch_const_subs_instructions_arm64,
+	cmp: patch_const_cmp_instructions_arm64,
+}
+
+# The other way round, for reading values back out of patched libraries
+
+def get_const_instruction_arm64(word, length, zeros):
+	return (word >> zeros) & ((1 << length) - 1)
+
+def read_mov(data):
+	return get_const_instruction_arm64(struct.unpack("<I", data)[0], 16, 5)
+
+def read_subs(data):
+	return get_const_instruction_arm64(struct.unpack("<I", data)[0], 12, 10)
+
+def read_cmp(data):
+	return get_const_instruction_arm64(struct.unpack("<I", data)[0], 12, 10)
+
+def read_u32(data):
+	return struct.unpack("<I", data)[0]
+
+def read_f32(data):
+	return struct.unpack("<f", data)[0]
+
+# Immediate fields as (mask, value, [(length, zeros), ...]) for instruction
+# classes, using the same length/zeros as patch_const_instruction_arm64. These
+# are the parts of an instruction that change between builds when code or
+# data moves around.
+IMMEDIATE_FIELDS = [
+	(0x7c000000, 0x14000000, [(26, 0)]), # B, BL
+	(0xff000010, 0x54000000, [(19, 5)]), # B.cond
+	(0x7e000000, 0x34000000, [(19, 5)]), # CBZ, CBNZ
+	(0x7e000000, 0x36000000, [(14, 5)]), # TBZ, TBNZ
+	(0x1f000000, 0x10000000, [(19, 5), (2, 29)]), # ADR, ADRP
+	(0x3b000000, 0x18000000, [(19, 5)]), # LDR (literal)
+	(0x1f800000, 0x12800000, [(16, 5)]), # MOVN, MOVZ, MOVK
+	(0x1f000000, 0x11000000, [(12, 10)]), # ADD, ADDS, SUB, SUBS (immediate), CMP
+	(0x3b000000, 0x39000000, [(12, 10)]), # LDR, STR (unsigned offset)
+]
+
+# The immediate field each encoder writes, as (length, zeros)
+ENCODER_FIELDS = {
+	mov: (16, 5),
+	subs: (12, 10),
+	cmp: (12, 10),
+}
+
+def immediate_fields_arm64(word):
+	"""
+	Get the (length, zeros) of each immediate field of an instruction
+	"""
+	
+	for (mask, value, fields) in IMMEDIATE_FIELDS:
+		if ((word & mask) == value):
+			return fields
+	
+	return []
+
+def immediate_mask_arm64(word):
+	"""
+	Get a mask of the bits of an instruction that aren't immediate fields
+	"""
+	
+	result = 0xffffffff
+	
+	for (length, zeros) in immediate_fields_arm64(word):
+		result &= ~(int("1"*length, 2) << zeros)
+	
+	return result & 0xffffffff
+
+# Instruction classes the patches write, as (mask, value, name). Each entry
+# is also put in DECODE_TABLE under every top byte it can have, so decoding
+# a word only tries the few classes that share its top byte.
+INSTRUCTION_CLASSES = [
+	(0xffffffff, 0xd503201f, "nop"),
+	(0xfffffc1f, 0xd65f0000, "ret"),
+	(0xfc000000, 0x14000000, "b"),
+	(0xfc000000, 0x94000000, "bl"),
+	(0x7f800000, 0x52800000, "movz"),
+	(0x7f800000, 0x12800000, "movn"),
+	(0x7f800000, 0x72800000, "movk"),
+	(0x7fe0ffe0, 0x2a0003e0, "mov"), # ORR with the zero register
+	(0x7f800000, 0x71000000, "subs"), # Also CMP (immediate)
+	(0x7f200000, 0x6b000000, "subs"), # Also CMP (shifted register)
+	(0x7f800000, 0x11000000, "add"),
+	(0x7fe0fc00, 0x1b007c00, "mul"), # MADD with the zero register
+	(0x3b000000, 0x18000000, "ldr"), # Literal
+	(0xffc00000, 0x39000000, "strb"), # Unsigned offset
+]
+
+DECODE_TABLE = [[(mask, value, name) for (mask, value, name) in INSTRUCTION_CLASSES if ((top << 24) & mask & 0xff000000) == (value & 0xff000000)] for top in range(256)]
+
+# Size of the value loaded by LDR (literal), by (V, opc); 0 is PRFM
+LITERAL_SIZES = {(0, 0): 4, (0, 1): 8, (0, 2): 4, (0, 3): 0, (1, 0): 4, (1, 1): 8, (1, 2): 16}
+
+def decode_arm64(word):
+	"""
+	Get the name of the instruction class a word is in, or None if it isn't
+	one of INSTRUCTION_CLASSES
+	"""
+	
+	for (mask, value, name) in DECODE_TABLE[word >> 24]:
+		if ((word & mask) == value):
+			return name
+	
+	return None
+
+def sign_extend_arm64(value, length):
+	return value - (1 << length) if value & (1 << (length - 1)) else value
+
+def target_arm64(word):
+	"""
+	Get the (kind, offset from the instruction, size) of what an instruction
+	refers to: ("code", offset, 4) for B and BL, ("data", offset, size) for
+	LDR (literal), or None for anything else
+	"""
+	
+	if ((word & 0x7c000000) == 0x14000000):
+		return ("code", sign_extend_arm64(word & 0x3ffffff, 26) * 4, 4)
+	
+	if ((word & 0x3b000000) == 0x18000000):
+		return ("data", sign_extend_arm64((word >> 5) & 0x7ffff, 19) * 4, LITERAL_SIZES.get(((word >> 26) & 1, word >> 30), 0))
+	
+	return None
+
+def retarget_arm64(word, offset):
+	"""
+	Change what a B, BL or LDR (literal) refers to, to offset from the
+	instruction, returning None if it can't reach that far
+	"""
+	
+	if (offset % 4):
+		return None
+	
+	if ((word & 0x7c000000) == 0x14000000):
+		length, zeros = (26, 0)
+	elif ((word & 0x3b000000) == 0x18000000):
+		length, zeros = (19, 5)
+	else:
+		return None
+	
+	if (not -(1 << (length + 1)) <= offset < (1 << (length + 1))):
+		return None
+	
+	mask = ((1 << length) - 1) << zeros
+	
+	return (word & ~mask & 0xffffffff) | (((offset >> 2) << zeros) & mask)
+
+def targets_arm64(words, address):
+	"""
+	Find the B, BL and LDR (literal) instructions in an array of words loaded
+	at address, returning arrays of their indexes, target addresses and
+	whether they refer to code (True) or data (False). Without NumPy these
+	are lists.
+	"""
+	
+	numpy = loadNumpy()
+	
+	if (numpy is None):
+		found = [(i, target_arm64(word)) for (i, word) in enumerate(words)]
+		found = [(i, target) for (i, target) in found if target]
+		
+		return ([i for (i, target) in found], [address + i * 4 + target[1] for (i, target) in found], [target[0] == "code" for (i, target) in found])
+	
+	words = numpy.asarray(words, dtype = numpy.uint32)
+	branch = (words & 0x7c000000) == 0x14000000
+	literal = (words & 0x3b000000) == 0x18000000
+	indexes = numpy.flatnonzero(branch | literal)
+	
+	words = words[indexes].astype(numpy.int64)
+	code = branch[indexes]
+	
+	# Sign extend imm26 or imm19 by flipping the sign bit and subtracting it
+	offsets = numpy.where(code, ((words & 0x3ffffff) ^ 0x2000000) - 0x2000000, (((words >> 5) & 0x7ffff) ^ 0x40000) - 0x40000) * 4
+	
+	return (indexes, address + indexes * 4 + offsets, code)
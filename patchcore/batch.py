@@ -0,0 +1,265 @@
+"""
+Headless batch patching of many game libraries at once
+
+Example:
+	python -m patchcore.batch -p antitamper -p checkpoints=26 mods/*/libsmashhit.so
+	python -m patchcore.batch --signatures smashhit.sig.json -p antitamper libsmashhit-new.so
+"""
+
+import argparse
+import concurrent.futures
+import contextlib
+import glob
+import os
+import sys
+
+from patchcore.cache import Cache, PlanCache, defaultCacheDir
+from patchcore.file import fileDigest
+from patchcore.fingerprint import defaultIndex, gameFor
+from patchcore.games import GAMES
+from patchcore.presets import loadPreset
+from patchcore.trace import Tracer
+from patchcore import registry, signature, trace
+
+def expandInputs(items):
+	"""
+	Expand globs and directories into a sorted list of unique .so and .apk
+	files
+	"""
+	
+	paths = []
+	
+	for item in items:
+		if (os.path.isdir(item)):
+			paths += glob.glob(os.path.join(item, "**", "*.so"), recursive = True)
+			paths += glob.glob(os.path.join(item, "**", "*.apk"), recursive = True)
+		elif (glob.has_magic(item)):
+			paths += glob.glob(item, recursive = True)
+		else:
+			paths.append(item)
+	
+	return sorted(set(os.path.abspath(p) for p in paths))
+
+def hashInput(path):
+	"""
+	Get the (digest, None) of a file, or (None, error message) if it can't be
+	read, so one bad input doesn't stop the others
+	"""
+	
+	try:
+		return (fileDigest(path), None)
+	except OSError as e:
+		return (None, str(e))
+
+def patchGroup(game, patches, paths, outputs, cache_dir = None, cache_link = False, journal = False, plans = False, sync = False, signatures = None):
+	"""
+	Patch a group of files that all have the same contents. Only the first one
+	goes through applyPatches (and its version check), the plan it used is
+	then replayed on the rest. With journal, undo journals are stored, and
+	with plans, compiled plans are reused (see patchcore.presets). With
+	sync, every patched file is synced to disk before it counts as done.
+	signatures is a loaded signature file, used to find the sites in builds
+	the game doesn't know the version of (see patchcore.signature).
+	"""
+	
+	results = []
+	cache = Cache(cache_dir, link = cache_link) if cache_dir else None
+	
+	try:
+		target = signature.gameForBuild(GAMES[game], paths[0], signatures, cache_dir)
+		
+		# Plans are stored by version, which doesn't tell relocated builds apart
+		plans = PlanCache(cache_dir) if (plans and target is GAMES[game]) else None
+		plan = registry.applyPatches(target, paths[0], patches, outputs[0], cache, journal = journal, plans = plans, sync = sync)
+	except Exception as e:
+		return [(path, False, str(e)) for path in paths]
+	finally:
+		if (cache):
+			cache.saveStats()
+	
+	# The other files have the same contents, so the same thing happens to them
+	message = plan.summary() or f"{len(plan)} writes (cached)"
+	
+	# A rejected value means the file didn't get everything asked for
+	ok = not plan.skipped
+	
+	if (plan.skipped):
+		message += f"; not applied because their values were rejected: {', '.join(plan.skipped)}"
+	
+	results.append((paths[0], ok, message))
+	
+	for (path, output) in zip(paths[1:], outputs[1:]):
+		try:
+			registry.writePlan(plan, path, output, library = GAMES[game].library, journal = journal, sync = sync)
+			results.append((path, ok, message))
+		except Exception as e:
+			results.append((path, False, str(e)))
+	
+	return results
+
+def tracedGroup(*args):
+	"""
+	Run patchGroup under a tracer, returning its results and the trace
+	"""
+	
+	with Tracer() as tracer:
+		results = patchGroup(*args)
+	
+	return (results, tracer.toDict())
+
+def outputPaths(paths, output_dir = None, copy_on_write = False):
+	"""
+	Work out where each patched file goes. With an output directory the
+	layout under the inputs' common directory is kept, with copy on write the
+	inputs are replaced atomically, and otherwise they are patched in place.
+	"""
+	
+	if (output_dir):
+		base = os.path.commonpath([os.path.dirname(p) for p in paths])
+		return [os.path.join(output_dir, os.path.relpath(p, base)) for p in paths]
+	
+	if (copy_on_write):
+		return list(paths)
+	
+	return [None] * len(paths)
+
+def runBatch(game, patches, paths, jobs = None, outputs = None, cache_dir = None, cache_link = False, journal = False, tracer = None, plans = False, sync = False, signatures = None):
+	"""
+	Patch all of the given files using a process pool, yielding a
+	(path, success, message) tuple for each file as it finishes. If game is
+	None it is detected for each file, and files that can't be detected are
+	taken to be for the game of signatures if it is given. If a
+	patchcore.trace.Tracer is given, the traces from the workers are merged
+	into it.
+	"""
+	
+	outputs = dict(zip(paths, outputs or [None] * len(paths)))
+	
+	with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+		# Group the files by their contents, so each distinct input is only
+		# checked and patched from scratch once
+		groups = {}
+		
+		with trace.span("hash inputs", files = len(paths)):
+			for (path, (digest, error)) in zip(paths, pool.map(hashInput, paths, chunksize = 4)):
+				if (error):
+					yield (path, False, error)
+				else:
+					groups.setdefault(digest, []).append(path)
+		
+		futures = []
+		index = defaultIndex() if game is None else None
+		
+		for (digest, group) in groups.items():
+			# Work out the game once per distinct input if it wasn't given
+			try:
+				group_game = game or gameFor(group[0], index, digest).name
+			except Exception as e:
+				if (not signatures):
+					yield from [(path, False, str(e)) for path in group]
+					continue
+				
+				group_game = signatures["game"]
+			
+			unknown = [p for p in registry.selected(patches) if p not in GAMES[group_game].patches]
+			
+			if (unknown):
+				yield from [(path, False, f"{group_game} doesn't have the patches {', '.join(unknown)}") for path in group]
+				continue
+			
+			futures.append(pool.submit(tracedGroup if tracer else patchGroup, group_game, patches, group, [outputs[p] for p in group], cache_dir, cache_link, journal, plans, sync, signatures))
+		
+		if (index):
+			index.save()
+		
+		for future in concurrent.futures.as_completed(futures):
+			if (tracer):
+				results, info = future.result()
+				tracer.merge(info)
+				yield from results
+			else:
+				yield from future.result()
+
+def main(argv = None):
+	parser = argparse.ArgumentParser(prog = "python -m patchcore.batch", description = "Patch many game libraries without the GUI.")
+	parser.add_argument("-g", "--game", default = None, choices = list(GAMES), help = "Which game the libraries are for (default: detect it)")
+	parser.add_argument("-p", "--patch", action = "append", default = [], metavar = "NAME[=VALUE]", help = "A patch to apply, with an optional value (can be given many times)")
+	parser.add_argument("--preset", default = None, help = "A saved preset (name or path) to apply; -p adds to it. Its compiled writes are reused for builds it has been used on before.")
+	parser.add_argument("-j", "--jobs", type = int, default = None, help = "Number of worker processes (default: number of cores)")
+	parser.add_argument("-o", "--output-dir", default = None, help = "Write patched copies here instead of changing the inputs")
+	parser.add_argument("--copy-on-write", action = "store_true", help = "Write each patched file to a new copy and rename it over the input")
+	parser.add_argument("--cache", action = "store_true", help = "Reuse patched outputs from the shared cache")
+	parser.add_argument("--cache-dir", default = None, help = "Cache directory to use (implies --cache)")
+	parser.add_argument("--cache-link", action = "store_true", help = "Hardlink outputs to the cache instead of copying them")
+	parser.add_argument("--journal", action = "store_true", help = "Store undo journals so the patches can be reverted with patchcore.journal")
+	parser.add_argument("--sync", action = "store_true", help = "Sync each patched file to disk before reporting it (slower, but safe against power loss)")
+	parser.add_argument("--signatures", default = None, metavar = "FILE", help = "Find the patch sites in builds of unknown versions with this signature file (see patchcore.signature)")
+	parser.add_argument("--trace", default = None, metavar = "PREFIX", help = "Write a timing summary to PREFIX.summary.json and a Chrome trace to PREFIX.trace.json")
+	parser.add_argument("files", nargs = "+", help = "Library files, globs or directories to search for .so files")
+	args = parser.parse_args(argv)
+	
+	patches = registry.parseSelection(args.patch)
+	
+	if (args.preset):
+		try:
+			preset = loadPreset(args.preset)
+		except Exception as e:
+			parser.error(str(e))
+		
+		patches = {**preset.patches, **patches}
+		args.game = args.game or preset.game
+	
+	signatures = None
+	
+	if (args.signatures):
+		try:
+			signatures = signature.loadSignatures(args.signatures)
+		except Exception as e:
+			parser.error(str(e))
+		
+		if (args.game and args.game != signatures["game"]):
+			parser.error(f"the signatures are for {signatures['game']}, not {args.game}")
+	
+	known = GAMES[args.game].patches if args.game else set().union(*(game.patches for game in GAMES.values()))
+	unknown = [p for p in registry.selected(patches) if p not in known]
+	
+	if (unknown):
+		parser.error(f"unknown patches: {', '.join(unknown)}")
+	
+	paths = expandInputs(args.files)
+	
+	if (not paths):
+		parser.error("no input files found")
+	
+	outputs = outputPaths(paths, args.output_dir, args.copy_on_write)
+	
+	for output in outputs:
+		if (output):
+			os.makedirs(os.path.dirname(output), exist_ok = True)
+	
+	cache_dir = args.cache_dir or (defaultCacheDir() if (args.cache or args.cache_link) else None)
+	
+	if (cache_dir):
+		stats = Cache(cache_dir).saveStats()
+	
+	failed = 0
+	tracer = Tracer() if args.trace else None
+	
+	with (tracer or contextlib.nullcontext()):
+		for (path, ok, message) in runBatch(args.game, patches, paths, args.jobs, outputs, cache_dir, args.cache_link, args.journal, tracer, bool(args.preset), args.sync, signatures):
+			print(f"{'OK' if ok else 'FAILED'}\t{path}\t{message}")
+			failed += not ok
+	
+	if (tracer):
+		tracer.save(args.trace + ".summary.json", args.trace + ".trace.json")
+	
+	print(f"{len(paths) - failed} of {len(paths)} files patched", file = sys.stderr)
+	
+	if (cache_dir):
+		total = Cache(cache_dir).saveStats()
+		print(f"Cache: {total['hits'] - stats['hits']} hits, {total['misses'] - stats['misses']} misses", file = sys.stderr)
+	
+	return 1 if failed else 0
+
+if (__name__ == "__main__"):
+	sys.exit(main())
@@ -0,0 +1,292 @@
+"""
+Content addressed cache of patched libraries
+
+Outputs are stored by a key made from the input file's digest, the selected
+patches and their values, and the tool version, so rebuilding the same
+library with the same preset just copies (or hardlinks) the stored result.
+The cache is shared by all of the tools and kept under a size limit by
+removing the least recently used entries.
+"""
+
+import copy
+import filecmp
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+try:
+	import fcntl
+except ImportError:
+	fcntl = None
+
+from patchcore import VERSION, defaultCacheDir
+from patchcore.output import atomicPath, cloneFile
+from patchcore.registry import Plan, selected
+
+DEFAULT_MAX_SIZE = 512 * 1024 * 1024
+
+def normalise(patches):
+	"""
+	Get the parts of a patches dict that affect the output: the selected
+	patches and their values as strings. Values are kept as given, since
+	the parsers don't all strip them.
+	"""
+	
+	result = {}
+	
+	for name in selected(patches):
+		result[name] = True
+		value = patches.get(name + "_val", None)
+		
+		if (value is not None):
+			result[name + "_val"] = str(value)
+	
+	return result
+
+class Cache():
+	"""
+	A cache directory
+	
+	Entries are made read-only, since with link = True outputs are hardlinks
+	to them and patching one in place would otherwise change the cache.
+	"""
+	
+	def __init__(self, root = None, max_size = DEFAULT_MAX_SIZE, link = False):
+		self.root = root or defaultCacheDir()
+		self.max_size = max_size
+		self.link = link
+		self.hits = 0
+		self.misses = 0
+		
+		os.makedirs(os.path.join(self.root, "objects"), exist_ok = True)
+	
+	def key(self, game, digest, patches):
+		"""
+		Get the key for a game library with the given digest and patches
+		"""
+		
+		info = json.dumps([game, digest, normalise(patches), VERSION], sort_keys = True)
+		
+		return hashlib.sha256(info.encode("utf-8")).hexdigest()
+	
+	def path(self, key):
+		return os.path.join(self.root, "objects", key[:2], key)
+	
+	def fetch(self, key, dest, source = None):
+		"""
+		Put the stored output for a key at dest, returning its plan, or None if
+		it isn't cached. A copy gets the mode of source (the input file) if
+		given.
+		"""
+		
+		path = self.path(key)
+		
+		try:
+			with open(path + ".json", "r") as f:
+				plan = Plan.fromJSON(f.read())
+			
+			# Mark as recently used
+			os.utime(path)
+			
+			self._place(path, dest, source)
+		except FileNotFoundError:
+			self.misses += 1
+			return None
+		
+		self.hits += 1
+		
+		return plan
+	
+	def _place(self, path, dest, source = None):
+		"""
+		Atomically put a copy of (or a link to) path at dest, with the mode of
+		source, or of dest if there is no source. A dest that already has the
+		same bytes is left alone, so its mtime doesn't change.
+		"""
+		
+		try:
+			if (os.path.samefile(path, dest) or filecmp.cmp(path, dest, shallow = False)):
+				return
+		except FileNotFoundError:
+			pass
+		
+		fd, temp = tempfile.mkstemp(prefix = ".", suffix = ".tmp", dir = os.path.dirname(os.path.abspath(dest)))
+		os.close(fd)
+		
+		try:
+			if (self.link):
+				os.unlink(temp)
+				os.link(path, temp)
+			else:
+				cloneFile(path, temp)
+				mode = source or (dest if os.path.exists(dest) else None)
+				
+				if (mode):
+					shutil.copymode(mode, temp)
+				else:
+					os.chmod(temp, 0o644)
+			
+			os.replace(temp, dest)
+		except BaseException:
+			if (os.path.exists(temp)):
+				os.unlink(temp)
+			
+			raise
+	
+	def store(self, key, src, plan):
+		"""
+		Store a patched file and the plan used to make it
+		"""
+		
+		path = self.path(key)
+		os.makedirs(os.path.dirname(path), exist_ok = True)
+		
+		fd, temp = tempfile.mkstemp(prefix = ".", suffix = ".tmp", dir = os.path.dirname(path))
+		os.close(fd)
+		
+		try:
+			cloneFile(src, temp)
+			os.chmod(temp, 0o444)
+			os.replace(temp, path)
+			
+			with open(temp, "w") as f:
+				f.write(plan.toJSON())
+			
+			os.replace(temp, path + ".json")
+		except BaseException:
+			if (os.path.exists(temp)):
+				os.unlink(temp)
+			
+			raise
+		
+		self.evict()
+	
+	def entries(self):
+		"""
+		List the (last used time, size, path) of every stored output
+		"""
+		
+		result = []
+		
+		for (directory, dirs, files) in os.walk(os.path.join(self.root, "objects")):
+			for name in files:
+				if (name.startswith(".") or name.endswith(".json")):
+					continue
+				
+				path = os.path.join(directory, name)
+				
+				try:
+					info = os.stat(path)
+				except FileNotFoundError:
+					continue
+				
+				result.append((info.st_mtime, info.st_size, path))
+		
+		return result
+	
+	def evict(self):
+		"""
+		Remove the least recently used entries until the cache fits in max_size
+		"""
+		
+		entries = sorted(self.entries())
+		total = sum(size for (used, size, path) in entries)
+		
+		for (used, size, path) in entries:
+			if (total <= self.max_size):
+				break
+			
+			for p in (path, path + ".json"):
+				try:
+					os.unlink(p)
+				except FileNotFoundError:
+					pass
+			
+			total -= size
+	
+	def saveStats(self):
+		"""
+		Add this instance's hit and miss counts to the totals stored in the
+		cache directory, and return the totals. Batch workers save at the same
+		time, so the totals are updated under a lock and replaced atomically.
+		"""
+		
+		path = os.path.join(self.root, "stats.json")
+		
+		with open(os.path.join(self.root, "stats.lock"), "a") as lock:
+			if (fcntl):
+				fcntl.flock(lock, fcntl.LOCK_EX)
+			
+			try:
+				with open(path, "r") as f:
+					stats = json.load(f)
+			except (FileNotFoundError, ValueError):
+				stats = {"hits": 0, "misses": 0}
+			
+			stats["hits"] += self.hits
+			stats["misses"] += self.misses
+			self.hits = self.misses = 0
+			
+			with atomicPath(path) as temp:
+				with open(temp, "w") as f:
+					json.dump(stats, f)
+		
+		return stats
+
+class PlanCache():
+	"""
+	Compiled plans, stored by game, build version, patches and tool version
+	
+	A plan only depends on the build and the patches, so once a set of
+	patches has been compiled for a build, applying it again to any copy of
+	that build can replay the stored writes without parsing values or
+	showing warnings. With memory, plans are also kept in memory once they
+	have been loaded, for long running processes.
+	"""
+	
+	def __init__(self, root = None, memory = False):
+		self.root = os.path.join(root or defaultCacheDir(), "plans")
+		self.memory = {} if memory else None
+	
+	def path(self, game, version, patches):
+		info = json.dumps([game, version, normalise(patches), VERSION], sort_keys = True)
+		
+		return os.path.join(self.root, hashlib.sha256(info.encode("utf-8")).hexdigest() + ".json")
+	
+	def fetch(self, game, version, patches):
+		"""
+		Get the stored plan, or None if it hasn't been compiled yet
+		"""
+		
+		path = self.path(game, version, patches)
+		
+		if (self.memory is not None and path in self.memory):
+			# Callers set the status on the plan they get, so each gets its own
+			return copy.copy(self.memory[path])
+		
+		try:
+			with open(path, "r") as f:
+				plan = Plan.fromJSON(f.read())
+		except FileNotFoundError:
+			return None
+		
+		if (self.memory is not None):
+			self.memory[path] = plan
+		
+		return copy.copy(plan) if self.memory is not None else plan
+	
+	def store(self, game, version, patches, plan):
+		path = self.path(game, version, patches)
+		os.makedirs(self.root, exist_ok = True)
+		
+		fd, temp = tempfile.mkstemp(prefix = ".", suffix = ".tmp", dir = self.root)
+		
+		with os.fdopen(fd, "w") as f:
+			f.write(plan.toJSON())
+		
+		os.replace(temp, path)
+		
+		if (self.memory is not None):
+			self.memory[path] = copy.copy(plan)
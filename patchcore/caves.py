@@ -0,0 +1,281 @@
+"""
+Finding spare space in a library for patches that need it
+
+Patches that add constants or trampolines need bytes nothing else uses, like
+the two unused NOPs the sprites patch keeps its floats in. A cave is a run of
+NOPs or zero bytes inside a section, or padding between sections that is
+still loaded. Sections are scanned straight out of the memory map with NumPy
+(or regular expressions without it), so a whole library takes milliseconds.
+
+The caves of each build are kept in the cache directory, and an Allocator
+hands out pieces of them that never overlap each other or any patch site.
+
+Example:
+	python -m patchcore.caves libsmashhit.so
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+from patchcore.elf import HEADER, PF_X, PROGRAM_HEADER, SHF_EXECINSTR, Elf
+from patchcore.file import File
+from patchcore.output import atomicPath
+from patchcore import defaultCacheDir, loadNumpy
+
+NOP = 0xd503201f
+
+# Kinds of cave, safest first, which is the order they are allocated in.
+# Padding isn't part of any section, NOPs are never run (or do nothing if
+# they are), and zero bytes could still be data that happens to be zero.
+KINDS = ("padding", "nop", "zero")
+
+# Builds are scanned down to this size once, and the cached caves filtered
+SCAN_MIN_SIZE = 8
+
+class Cave():
+	"""
+	A run of free bytes at a file offset, and the address it is loaded at
+	"""
+	
+	def __init__(self, offset, size, kind, executable, address):
+		self.offset = offset
+		self.size = size
+		self.kind = kind
+		self.executable = executable
+		self.address = address
+	
+	def __repr__(self):
+		return f"Cave({hex(self.offset)}, {self.size}, {self.kind!r}, {self.executable})"
+	
+	def toList(self):
+		return [self.offset, self.size, self.kind, self.executable, self.address]
+
+def findRuns(data, word, min_size):
+	"""
+	Get the (start, end) of every run of an aligned 32-bit word in a buffer
+	whose length is a multiple of 4 that is at least min_size bytes long
+	"""
+	
+	numpy = loadNumpy()
+	
+	if (numpy is None):
+		pattern = word.to_bytes(4, "little")
+		runs = []
+		
+		if (len(set(pattern)) == 1):
+			# Runs of one byte, trimmed to whole words
+			for match in re.finditer(re.escape(pattern[:1]) + b"+", data):
+				start = match.start() + -match.start() % 4
+				runs.append((start, start + (match.end() - start) // 4 * 4))
+		else:
+			# Other patterns (like NOP) can't overlap themselves, so an
+			# unaligned match is never part of an aligned run
+			runs = [match.span() for match in re.finditer(b"(?:" + re.escape(pattern) + b")+", data) if match.start() % 4 == 0]
+	else:
+		# Mark where each word matches, then find the edges of the runs
+		words = numpy.frombuffer(data, dtype = "<u4")
+		found = numpy.zeros(len(words) + 2, dtype = numpy.int8)
+		found[1:-1] = words == word
+		del words
+		
+		edges = numpy.diff(found)
+		runs = zip((numpy.flatnonzero(edges == 1) * 4).tolist(), (numpy.flatnonzero(edges == -1) * 4).tolist())
+	
+	return [(start, end) for (start, end) in runs if end - start >= min_size]
+
+def findCaves(f, min_size = 16):
+	"""
+	Find every cave of at least min_size bytes in an ELF library, sorted by
+	offset. Code sections are searched for NOPs and zeros, and .rodata for
+	zeros; other data sections are left alone since the loader fills in
+	zeros in them.
+	"""
+	
+	layout = Elf(f)
+	sections = layout.getSections()
+	
+	if (not sections):
+		raise Exception(f"{f.path} has no section headers, so its caves can't be found.")
+	
+	caves = []
+	
+	with memoryview(f.map) as view:
+		for section in sections:
+			executable = bool(section.flags & SHF_EXECINSTR)
+			
+			if (layout.offsetToAddress(section.offset) is None or not (executable or section.name.startswith(".rodata"))):
+				continue
+			
+			# Code is only ever split between instructions
+			start = section.offset + -section.offset % 4
+			
+			with view[start:section.end - (section.end - start) % 4] as data:
+				runs = [(a, b, "nop") for (a, b) in findRuns(data, NOP, min_size)] if executable else []
+				runs += [(a, b, "zero") for (a, b) in findRuns(data, 0, min_size)]
+			
+			for (a, b, kind) in runs:
+				caves.append(Cave(start + a, b - a, kind, executable, layout.offsetToAddress(start + a)))
+	
+	# Bytes in a loaded segment that no section covers, after the headers
+	headers = max(HEADER.size, layout.program_offset + layout.program_count * PROGRAM_HEADER.size)
+	
+	for segment in layout.getSegments():
+		position = max(segment.offset, headers)
+		end = segment.offset + segment.file_size
+		gaps = []
+		
+		for section in sections:
+			if (section.offset >= end):
+				break
+			
+			gaps.append((position, section.offset))
+			position = max(position, section.end)
+		
+		gaps.append((position, end))
+		
+		for (start, stop) in gaps:
+			if (stop - start >= min_size):
+				caves.append(Cave(start, stop - start, "padding", bool(segment.flags & PF_X), segment.address + start - segment.offset))
+	
+	return sorted(caves, key = lambda c: c.offset)
+
+def cavesPath(game, version):
+	return os.path.join(defaultCacheDir(), "caves", f"{game}-{version}.json")
+
+def cavesFor(game, f, min_size = 16):
+	"""
+	Get the caves of a game library, from the cache if this build has been
+	scanned before. Bytes any of the game's patches write to are left out,
+	so the caves are the same whether the library is patched or not.
+	"""
+	
+	version = game.checkVersion(f)
+	path = cavesPath(game.name, version)
+	
+	try:
+		with open(path, "r") as cache:
+			caves = [Cave(*info) for info in json.load(cache)]
+	except (FileNotFoundError, ValueError):
+		caves = findCaves(f, SCAN_MIN_SIZE)
+		os.makedirs(os.path.dirname(path), exist_ok = True)
+		
+		with atomicPath(path) as temp:
+			with open(temp, "w") as cache:
+				json.dump([cave.toList() for cave in caves], cache)
+	
+	allocator = Allocator(caves)
+	
+	for (start, end, name, site) in game.locate(f).index.sites:
+		allocator.reserve(start, end - start)
+	
+	return [cave for cave in allocator.caves if cave.size >= min_size]
+
+def allocatorFor(game, f, min_size = SCAN_MIN_SIZE):
+	"""
+	Get an Allocator for the caves of a game library
+	"""
+	
+	return Allocator(cavesFor(game, f, min_size))
+
+class Allocator():
+	"""
+	Hands out pieces of a list of caves that never overlap. Allocations are
+	first fit in the order of KINDS and then by offset, so the same requests
+	in the same order always get the same offsets.
+	"""
+	
+	def __init__(self, caves):
+		self.caves = sorted(caves, key = lambda c: c.offset)
+		self.allocations = {}
+	
+	def reserve(self, offset, size):
+		"""
+		Take a range out of the caves, for bytes something else uses
+		"""
+		
+		end = offset + size
+		result = []
+		
+		for cave in self.caves:
+			cave_end = cave.offset + cave.size
+			
+			if (cave_end <= offset or cave.offset >= end):
+				result.append(cave)
+				continue
+			
+			if (cave.offset < offset):
+				result.append(Cave(cave.offset, offset - cave.offset, cave.kind, cave.executable, cave.address))
+			
+			if (cave_end > end):
+				result.append(Cave(end, cave_end - end, cave.kind, cave.executable, cave.address + end - cave.offset))
+		
+		self.caves = result
+	
+	def allocate(self, size, align = 4, executable = False, name = None, kinds = KINDS):
+		"""
+		Get a Cave of size bytes, aligned to align, that hasn't been given out
+		before. With executable, it is somewhere code can run from. A name
+		gives the same cave back every time it is asked for.
+		"""
+		
+		if (name in self.allocations):
+			return self.allocations[name]
+		
+		for kind in kinds:
+			for cave in self.caves:
+				if (cave.kind != kind or (executable and not cave.executable)):
+					continue
+				
+				# Align the address, which is what the code refers to
+				start = cave.offset + -cave.address % align
+				
+				if (start + size > cave.offset + cave.size):
+					continue
+				
+				piece = Cave(start, size, kind, cave.executable, cave.address + start - cave.offset)
+				self.reserve(start, size)
+				
+				if (name is not None):
+					self.allocations[name] = piece
+				
+				return piece
+		
+		raise Exception(f"There is no {'executable ' if executable else ''}cave left with {size} free bytes.")
+
+def main(argv = None):
+	parser = argparse.ArgumentParser(prog = "python -m patchcore.caves", description = "Find spare space in a library for patches.")
+	parser.add_argument("-m", "--min-size", type = int, default = 16, help = "Smallest cave to list, in bytes (default: 16)")
+	parser.add_argument("-k", "--kind", action = "append", choices = KINDS, default = None, help = "Only list caves of this kind (can be given many times)")
+	parser.add_argument("-x", "--executable", action = "store_true", help = "Only list caves code can run from")
+	parser.add_argument("files", nargs = "+", help = "Library files")
+	args = parser.parse_args(argv)
+	
+	failed = 0
+	
+	for path in args.files:
+		try:
+			with File(path, writable = False) as f:
+				# Importing NumPy isn't part of the scan
+				loadNumpy()
+				start = time.perf_counter()
+				caves = findCaves(f, args.min_size)
+				elapsed = time.perf_counter() - start
+		except Exception as e:
+			print(f"{path}\tError: {e}", file = sys.stderr)
+			failed += 1
+			continue
+		
+		caves = [c for c in caves if (not args.kind or c.kind in args.kind) and (c.executable or not args.executable)]
+		print(f"{path}\t{len(caves)} caves, {sum(c.size for c in caves)} bytes ({elapsed * 1000:.1f} ms)")
+		
+		for cave in caves:
+			print(f"\t{hex(cave.offset)}\t{hex(cave.address)}\t{cave.size}\t{cave.kind}{' (executable)' if cave.executable else ''}")
+	
+	return 1 if failed else 0
+
+if (__name__ == "__main__"):
+	sys.exit(main())
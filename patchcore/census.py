@@ -0,0 +1,193 @@
+"""
+Find out which patches a collection of libraries has, and with what values
+
+Only the patch sites (and the few bytes needed to identify the build) are
+read, through a memory map, so scanning a library touches a handful of pages
+instead of reading the whole file.
+"""
+
+import argparse
+import concurrent.futures
+import contextlib
+import csv
+import json
+import sys
+
+from patchcore.apk import isApk, openLibrary
+from patchcore.batch import expandInputs
+from patchcore.file import File
+from patchcore.fingerprint import defaultIndex, gameFor
+from patchcore.registry import Write
+from patchcore import verify
+
+FIELDS = ["path", "game", "version", "patch", "status", "value"]
+
+# Loaded once in each worker process
+index = None
+
+@contextlib.contextmanager
+def openLibraryFile(location, game):
+	"""
+	Open a library, or the library in an APK, for reading
+	"""
+	
+	if (isApk(location)):
+		with openLibrary(location, game.library) as f:
+			yield f
+	else:
+		with File(location, writable = False) as f:
+			yield f
+
+def patchState(f, patch, originals):
+	"""
+	Get the (status, value) of a patch in a file. The status is "applied",
+	"partially applied", "not applied" or "unknown" (for patches made only of
+	values, when the original bytes haven't been recorded). The value is
+	recovered from the sites that can be decoded.
+	"""
+	
+	found = []
+	values = []
+	
+	for site in patch.sites:
+		data = f.read(site.offset, site.size)
+		
+		if (isinstance(site, Write)):
+			found.append(data == site.data)
+			continue
+		
+		original = site.original or originals.get(site.offset)
+		
+		if (original is not None):
+			found.append(data != original)
+		
+		if (site.decode):
+			try:
+				value = site.decode(data)
+			except Exception:
+				continue
+			
+			# Floats only have single precision in the library
+			if (isinstance(value, float)):
+				value = float(f"{value:.7g}")
+			
+			if (value not in values):
+				values.append(value)
+	
+	if (not found):
+		status = "unknown"
+	elif (all(found)):
+		status = "applied"
+	elif (any(found)):
+		status = "partially applied"
+	else:
+		status = "not applied"
+	
+	if (status == "not applied" or not values):
+		return (status, None)
+	
+	# Sites that disagree are all shown
+	return (status, values[0] if len(values) == 1 else values)
+
+def scanFile(location):
+	"""
+	Scan one library or APK, returning a dict with the game, version and the
+	state of every patch, or an error
+	"""
+	
+	global index
+	
+	result = {"path": location}
+	
+	try:
+		if (index is None):
+			index = defaultIndex()
+		
+		game = gameFor(location, index)
+		
+		with openLibraryFile(location, game) as f:
+			version = game.checkVersion(f)
+			originals = verify.loadOriginals(game.name, version) or {}
+			patches = {}
+			
+			for (name, patch) in game.locate(f).patches.items():
+				status, value = patchState(f, patch, originals)
+				patches[name] = {"status": status, "value": value}
+		
+		result.update(game = game.name, version = version, patches = patches)
+	except Exception as e:
+		result["error"] = str(e)
+	
+	return result
+
+def scan(paths, jobs = None):
+	"""
+	Scan many files over a process pool, yielding results in order
+	"""
+	
+	if (len(paths) <= 1 or jobs == 1):
+		yield from map(scanFile, paths)
+		return
+	
+	with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+		yield from pool.map(scanFile, paths, chunksize = 16)
+
+def rows(result):
+	"""
+	Turn a scan result into CSV rows, one per patch
+	"""
+	
+	if ("error" in result):
+		return [{"path": result["path"], "status": "error", "value": result["error"]}]
+	
+	return [{
+		"path": result["path"],
+		"game": result["game"],
+		"version": result["version"],
+		"patch": name,
+		"status": state["status"],
+		"value": "" if state["value"] is None else state["value"],
+	} for (name, state) in result["patches"].items()]
+
+def main(argv = None):
+	parser = argparse.ArgumentParser(prog = "python -m patchcore.census", description = "List the patches (and their values) in patched libraries.")
+	parser.add_argument("-f", "--format", choices = ["csv", "json"], default = "csv", help = "Output format (default: csv)")
+	parser.add_argument("-o", "--output", default = None, help = "Write the table here instead of to stdout")
+	parser.add_argument("-j", "--jobs", type = int, default = None, help = "Number of worker processes (default: number of cores)")
+	parser.add_argument("--applied", action = "store_true", help = "Leave out patches that aren't applied")
+	parser.add_argument("files", nargs = "+", help = "Library files, APKs, globs or directories to search")
+	args = parser.parse_args(argv)
+	
+	paths = expandInputs(args.files)
+	out = open(args.output, "w", newline = "") if args.output else sys.stdout
+	failed = 0
+	
+	try:
+		if (args.format == "csv"):
+			writer = csv.DictWriter(out, FIELDS)
+			writer.writeheader()
+		else:
+			results = []
+		
+		for result in scan(paths, args.jobs):
+			failed += "error" in result
+			
+			if (args.applied and "patches" in result):
+				result["patches"] = {name: state for (name, state) in result["patches"].items() if state["status"] != "not applied"}
+			
+			if (args.format == "csv"):
+				writer.writerows(rows(result))
+			else:
+				results.append(result)
+		
+		if (args.format == "json"):
+			json.dump(results, out, indent = "\t")
+			out.write("\n")
+	finally:
+		if (out is not sys.stdout):
+			out.close()
+	
+	return 1 if failed else 0
+
+if (__name__ == "__main__"):
+	sys.exit(main())
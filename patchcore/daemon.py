@@ -0,0 +1,515 @@
+"""
+A patch daemon for tools that patch many files one call at a time
+
+Starting the patcher for every file pays for the interpreter, the imports
+and identifying the build each time. The daemon is started once and keeps
+the games, the build index and compiled plans in memory, so a request only
+costs the writes it makes.
+
+Requests are JSON objects sent over a Unix socket, one per line, and each
+gets a JSON reply on its own line, in the order they were sent:
+
+	{"input": "/mods/a/libsmashhit.so", "output": "/mods/a/out.so", "patches": {"antitamper": true, "balls": true, "balls_val": "10"}}
+	{"ok": true, "input": "...", "output": "...", "game": "smashhit", "status": {"antitamper": "applied now", "balls": "applied now"}, "writes": 7, "messages": [], "ms": 1.2}
+
+Requests can also give "game", "preset" (merged under "patches" like the
+batch --preset option), "check", "journal" and an "id" that is copied into
+the reply. Paths must be absolute. Failed requests get {"ok": false,
+"error": "..."}, and so do requests where a patch was left out because its
+value was rejected (those are listed in "skipped"). {"command": "ping"},
+{"command": "stats"} and {"command": "shutdown"} are answered straight
+away.
+
+Requests run on a fixed number of worker threads. Once that many requests
+are running and as many again are waiting, the daemon stops reading from
+connections until one finishes, so clients that send faster than files can
+be patched just block. A request with "wait": false is answered with
+{"ok": false, "busy": true} instead.
+
+A daemon started with a signature file (serve --signatures) uses it to find
+the patch sites in builds whose version isn't known.
+"""
+
+import argparse
+import concurrent.futures
+import json
+import os
+import queue
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+from patchcore.cache import PlanCache
+from patchcore.fingerprint import defaultIndex, gameFor
+from patchcore.games import GAMES
+from patchcore.presets import loadPreset
+from patchcore.registry import applyPatches, parseSelection
+from patchcore.signature import gameForBuild, loadSignatures
+from patchcore import VERSION, defaultCacheDir, ui
+
+def socketPath():
+	"""
+	Get the default socket path, in the cache directory
+	"""
+	
+	return os.path.join(defaultCacheDir(), "daemon.sock")
+
+def finished(reply):
+	"""
+	Get a future that already has a reply
+	"""
+	
+	future = concurrent.futures.Future()
+	future.set_result(reply)
+	
+	return future
+
+class Collector():
+	"""
+	patchcore.ui backend that collects the messages shown while a request is
+	running on each thread, so they can be put in its reply
+	"""
+	
+	def __init__(self):
+		self.local = threading.local()
+	
+	def begin(self):
+		self.local.messages = []
+	
+	def end(self):
+		messages = self.local.messages
+		self.local.messages = None
+		
+		return messages
+	
+	def add(self, kind, title, message):
+		messages = getattr(self.local, "messages", None)
+		
+		if (messages is None):
+			print(f"{title}: {message}", file = sys.stderr)
+		else:
+			messages.append({"kind": kind, "title": title, "message": message})
+	
+	def showinfo(self, title, message):
+		self.add("info", title, message)
+	
+	def showwarning(self, title, message):
+		self.add("warning", title, message)
+	
+	def showerror(self, title, message):
+		self.add("error", title, message)
+
+class Daemon():
+	"""
+	Runs patch requests on a pool of jobs worker threads, with room for
+	backlog more waiting, keeping the build index and plans warm.
+	signatures is a loaded signature file for builds of unknown versions.
+	"""
+	
+	def __init__(self, jobs = None, backlog = None, cache_dir = None, signatures = None):
+		self.jobs = jobs or min(8, os.cpu_count() or 1)
+		self.pool = concurrent.futures.ThreadPoolExecutor(self.jobs)
+		self.slots = threading.BoundedSemaphore(self.jobs + (self.jobs if backlog is None else backlog))
+		
+		self.index = defaultIndex()
+		self.index_lock = threading.Lock()
+		self.plans = PlanCache(cache_dir, memory = True)
+		self.signatures = signatures
+		
+		self.messages = Collector()
+		ui.setBackend(self.messages)
+		
+		self.started = time.time()
+		self.served = 0
+		self.failed = 0
+		self.running = 0
+		self.lock = threading.Lock()
+	
+	def submit(self, request):
+		"""
+		Start a patch request, blocking until there is room for it unless it
+		has "wait": false. Returns a future for the reply.
+		"""
+		
+		if (not self.slots.acquire(blocking = request.get("wait", True) != False)):
+			return finished(self.reply(request, {"ok": False, "busy": True, "error": "The daemon is busy."}))
+		
+		try:
+			future = self.pool.submit(self.run, request)
+		except BaseException:
+			self.slots.release()
+			raise
+		
+		future.add_done_callback(lambda f: self.slots.release())
+		
+		return future
+	
+	def run(self, request):
+		start = time.perf_counter()
+		
+		with self.lock:
+			self.running += 1
+		
+		self.messages.begin()
+		
+		try:
+			reply = self.patch(request)
+		except Exception as e:
+			reply = {"ok": False, "error": str(e)}
+		
+		reply["messages"] = self.messages.end()
+		reply["ms"] = round((time.perf_counter() - start) * 1000, 3)
+		
+		with self.lock:
+			self.running -= 1
+			self.served += 1
+			self.failed += not reply["ok"]
+		
+		return self.reply(request, reply)
+	
+	def reply(self, request, reply):
+		if ("id" in request):
+			reply["id"] = request["id"]
+		
+		return reply
+	
+	def gameFor(self, location):
+		with self.index_lock:
+			try:
+				game = gameFor(location, self.index)
+			except Exception:
+				if (not self.signatures):
+					raise
+				
+				game = GAMES[self.signatures["game"]]
+			
+			self.index.save()
+		
+		return game
+	
+	def patch(self, request):
+		location = request.get("input")
+		output = request.get("output")
+		
+		for path in (location, output):
+			if (path is not None and (type(path) != str or not os.path.isabs(path))):
+				raise Exception("The input and output must be absolute paths.")
+		
+		if (location is None):
+			raise Exception("The request has no input.")
+		
+		patches = request.get("patches") or {}
+		name = request.get("game")
+		
+		if (type(patches) == list):
+			patches = parseSelection(patches)
+		
+		if (type(patches) != dict):
+			raise Exception("The patches must be a dict or a list of \"name=value\" strings.")
+		
+		if (request.get("preset")):
+			preset = loadPreset(request["preset"])
+			patches = {**preset.patches, **patches}
+			name = name or preset.game
+		
+		if (name is not None and name not in GAMES):
+			raise Exception(f"Unknown game {name}.")
+		
+		game = GAMES[name] if name else self.gameFor(location)
+		target = gameForBuild(game, location, self.signatures)
+		
+		# Plans are stored by version, which doesn't tell relocated builds apart
+		plan = applyPatches(target, location, patches, output, check = request.get("check", True), journal = request.get("journal") or None, plans = self.plans if target is game else None)
+		
+		reply = {
+			"ok": not plan.skipped,
+			"input": location,
+			"output": output or location,
+			"game": game.name,
+			"status": plan.status,
+			"writes": len(plan.writes),
+			"skipped": plan.skipped,
+		}
+		
+		if (plan.skipped):
+			reply["error"] = f"These patches weren't applied because their values were rejected: {', '.join(plan.skipped)}."
+		
+		return reply
+	
+	def command(self, request, server):
+		"""
+		Answer a request that doesn't patch anything
+		"""
+		
+		command = request["command"]
+		
+		if (command == "ping"):
+			return {"ok": True, "version": ".".join(str(v) for v in VERSION)}
+		elif (command == "stats"):
+			with self.lock:
+				return {
+					"ok": True,
+					"jobs": self.jobs,
+					"running": self.running,
+					"served": self.served,
+					"failed": self.failed,
+					"plans": len(self.plans.memory),
+					"uptime": round(time.time() - self.started, 3),
+				}
+		elif (command == "shutdown"):
+			# shutdown() waits for serve_forever() to return, so it can't be
+			# called from a thread serve_forever() is waiting on
+			threading.Thread(target = server.shutdown).start()
+			return {"ok": True}
+		else:
+			return {"ok": False, "error": f"Unknown command {command}."}
+	
+	def close(self):
+		self.pool.shutdown(wait = True)
+		
+		with self.index_lock:
+			self.index.save()
+
+class Handler(socketserver.StreamRequestHandler):
+	"""
+	Reads requests from a connection and writes their replies in order. The
+	replies are written from another thread, so requests sent together run
+	together.
+	"""
+	
+	def handle(self):
+		replies = queue.Queue()
+		writer = threading.Thread(target = self.writeReplies, args = (replies,))
+		writer.start()
+		
+		try:
+			for line in self.rfile:
+				if (not line.strip()):
+					continue
+				
+				try:
+					request = json.loads(line)
+					
+					if (type(request) != dict):
+						raise ValueError()
+				except ValueError:
+					replies.put(finished({"ok": False, "error": "Requests must be JSON objects, one per line."}))
+					continue
+				
+				if ("command" in request):
+					replies.put(finished(self.server.daemon.reply(request, self.server.daemon.command(request, self.server))))
+				else:
+					replies.put(self.server.daemon.submit(request))
+		finally:
+			replies.put(None)
+			writer.join()
+	
+	def writeReplies(self, replies):
+		gone = False
+		
+		while (True):
+			future = replies.get()
+			
+			if (future is None):
+				break
+			
+			reply = future.result()
+			
+			if (gone):
+				continue
+			
+			try:
+				self.wfile.write((json.dumps(reply) + "\n").encode("utf-8"))
+				self.wfile.flush()
+			except OSError:
+				# The client has gone, but the requests it sent still finish
+				gone = True
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+	daemon_threads = True
+	
+	def __init__(self, path, daemon):
+		self.daemon = daemon
+		
+		if (os.path.exists(path)):
+			try:
+				with socket.socket(socket.AF_UNIX) as s:
+					s.connect(path)
+			except (ConnectionRefusedError, FileNotFoundError):
+				# Left behind by a daemon that didn't shut down cleanly
+				os.unlink(path)
+			else:
+				raise Exception(f"A daemon is already running on {path}.")
+		
+		os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok = True)
+		
+		# Only the user running the daemon can send it requests
+		umask = os.umask(0o177)
+		
+		try:
+			super().__init__(path, Handler)
+		finally:
+			os.umask(umask)
+	
+	def server_close(self):
+		super().server_close()
+		
+		try:
+			os.unlink(self.server_address)
+		except FileNotFoundError:
+			pass
+
+def serve(path = None, jobs = None, backlog = None, ready = None, signatures = None):
+	"""
+	Run a daemon on path until it is sent a shutdown command or interrupted.
+	ready is called once it is listening.
+	"""
+	
+	daemon = Daemon(jobs, backlog, signatures = signatures)
+	
+	with Server(path or socketPath(), daemon) as server:
+		if (ready):
+			ready(server)
+		
+		try:
+			server.serve_forever()
+		except KeyboardInterrupt:
+			pass
+		finally:
+			daemon.close()
+
+class Client():
+	"""
+	A connection to a daemon. Requests can be sent together with send() and
+	their replies read back in order with receive().
+	"""
+	
+	def __init__(self, path = None):
+		self.socket = socket.socket(socket.AF_UNIX)
+		
+		try:
+			self.socket.connect(path or socketPath())
+		except BaseException:
+			self.socket.close()
+			raise
+		
+		self.file = self.socket.makefile("rwb")
+	
+	def __enter__(self):
+		return self
+	
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+	
+	def close(self):
+		self.file.close()
+		self.socket.close()
+	
+	def send(self, request):
+		self.file.write((json.dumps(request) + "\n").encode("utf-8"))
+		self.file.flush()
+	
+	def receive(self):
+		line = self.file.readline()
+		
+		if (not line):
+			raise Exception("The daemon closed the connection.")
+		
+		return json.loads(line)
+	
+	def request(self, **request):
+		"""
+		Send one request and wait for its reply
+		"""
+		
+		self.send(request)
+		
+		return self.receive()
+
+def main(argv = None):
+	parser = argparse.ArgumentParser(prog = "python -m patchcore.daemon", description = "Run or talk to a patch daemon that keeps its caches warm between requests.")
+	parser.add_argument("-s", "--socket", default = None, help = "Socket path (default: daemon.sock in the cache directory)")
+	commands = parser.add_subparsers(dest = "command", required = True)
+	
+	serve_parser = commands.add_parser("serve", help = "Run the daemon")
+	serve_parser.add_argument("-j", "--jobs", type = int, default = None, help = "Number of requests to run at once (default: number of cores, up to 8)")
+	serve_parser.add_argument("-b", "--backlog", type = int, default = None, help = "Number of requests that can wait for a worker before the daemon stops reading (default: the number of jobs)")
+	serve_parser.add_argument("--signatures", default = None, metavar = "FILE", help = "Find the patch sites in builds of unknown versions with this signature file")
+	
+	send = commands.add_parser("send", help = "Patch files through a running daemon")
+	send.add_argument("-g", "--game", default = None, choices = list(GAMES), help = "Which game the files are for (default: detect it)")
+	send.add_argument("-p", "--patch", action = "append", default = [], metavar = "NAME[=VALUE]", help = "A patch to apply, with an optional value (can be given many times)")
+	send.add_argument("--preset", default = None, help = "Apply a saved preset")
+	send.add_argument("-o", "--output", default = None, help = "Output file (only with one input, default: patch in place)")
+	send.add_argument("--journal", action = "store_true", help = "Save undo journals")
+	send.add_argument("files", nargs = "+", help = "Library files or APKs")
+	
+	commands.add_parser("stats", help = "Show what a running daemon has done")
+	commands.add_parser("stop", help = "Stop a running daemon")
+	
+	args = parser.parse_args(argv)
+	
+	if (args.command == "serve"):
+		try:
+			signatures = loadSignatures(args.signatures) if args.signatures else None
+			serve(args.socket, args.jobs, args.backlog, lambda server: print(f"Listening on {server.server_address}", file = sys.stderr, flush = True), signatures)
+		except Exception as e:
+			print(f"Error: {e}", file = sys.stderr)
+			return 1
+		
+		return 0
+	
+	try:
+		with Client(args.socket) as client:
+			if (args.command == "stats"):
+				print(json.dumps(client.request(command = "stats"), indent = "\t"))
+				return 0
+			
+			if (args.command == "stop"):
+				client.request(command = "shutdown")
+				return 0
+			
+			if (args.output and len(args.files) != 1):
+				parser.error("--output can only be used with one input file")
+			
+			# Send everything first so the daemon can work on the files together
+			for path in args.files:
+				request = {"input": os.path.abspath(path), "patches": parseSelection(args.patch)}
+				
+				if (args.output):
+					request["output"] = os.path.abspath(args.output)
+				
+				if (args.game):
+					request["game"] = args.game
+				
+				if (args.preset):
+					request["preset"] = args.preset
+				
+				if (args.journal):
+					request["journal"] = True
+				
+				client.send(request)
+			
+			failed = 0
+			
+			for path in args.files:
+				reply = client.receive()
+				
+				if (reply["ok"]):
+					print(f"{path}: {', '.join(f'{name} {status}' for (name, status) in reply['status'].items())} ({reply['ms']} ms)")
+				else:
+					print(f"{path}: Error: {reply['error']}", file = sys.stderr)
+					failed += 1
+			
+			return 1 if failed else 0
+	except (ConnectionRefusedError, FileNotFoundError):
+		print(f"Error: There is no daemon running on {args.socket or socketPath()}.", file = sys.stderr)
+		return 1
+	except Exception as e:
+		print(f"Error: {e}", file = sys.stderr)
+		return 1
+
+if (__name__ == "__main__"):
+	sys.exit(main())
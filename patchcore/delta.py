@@ -0,0 +1,206 @@
+"""
+Compact binary delta patches
+
+Instead of a whole patched library, a delta only holds the bytes that the
+selected patches write, plus the sizes and SHA-256 digests of the base and
+patched files so it can't be applied to the wrong build.
+
+Format (all integers little endian):
+	magic           b"SHDELTA1"
+	source size     u64
+	target size     u64
+	source digest   32 bytes
+	target digest   32 bytes
+	record count    u32
+	records         (offset u64, length u32, data) sorted by offset
+
+Examples:
+	python -m patchcore.delta export -g smashhit -p antitamper -p checkpoints=26 libsmashhit.so mod.shd
+	python -m patchcore.delta apply mod.shd libsmashhit.so libsmashhit-patched.so
+"""
+
+import argparse
+import hashlib
+import shutil
+import struct
+import sys
+
+from patchcore.file import File
+from patchcore.games import GAMES
+from patchcore.output import atomicPath
+from patchcore import registry
+
+MAGIC = b"SHDELTA1"
+HEADER = struct.Struct("<8sQQ32s32sI")
+RECORD = struct.Struct("<QI")
+CHUNK_SIZE = 1 << 20
+
+def planRuns(plan):
+	"""
+	Merge the writes of a plan into (offset, data) runs
+	"""
+	
+	runs = []
+	
+	for (offset, data, name) in plan.writes:
+		if (runs and runs[-1][0] + len(runs[-1][1]) == offset):
+			runs[-1] = (runs[-1][0], runs[-1][1] + data)
+		else:
+			runs.append((offset, data))
+	
+	return runs
+
+def streamPatched(src, runs):
+	"""
+	Read a file in chunks, yielding (original chunk, patched chunk) pairs
+	"""
+	
+	position = 0
+	i = 0
+	
+	while (chunk := src.read(CHUNK_SIZE)):
+		end = position + len(chunk)
+		patched = bytearray(chunk)
+		
+		# Skip runs that ended before this chunk
+		while (i < len(runs) and runs[i][0] + len(runs[i][1]) <= position):
+			i += 1
+		
+		j = i
+		
+		while (j < len(runs) and runs[j][0] < end):
+			offset, data = runs[j]
+			start = max(offset, position)
+			stop = min(offset + len(data), end)
+			patched[start - position:stop - position] = data[start - offset:stop - offset]
+			j += 1
+		
+		yield (chunk, patched)
+		
+		position = end
+
+def makeDelta(plan, source):
+	"""
+	Make a delta that turns the source file into the source with the plan
+	applied
+	"""
+	
+	runs = planRuns(plan)
+	size = 0
+	source_hash = hashlib.sha256()
+	target_hash = hashlib.sha256()
+	
+	with open(source, "rb") as f:
+		for (chunk, patched) in streamPatched(f, runs):
+			size += len(chunk)
+			source_hash.update(chunk)
+			target_hash.update(patched)
+	
+	if (runs and runs[-1][0] + len(runs[-1][1]) > size):
+		raise Exception("The patches go past the end of the source file.")
+	
+	parts = [HEADER.pack(MAGIC, size, size, source_hash.digest(), target_hash.digest(), len(runs))]
+	
+	for (offset, data) in runs:
+		parts.append(RECORD.pack(offset, len(data)))
+		parts.append(data)
+	
+	return b"".join(parts)
+
+def readDelta(delta):
+	"""
+	Parse a delta into its header fields and list of (offset, data) runs
+	"""
+	
+	magic, source_size, target_size, source_digest, target_digest, count = HEADER.unpack_from(delta, 0)
+	
+	if (magic != MAGIC):
+		raise Exception("This isn't a delta patch file.")
+	
+	runs = []
+	position = HEADER.size
+	
+	for i in range(count):
+		offset, length = RECORD.unpack_from(delta, position)
+		position += RECORD.size
+		runs.append((offset, bytes(delta[position:position + length])))
+		position += length
+	
+	return (source_size, target_size, source_digest, target_digest, runs)
+
+def applyDelta(delta, source, target):
+	"""
+	Stream the source file through the delta into the target file, checking
+	both digests. The target is only replaced if everything matches, and can
+	be the same as the source.
+	"""
+	
+	source_size, target_size, source_digest, target_digest, runs = readDelta(delta)
+	source_hash = hashlib.sha256()
+	target_hash = hashlib.sha256()
+	
+	# Every byte is written from the stream, so there's nothing to clone
+	with atomicPath(target) as temp:
+		with open(source, "rb") as i, open(temp, "wb") as o:
+			size = 0
+			
+			for (chunk, patched) in streamPatched(i, runs):
+				size += len(chunk)
+				source_hash.update(chunk)
+				target_hash.update(patched)
+				o.write(patched)
+		
+		if (size != source_size or source_hash.digest() != source_digest):
+			raise Exception("The delta is for a different base file.")
+		
+		if (size != target_size or target_hash.digest() != target_digest):
+			raise Exception("The patched file doesn't match the delta's checksum.")
+		
+		shutil.copymode(source, temp)
+
+def main(argv = None):
+	parser = argparse.ArgumentParser(prog = "python -m patchcore.delta", description = "Export and apply compact delta patches.")
+	commands = parser.add_subparsers(dest = "command", required = True)
+	
+	export = commands.add_parser("export", help = "Make a delta of some patches for a base library")
+	export.add_argument("-g", "--game", required = True, choices = list(GAMES), help = "Which game the library is for")
+	export.add_argument("-p", "--patch", action = "append", default = [], metavar = "NAME[=VALUE]", help = "A patch to apply, with an optional value (can be given many times)")
+	export.add_argument("base", help = "Unpatched library")
+	export.add_argument("delta", help = "Delta file to write")
+	
+	apply = commands.add_parser("apply", help = "Apply a delta to a base library")
+	apply.add_argument("delta", help = "Delta file")
+	apply.add_argument("base", help = "Unpatched library")
+	apply.add_argument("output", help = "Where to write the patched library")
+	
+	args = parser.parse_args(argv)
+	
+	try:
+		if (args.command == "export"):
+			game = GAMES[args.game]
+			
+			with File(args.base, writable = False) as f:
+				game.checkVersion(f)
+				plan = registry.compilePlan(game, f, registry.parseSelection(args.patch))
+			
+			# A delta missing a patch would look complete to whoever applies it
+			if (plan.skipped):
+				raise Exception(f"Not writing a delta, because these patches' values were rejected: {', '.join(plan.skipped)}.")
+			
+			delta = makeDelta(plan, args.base)
+			
+			with open(args.delta, "wb") as f:
+				f.write(delta)
+			
+			print(f"Wrote {len(delta)} bytes ({len(plan)} writes)", file = sys.stderr)
+		else:
+			with open(args.delta, "rb") as f:
+				applyDelta(f.read(), args.base, args.output)
+	except Exception as e:
+		print(f"Error: {e}", file = sys.stderr)
+		return 1
+	
+	return 0
+
+if (__name__ == "__main__"):
+	sys.exit(main())
@@ -0,0 +1,486 @@
+"""
+Reading the layout of 64-bit ELF libraries
+
+Only the parts that are asked for are read: the file header when an Elf is
+made, the section and program headers the first time they are needed, and
+the dynamic symbols only when a symbol is looked up. The symbol index of a
+build is also kept in the cache directory, so it is only read out of the
+library once.
+
+This is used to reject writes that would land outside the code and constant
+data of a library, and to turn file offsets into symbol+offset names and
+back, since the patches are really tied to functions like Player::load.
+
+Example:
+	python -m patchcore.elf libsmashhit.so where 0x574d0
+	python -m patchcore.elf libsmashhit.so resolve Player::load+0x40
+"""
+
+import argparse
+import bisect
+import hashlib
+import json
+import os
+import re
+import struct
+import sys
+
+from patchcore.file import File
+from patchcore.output import atomicPath
+from patchcore import defaultCacheDir
+
+MAGIC = b"\x7fELF"
+
+HEADER = struct.Struct("<16sHHIQQQIHHHHHH")
+SECTION_HEADER = struct.Struct("<IIQQQQIIQQ")
+PROGRAM_HEADER = struct.Struct("<IIQQQQQQ")
+SYMBOL = struct.Struct("<IBBHQQ")
+
+SHT_NOBITS = 8
+SHT_DYNSYM = 11
+SHF_EXECINSTR = 0x4
+PT_LOAD = 1
+PF_X = 0x1
+SHN_UNDEF = 0
+
+SYMBOL_TYPES = {0: "none", 1: "object", 2: "func", 3: "section", 4: "file", 6: "tls", 10: "ifunc"}
+
+# Sections a patch site can be in, given with each site in the game tables.
+# Instructions are in .text, while constants and strings can be in a literal
+# pool in the code or in any of the data sections.
+TEXT = (".text",)
+DATA = (".text", ".rodata", ".data.rel.ro", ".data")
+
+# Symbol indexes loaded in this process, by symbolsKey()
+loaded_symbols = {}
+
+class Section():
+	"""
+	A section from the section header table
+	"""
+	
+	def __init__(self, name, type, flags, address, offset, size, link = 0):
+		self.name = name
+		self.type = type
+		self.flags = flags
+		self.address = address
+		self.offset = offset
+		self.size = size
+		self.end = offset + size
+		self.link = link
+
+class Segment():
+	"""
+	A loadable segment from the program header table
+	"""
+	
+	def __init__(self, offset, address, file_size, memory_size, flags):
+		self.offset = offset
+		self.address = address
+		self.file_size = file_size
+		self.memory_size = memory_size
+		self.flags = flags
+
+class Symbol():
+	"""
+	A defined dynamic symbol, with the file offset its address maps to (or
+	None if it isn't in the file)
+	"""
+	
+	def __init__(self, name, address, size, type, offset):
+		self.name = name
+		self.address = address
+		self.size = size
+		self.type = type
+		self.offset = offset
+	
+	def toList(self):
+		return [self.name, self.address, self.size, self.type, self.offset]
+
+def mangledPrefix(name):
+	"""
+	Get the start of the Itanium C++ mangled name of a function like
+	Player::load, which is how it appears in the symbol table. Names without
+	:: are returned as they are.
+	"""
+	
+	if ("::" not in name):
+		return name
+	
+	return "_ZN" + "".join(f"{len(part)}{part}" for part in name.split("::")) + "E"
+
+class Elf():
+	"""
+	A 64-bit little endian ELF file, read through anything with read(offset,
+	length) and size, like a patchcore.file.File
+	"""
+	
+	def __init__(self, f):
+		self.f = f
+		header = f.read(0, HEADER.size)
+		
+		if (len(header) < HEADER.size or header[:4] != MAGIC):
+			raise Exception(f"{f.path} isn't an ELF file.")
+		
+		if (header[4] != 2 or header[5] != 1):
+			raise Exception(f"{f.path} isn't a 64-bit little endian ELF file.")
+		
+		fields = HEADER.unpack(header)
+		self.machine = fields[2]
+		self.program_offset = fields[5]
+		self.section_offset = fields[6]
+		self.program_count = fields[10]
+		self.section_count = fields[12]
+		self.names_index = fields[13]
+		
+		self.sections = None
+		self.segments = None
+		self.symbols = None
+	
+	def readTable(self, offset, count, entry):
+		size = count * entry.size
+		
+		if (offset + size > self.f.size):
+			raise Exception(f"The headers of {self.f.path} go past the end of the file.")
+		
+		return list(entry.iter_unpack(self.f.read(offset, size)))
+	
+	def readString(self, table, offset):
+		end = table.find(b"\x00", offset)
+		return table[offset:end if end >= 0 else len(table)].decode("utf-8", errors = "replace")
+	
+	def getSections(self):
+		"""
+		Get the sections that have bytes in the file, sorted by offset
+		"""
+		
+		if (self.sections is None):
+			headers = self.readTable(self.section_offset, self.section_count, SECTION_HEADER) if self.section_offset else []
+			names = b""
+			
+			if (self.names_index < len(headers)):
+				names_header = headers[self.names_index]
+				names = self.f.read(names_header[4], names_header[5])
+			
+			self.all_sections = [Section(self.readString(names, h[0]), h[1], h[2], h[3], h[4], h[5], h[6]) for h in headers]
+			self.sections = sorted((s for s in self.all_sections if s.type not in (0, SHT_NOBITS) and s.size), key = lambda s: s.offset)
+			self.section_starts = [s.offset for s in self.sections]
+		
+		return self.sections
+	
+	def section(self, name):
+		"""
+		Get the section with the given name
+		"""
+		
+		for section in self.getSections():
+			if (section.name == name):
+				return section
+		
+		raise Exception(f"{self.f.path} has no {name} section.")
+	
+	def sectionAt(self, offset):
+		"""
+		Get the section a file offset is in, or None
+		"""
+		
+		sections = self.getSections()
+		i = bisect.bisect_right(self.section_starts, offset) - 1
+		
+		if (i >= 0 and offset < sections[i].end):
+			return sections[i]
+		
+		return None
+	
+	def getSegments(self):
+		"""
+		Get the loadable segments
+		"""
+		
+		if (self.segments is None):
+			headers = self.readTable(self.program_offset, self.program_count, PROGRAM_HEADER) if self.program_offset else []
+			self.segments = [Segment(h[2], h[3], h[5], h[6], h[1]) for h in headers if h[0] == PT_LOAD]
+		
+		return self.segments
+	
+	def ranges(self, executable = False):
+		"""
+		Get the (start, end) address ranges of the loaded segments that are
+		backed by the file, or only the executable ones
+		"""
+		
+		return [(s.address, s.address + s.file_size) for s in self.getSegments() if s.flags & PF_X or not executable]
+	
+	def offsetToAddress(self, offset):
+		"""
+		Get the virtual address a file offset is loaded at, or None if it
+		isn't loaded
+		"""
+		
+		for segment in self.getSegments():
+			if (segment.offset <= offset < segment.offset + segment.file_size):
+				return segment.address + offset - segment.offset
+		
+		return None
+	
+	def addressToOffset(self, address):
+		"""
+		Get the file offset a virtual address is loaded from, or None if it
+		isn't backed by the file
+		"""
+		
+		for segment in self.getSegments():
+			if (segment.address <= address < segment.address + segment.file_size):
+				return segment.offset + address - segment.address
+		
+		return None
+	
+	def dynamicTables(self):
+		"""
+		Get the .dynsym section and its string table, or None
+		"""
+		
+		self.getSections()
+		
+		for section in self.all_sections:
+			if (section.type == SHT_DYNSYM):
+				# The link of a symbol table is the index of its string table
+				return (section, self.all_sections[section.link])
+		
+		return None
+	
+	def symbolsKey(self):
+		"""
+		Get a key for the symbol index of this build, from everything it is
+		read from: the headers and the raw symbol and string tables. Hashing
+		those is much quicker than decoding them.
+		"""
+		
+		h = hashlib.sha256()
+		h.update(self.f.read(0, HEADER.size))
+		h.update(self.f.read(self.program_offset, self.program_count * PROGRAM_HEADER.size))
+		h.update(self.f.read(self.section_offset, self.section_count * SECTION_HEADER.size))
+		
+		tables = self.dynamicTables()
+		
+		for section in (tables or ()):
+			h.update(self.f.read(section.offset, section.size))
+		
+		return h.hexdigest()
+	
+	def readSymbols(self):
+		tables = self.dynamicTables()
+		
+		if (tables is None):
+			return []
+		
+		section, strings = tables
+		names = self.f.read(strings.offset, strings.size)
+		symbols = []
+		
+		for (name, info, other, index, value, size) in SYMBOL.iter_unpack(self.f.read(section.offset, section.size - section.size % SYMBOL.size)):
+			if (index == SHN_UNDEF or not name):
+				continue
+			
+			symbols.append(Symbol(self.readString(names, name), value, size, SYMBOL_TYPES.get(info & 0xf, str(info & 0xf)), self.addressToOffset(value)))
+		
+		return symbols
+	
+	def getSymbols(self):
+		"""
+		Get the defined dynamic symbols, sorted by offset, from the cache if
+		this build has been seen before
+		"""
+		
+		if (self.symbols is None):
+			key = self.symbolsKey()
+			
+			if (key not in loaded_symbols):
+				path = os.path.join(defaultCacheDir(), "symbols", f"{key}.json")
+				
+				try:
+					with open(path, "r") as f:
+						loaded_symbols[key] = [Symbol(*info) for info in json.load(f)]
+				except (FileNotFoundError, ValueError):
+					loaded_symbols[key] = sorted(self.readSymbols(), key = lambda s: (s.offset is None, s.offset or 0, s.name))
+					os.makedirs(os.path.dirname(path), exist_ok = True)
+					
+					with atomicPath(path) as temp:
+						with open(temp, "w") as f:
+							json.dump([symbol.toList() for symbol in loaded_symbols[key]], f)
+			
+			self.symbols = loaded_symbols[key]
+			self.symbol_names = {}
+			
+			for symbol in self.symbols:
+				self.symbol_names.setdefault(symbol.name, symbol)
+			
+			self.sized = [s for s in self.symbols if s.offset is not None and s.size]
+			self.sized_starts = [s.offset for s in self.sized]
+			self.longest = max((s.size for s in self.sized), default = 0)
+		
+		return self.symbols
+	
+	def symbol(self, name):
+		"""
+		Get a symbol by its name, or by a C++ name like Player::load as long
+		as only one symbol has that name
+		"""
+		
+		self.getSymbols()
+		
+		if (name in self.symbol_names):
+			return self.symbol_names[name]
+		
+		prefix = mangledPrefix(name)
+		found = [s for s in self.symbols if s.name.startswith(prefix)]
+		
+		if (len(found) == 1):
+			return found[0]
+		elif (found):
+			raise Exception(f"{name} could be any of {', '.join(s.name for s in found)}.")
+		else:
+			raise Exception(f"{self.f.path} has no symbol called {name}.")
+	
+	def symbolAt(self, offset):
+		"""
+		Get the (symbol, offset into it) of the sized symbol a file offset is
+		in, or None
+		"""
+		
+		self.getSymbols()
+		
+		# Symbols can be nested (or aliased), so check every one that starts
+		# close enough to reach the offset, innermost first
+		first = bisect.bisect_right(self.sized_starts, offset - self.longest)
+		last = bisect.bisect_right(self.sized_starts, offset)
+		
+		for symbol in reversed(self.sized[first:last]):
+			if (offset < symbol.offset + symbol.size):
+				return (symbol, offset - symbol.offset)
+		
+		return None
+	
+	def describe(self, offset):
+		"""
+		Get a symbol+offset name for a file offset, or just the offset if it
+		isn't in a symbol
+		"""
+		
+		found = self.symbolAt(offset)
+		
+		if (found is None):
+			return hex(offset)
+		
+		symbol, delta = found
+		
+		return f"{symbol.name}+{hex(delta)}" if delta else symbol.name
+	
+	def resolve(self, name):
+		"""
+		Get the file offset of a name like luaopen_io, Player::load+0x40 or
+		_ZN6Player4loadEv+12
+		"""
+		
+		match = re.fullmatch(r"(.+?)(?:\+((?:0x)?[0-9a-fA-F]+))?", name.strip())
+		symbol = self.symbol(match.group(1))
+		delta = int(match.group(2), 0) if match.group(2) else 0
+		
+		if (symbol.offset is None):
+			raise Exception(f"{symbol.name} isn't in the file.")
+		
+		if (symbol.size and delta >= symbol.size):
+			raise Exception(f"{name} is past the end of {symbol.name}, which is {hex(symbol.size)} bytes long.")
+		
+		return symbol.offset + delta
+	
+	def checkRange(self, offset, size, allowed):
+		"""
+		Get None if a range of bytes is inside one of the allowed sections,
+		otherwise a description of where it is
+		"""
+		
+		section = self.sectionAt(offset)
+		
+		if (section is not None and section.name in allowed and offset + size <= section.end):
+			return None
+		
+		if (section is None):
+			return "outside of every section"
+		
+		return f"in {section.name}" if section.name not in allowed else f"past the end of {section.name}"
+
+def checkSites(f, sites):
+	"""
+	Raise an error if any (site, patch name) isn't inside one of the sections
+	the site allows (its sections attribute). Files that aren't 64-bit ELF
+	files or don't have section headers can't be checked, so they are let
+	through.
+	"""
+	
+	try:
+		elf = Elf(f)
+		elf.getSections()
+	except Exception:
+		return
+	
+	if (not elf.sections):
+		return
+	
+	bad = []
+	
+	for (site, name) in sites:
+		problem = elf.checkRange(site.offset, site.size, site.sections)
+		
+		if (problem):
+			bad.append(f"{name} at {hex(site.offset)} ({problem}, should be in {' or '.join(site.sections)})")
+	
+	if (bad):
+		raise Exception(f"These patch sites aren't in the sections they were made for, so this library doesn't look like the one the patches were made for: {', '.join(bad)}.")
+
+def main(argv = None):
+	parser = argparse.ArgumentParser(prog = "python -m patchcore.elf", description = "Show the layout and symbols of a 64-bit ELF library.")
+	parser.add_argument("file", help = "Library file")
+	commands = parser.add_subparsers(dest = "command", required = True)
+	
+	commands.add_parser("sections", help = "List the sections")
+	
+	symbols = commands.add_parser("symbols", help = "List the dynamic symbols")
+	symbols.add_argument("pattern", nargs = "?", default = None, help = "Only list symbols whose names contain this")
+	
+	where = commands.add_parser("where", help = "Show the section, address and symbol of file offsets")
+	where.add_argument("offsets", nargs = "+", help = "File offsets")
+	
+	resolve = commands.add_parser("resolve", help = "Get the file offsets of symbol+offset names")
+	resolve.add_argument("names", nargs = "+", help = "Names like luaopen_io or Player::load+0x40")
+	
+	args = parser.parse_args(argv)
+	
+	try:
+		with File(args.file, writable = False) as f:
+			elf = Elf(f)
+			
+			if (args.command == "sections"):
+				for section in elf.getSections():
+					print(f"{section.name}\t{hex(section.offset)}\t{hex(section.size)}\t{hex(section.address)}")
+			elif (args.command == "symbols"):
+				for symbol in elf.getSymbols():
+					if (args.pattern is None or args.pattern in symbol.name):
+						print(f"{'-' if symbol.offset is None else hex(symbol.offset)}\t{hex(symbol.size)}\t{symbol.type}\t{symbol.name}")
+			elif (args.command == "where"):
+				for offset in args.offsets:
+					offset = int(offset, 0)
+					section = elf.sectionAt(offset)
+					address = elf.offsetToAddress(offset)
+					print(f"{hex(offset)}\t{section.name if section else '-'}\t{'-' if address is None else hex(address)}\t{elf.describe(offset)}")
+			else:
+				for name in args.names:
+					print(f"{name}\t{hex(elf.resolve(name))}")
+	except Exception as e:
+		print(f"Error: {e}", file = sys.stderr)
+		return 1
+	
+	return 0
+
+if (__name__ == "__main__"):
+	sys.exit(main())
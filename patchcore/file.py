@@ -0,0 +1,257 @@
+"""
+Memory mapped game library file with write coalescing
+"""
+
+import bisect
+import hashlib
+import mmap
+import os
+
+from patchcore import trace
+
+PAGE_SIZE = mmap.PAGESIZE
+DIGEST_CHUNK_SIZE = 1 << 20
+
+class File():
+	"""
+	A game library file (libsmashhit.so, libcommute.so, ...)
+	
+	The file is mapped into memory once. Writes made with patch() are only
+	collected; they are sorted, merged into contiguous runs and written out in
+	one pass by flush(), which happens automatically when the file is used as a
+	context manager and the block exits without an exception.
+	"""
+	
+	def __init__(self, path, writable = True, sync = False):
+		"""
+		Initialise the file
+		"""
+		
+		self.path = path
+		self.writable = writable
+		self.sync = sync
+		self.pending = []
+		self.written = False
+		
+		with trace.span("open", path = path):
+			self.file = open(path, "rb+" if writable else "rb")
+			
+			try:
+				self.map = mmap.mmap(self.file.fileno(), 0, access = (mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ))
+			except ValueError:
+				self.file.close()
+				raise Exception(f"The file {path} is empty.")
+		
+		self.size = len(self.map)
+	
+	@classmethod
+	def fromBuffer(cls, data, name = "<memory>", writable = True):
+		"""
+		Make a file that works on a copy of some bytes in memory instead of a
+		file on disk, for libraries read out of an archive. Flushed writes end
+		up in the map attribute, a bytearray.
+		"""
+		
+		self = cls.__new__(cls)
+		self.path = name
+		self.writable = writable
+		self.sync = False
+		self.pending = []
+		self.written = False
+		self.file = None
+		self.map = bytearray(data)
+		self.size = len(self.map)
+		
+		return self
+	
+	def __enter__(self):
+		return self
+	
+	def __exit__(self, exc_type, exc_value, traceback):
+		# Don't write anything if patching failed part way through
+		if (exc_type is None):
+			self.flush()
+		
+		self.close()
+	
+	def read(self, location, length = 4):
+		"""
+		Read some bytes (32 bits by default) from the given location, including
+		any writes that have not been flushed yet
+		"""
+		
+		if (trace.current):
+			trace.current.read(location, length)
+		
+		data = self.map[location:location + length]
+		
+		if (not self.pending):
+			return data
+		
+		data = bytearray(data)
+		end = location + len(data)
+		
+		# Later writes win, so overlay them in the order they were made
+		for (offset, patch) in self.pending:
+			if (offset < end and offset + len(patch) > location):
+				start = max(offset, location)
+				stop = min(offset + len(patch), end)
+				data[start - location:stop - location] = patch[start - offset:stop - offset]
+		
+		return bytes(data)
+	
+	def patch(self, location, data):
+		"""
+		Queue patched data to be written to the file
+		"""
+		
+		if (not self.writable):
+			raise Exception(f"The file {self.path} was opened read-only.")
+		
+		if (location < 0 or location + len(data) > self.size):
+			raise Exception(f"Patch at {hex(location)} ({len(data)} bytes) is outside of the file.")
+		
+		if (trace.current):
+			trace.current.write(location, len(data))
+		
+		self.pending.append((location, bytes(data)))
+	
+	def runs(self):
+		"""
+		Sort and merge the pending writes into a list of (offset, data) runs.
+		Writes that overlap or touch are merged, with later writes winning.
+		"""
+		
+		spans = []
+		
+		for (offset, data) in sorted(self.pending, key = lambda w: w[0]):
+			end = offset + len(data)
+			
+			if (spans and offset <= spans[-1][1]):
+				spans[-1][1] = max(spans[-1][1], end)
+			else:
+				spans.append([offset, end])
+		
+		starts = [start for (start, end) in spans]
+		runs = [bytearray(end - start) for (start, end) in spans]
+		
+		# Every byte of a span is covered by at least one write, so replaying
+		# them in the order they were made fills it in completely.
+		for (offset, data) in self.pending:
+			i = bisect.bisect_right(starts, offset) - 1
+			runs[i][offset - starts[i]:offset - starts[i] + len(data)] = data
+		
+		return [(starts[i], bytes(runs[i])) for i in range(len(runs))]
+	
+	def flush(self):
+		"""
+		Write all pending patches to the file in one pass, returning the
+		(offset, data) runs that were written
+		"""
+		
+		if (not self.pending):
+			return []
+		
+		with trace.span("flush"):
+			runs = self.runs()
+			self.pending = []
+			self.written = True
+			
+			for (offset, data) in runs:
+				self.map[offset:offset + len(data)] = data
+				
+				if (trace.current):
+					trace.current.run(self.path, offset, len(data))
+			
+			if (self.sync and self.file):
+				with trace.span("fsync"):
+					# Only the pages that were touched are synced
+					for (start, end) in pageRanges(runs, len(self.map)):
+						self.map.flush(start, end - start)
+					
+					os.fsync(self.file.fileno())
+		
+		return runs
+	
+	def close(self):
+		"""
+		Close the file without writing pending patches
+		"""
+		
+		# Buffers are kept so the patched bytes can be taken afterwards
+		if (self.file is None):
+			return
+		
+		if (self.map is not None):
+			self.map.close()
+			self.map = None
+		
+		self.file.close()
+
+def pageRanges(runs, size = None):
+	"""
+	Convert a sorted list of (offset, data) runs into a list of page aligned
+	(start, end) ranges, merging runs that share a page. If size is given, the
+	ranges stop there instead of going on to the end of the last page.
+	"""
+	
+	ranges = []
+	
+	for (offset, data) in runs:
+		start = offset - (offset % PAGE_SIZE)
+		end = offset + len(data)
+		end += (-end) % PAGE_SIZE
+		
+		if (size is not None):
+			end = min(end, size)
+		
+		if (ranges and start <= ranges[-1][1]):
+			ranges[-1] = (ranges[-1][0], max(ranges[-1][1], end))
+		else:
+			ranges.append((start, end))
+	
+	return ranges
+
+def fileDigest(path, workers = 1):
+	"""
+	Get the digest of a file as a hex string. The file is hashed in 1 MiB
+	chunks, and the digest is the SHA-256 of the chunk digests, so the chunks
+	can be hashed on several threads (hashlib releases the GIL).
+	"""
+	
+	with open(path, "rb") as f:
+		size = os.fstat(f.fileno()).st_size
+		
+		if (size == 0):
+			return bufferDigest(b"")
+		
+		with mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) as m:
+			return bufferDigest(m, workers)
+
+def bufferDigest(buffer, workers = 1):
+	"""
+	Get the digest of some bytes (or a map) the same way as fileDigest
+	"""
+	
+	if (len(buffer) == 0):
+		return hashlib.sha256(b"").hexdigest()
+	
+	view = memoryview(buffer)
+	chunks = [view[i:i + DIGEST_CHUNK_SIZE] for i in range(0, len(buffer), DIGEST_CHUNK_SIZE)]
+	
+	try:
+		if (workers > 1 and len(chunks) > 1):
+			# Only imported here since it is slow to import
+			import concurrent.futures
+			
+			with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+				digests = list(pool.map(lambda c: hashlib.sha256(c).digest(), chunks))
+		else:
+			digests = [hashlib.sha256(c).digest() for c in chunks]
+	finally:
+		for c in chunks:
+			c.release()
+		
+		view.release()
+	
+	return hashlib.sha256(b"".join(digests)).hexdigest()
@@ -0,0 +1,232 @@
+"""
+Working out which game, version and ABI a library is from
+
+A file is identified from its size and a hash of a few small samples spread
+across it, looked up in an index of builds that have been seen before. If
+it isn't in the index, the version string of each known game is checked
+and the result is added to the index.
+
+Example:
+	python -m patchcore.fingerprint libsmashhit.so
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import struct
+import sys
+
+from patchcore.apk import ABI_DIR, Apk, isApk
+from patchcore.cache import defaultCacheDir
+from patchcore.file import File, fileDigest
+from patchcore.games import GAMES
+from patchcore.output import atomicPath
+from patchcore import ui
+
+SAMPLE_COUNT = 64
+SAMPLE_SIZE = 64
+
+# ELF e_machine values
+MACHINES = {
+	0x03: "x86",
+	0x28: "armeabi-v7a",
+	0x3e: "x86_64",
+	0xb7: "arm64-v8a",
+}
+
+class Build():
+	"""
+	A known build of a game library
+	"""
+	
+	def __init__(self, game, version, abi):
+		self.game = game
+		self.version = version
+		self.abi = abi
+	
+	def __repr__(self):
+		return f"Build({self.game!r}, {self.version!r}, {self.abi!r})"
+	
+	def __eq__(self, other):
+		return isinstance(other, Build) and (self.game, self.version, self.abi) == (other.game, other.version, other.abi)
+	
+	def toDict(self):
+		return {"game": self.game, "version": self.version, "abi": self.abi}
+
+def getABI(f):
+	"""
+	Get the Android ABI name from the ELF header, or None if it isn't an ELF
+	file
+	"""
+	
+	header = f.read(0, 20)
+	
+	if (len(header) < 20 or header[:4] != b"\x7fELF"):
+		return None
+	
+	byteorder = "<" if header[5] == 1 else ">"
+	machine = struct.unpack(byteorder + "H", header[18:20])[0]
+	
+	return MACHINES.get(machine, f"machine {hex(machine)}")
+
+def sampleKey(f):
+	"""
+	Get a key made from the file size and a hash of evenly spaced samples and
+	the version strings, which only touches a few pages of the file
+	"""
+	
+	h = hashlib.sha256()
+	step = max(f.size // SAMPLE_COUNT, 1)
+	
+	for i in range(0, f.size, step):
+		h.update(f.read(i, SAMPLE_SIZE))
+	
+	for game in GAMES.values():
+		h.update(f.read(game.version_offset, 8))
+	
+	return f"{f.size}:{h.hexdigest()}"
+
+def probe(f):
+	"""
+	Identify a file by checking the version string of each game
+	"""
+	
+	abi = getABI(f)
+	
+	for game in GAMES.values():
+		if (game.version_offset + 5 <= f.size):
+			version = game.getVersion(f)
+			
+			if (version in game.versions):
+				return Build(game.name, version, abi)
+	
+	return None
+
+class BuildIndex():
+	"""
+	An index of known builds by sample key and, optionally, full digest,
+	saved as JSON. An index that can't be read is started again, since it
+	can always be rebuilt.
+	"""
+	
+	def __init__(self, path = None):
+		self.path = path
+		self.samples = {}
+		self.digests = {}
+		self.changed = False
+		
+		if (path and os.path.exists(path)):
+			try:
+				with open(path, "r") as f:
+					info = json.load(f)
+			except ValueError as e:
+				ui.showwarning("Build index", f"{path} is damaged ({e}), so builds will be identified again.")
+				info = {}
+			
+			self.samples = {key: Build(**build) for (key, build) in info.get("samples", {}).items()}
+			self.digests = {key: Build(**build) for (key, build) in info.get("digests", {}).items()}
+	
+	def add(self, build, sample_key = None, digest = None):
+		if (sample_key):
+			self.samples[sample_key] = build
+		
+		if (digest):
+			self.digests[digest] = build
+		
+		self.changed = True
+	
+	def save(self):
+		if (not self.path or not self.changed):
+			return
+		
+		os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok = True)
+		
+		# Other processes share the index, so it is never seen half written
+		with atomicPath(self.path) as temp:
+			with open(temp, "w") as f:
+				json.dump({
+					"samples": {key: build.toDict() for (key, build) in self.samples.items()},
+					"digests": {key: build.toDict() for (key, build) in self.digests.items()},
+				}, f, indent = "\t")
+		
+		self.changed = False
+
+def identify(location, index = None, digest = None):
+	"""
+	Identify a library, returning a Build. If a full digest of the file is
+	already known it is checked first. Raises an exception if the file isn't
+	a supported build.
+	"""
+	
+	if (index and digest in index.digests):
+		return index.digests[digest]
+	
+	with File(location, writable = False) as f:
+		key = sampleKey(f)
+		
+		if (index and key in index.samples):
+			return index.samples[key]
+		
+		build = probe(f)
+	
+	if (not build):
+		raise Exception(f"Sorry, this doesn't seem to be a supported version of {', '.join(game.library for game in GAMES.values())}.")
+	
+	if (index):
+		index.add(build, key, digest)
+	
+	return build
+
+def defaultIndex():
+	"""
+	Load the build index kept in the shared cache directory
+	"""
+	
+	return BuildIndex(os.path.join(defaultCacheDir(), "builds.json"))
+
+def gameFor(location, index = None, digest = None):
+	"""
+	Get the patch set for a library
+	"""
+	
+	if (isApk(location)):
+		# The version is checked when the library is read out of it
+		with Apk(location) as archive:
+			for game in GAMES.values():
+				if (ABI_DIR + game.library in archive.names):
+					return game
+		
+		raise Exception(f"Sorry, {location} doesn't contain an ARM64 {' or '.join(game.library for game in GAMES.values())}.")
+	
+	build = identify(location, index, digest)
+	
+	if (build.abi not in (None, "arm64-v8a")):
+		raise Exception(f"Sorry, this is a {build.abi} library, only ARM64 libraries are supported.")
+	
+	return GAMES[build.game]
+
+def main(argv = None):
+	parser = argparse.ArgumentParser(prog = "python -m patchcore.fingerprint", description = "Identify game libraries.")
+	parser.add_argument("-j", "--jobs", type = int, default = os.cpu_count(), help = "Number of threads to hash each file with")
+	parser.add_argument("files", nargs = "+", help = "Library files")
+	args = parser.parse_args(argv)
+	
+	index = defaultIndex()
+	failed = 0
+	
+	for path in args.files:
+		try:
+			digest = fileDigest(path, args.jobs)
+			build = identify(path, index, digest)
+			print(f"{path}\t{build.game}\t{build.version}\t{build.abi}\t{digest}")
+		except Exception as e:
+			print(f"{path}\tunknown\t{e}")
+			failed += 1
+	
+	index.save()
+	
+	return 1 if failed else 0
+
+if (__name__ == "__main__"):
+	sys.exit(main())
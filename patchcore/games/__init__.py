@@ -0,0 +1,11 @@
+"""
+Patch definitions for each supported game
+"""
+
+from patchcore.games import smashhit, commute, pinout
+
+GAMES = {
+	smashhit.GAME.name: smashhit.GAME,
+	commute.GAME.name: commute.GAME,
+	pinout.GAME.name: pinout.GAME,
+}
@@ -0,0 +1,14 @@
+"""
+libcommute.so patches
+"""
+
+from patchcore.registry import Game, Patch, Write
+
+GAME = Game("commute", "Does Not Commute", "libcommute.so", 0x20e350, ("1.4.6",), [
+	Patch("antitamper", [
+		Write(0x55a04, b"\x13\x00\x00\x14"),
+		Write(0x567a8, b"\x04\x00\x00\x14"),
+		Write(0x56854, b"\x1f\x20\x03\xd5"),
+		Write(0x56b08, b"\x3b\x00\x00\x14"),
+	]),
+])
@@ -0,0 +1,25 @@
+"""
+libpinout.so patches
+"""
+
+from patchcore.registry import Game, Patch, Write
+
+PREMIUM_NOTICE = ("Software copyright notice", "APKs where premium is patched should NOT be distrubuted, and this functionality is only available for users to extercise their right to modify software that they own for private use. If you do not own premium, you should delete the patched file immediately.")
+
+GAME = Game("pinout", "PinOut", "libpinout.so", 0x1e0170, ("1.0.5",), [
+	Patch("antitamper", [
+		Write(0x4581c, b"\x13\x00\x00\x14"),
+		Write(0x46594, b"\x04\x00\x00\x14"),
+		Write(0x468fc, b"\x3b\x00\x00\x14"),
+		Write(0x46b80, b"\x0a\x00\x00\x14"),
+	]),
+	Patch("premium", [
+		Write(0x75720, b"\x07\x00\x00\x14"),
+		Write(0x7bfb8, b"\x06\x00\x00\x14"),
+	], notice = PREMIUM_NOTICE),
+	Patch("variable_framerate", [
+		Write(0x1d4190, b"\x61\x5a\x41\xbd"), # gGame->timeStep = gGame->frameTime instead of gGame->timeStep = 0.0166667
+		Write(0x1d4bac, b"\x10\x00\x00\x14"), # update only once
+		Write(0x46a40, b"\x1f\x20\x03\xd5"), # remove frame limiter
+	]),
+])
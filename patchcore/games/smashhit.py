@@ -0,0 +1,237 @@
+"""
+libsmashhit.so patches (for both patch.py and patch2.py)
+"""
+
+from patchcore.registry import Game, Patch, Write, Encode
+from patchcore.arm64 import mov, subs, cmp, u32, f32, read_mov, read_subs, read_cmp, read_u32, read_f32
+from patchcore.elf import DATA
+from patchcore import ui
+
+PREMIUM_NOTICE = ("Software copyright notice", "APKs where premium is patched should NOT be distrubuted, and this functionality is only available for users to extercise their right to modify software that they own for private use. If you do not own premium, you should delete the patched file immediately.")
+
+def parse_key(value):
+	if (not value):
+		ui.showwarning("Change key warning", "The encryption key will be set to Smash Hit's default key, 5m45hh1t41ght, since you did not set one.")
+		value = "5m45hh1t41ght"
+	
+	key = value.encode('utf-8')
+	
+	if (len(key) >= 24):
+		ui.showwarning("Change key warning", "Your encryption key is longer than 23 bytes, so it has been truncated.")
+		key = key[:23]
+	
+	return key + (b"\x00" * (24 - len(key)))
+
+def parse_balls(value):
+	if (not value):
+		ui.showerror("Patch balls error", "You didn't put in a value for how many balls you want to start with. Balls won't be patched!")
+		return None
+	
+	return int(value)
+
+def parse_checkpoints(value):
+	if (not value):
+		ui.showerror("Checkpoints error", "You didn't put in a value for the number of checkpoints in your mod. Checkpoints won't be patched!")
+		return None
+	
+	value = int(value)
+	
+	if (value < 1 or value > 26):
+		ui.showerror("Checkpoints error", "The number of checkpoints (including start and endless) must be greater than 0 or less than 27!")
+		return None
+	
+	return value
+
+def parse_hit(value):
+	if (not value):
+		ui.showerror("Patch drop balls error", "You didn't put in a value for how many balls you want to drop when you hit something. Dropping balls won't be patched!")
+		return None
+	
+	return int(value)
+
+def parse_fov(value):
+	if (not value):
+		ui.showerror("Patch FoV error", "You didn't put in a value for the FoV you want. FoV won't be patched!")
+		return None
+	
+	return float(value)
+
+def parse_seconds(value):
+	value = float(value) if value else ""
+	
+	if (not value):
+		ui.showwarning("Patch room length in seconds warning", "You didn't put in a room length in seconds. Room length in seconds will be set to the default! (32)")
+		value = 32.0
+	
+	ui.showwarning("Patch room length in seconds warning", f"Changing the time a room takes breaks the game if you have improperly lengthed music. Music tracks must now be {value + 4} seconds long.")
+	
+	return value
+
+def parse_sprites(value):
+	n_rows = 2 ** int(value) * 8 if value else "" # Let this be a power of 2 because of floating-point roundoff error
+	
+	if (not value):
+		ui.showwarning("Patch sprite number warning", "You didn't put in a number of times to multiply. Number of rows will be set to the default! (8)")
+		n_rows = 8
+	
+	ui.showwarning("Patch sprite number warning", f"Changing the number of rows breaks the graphics if you don't add blank space at the bottom of sprites.png so the aspect ratio is 8:{n_rows}. Leave it as sprites.png.mp3 instead of converting to sprites.png.mtx to eliminate generation loss.")
+	
+	return n_rows
+
+GAME = Game("smashhit", "Smash Hit", "libsmashhit.so", 0x1f38a0, ("1.4.2", "1.4.3"), [
+	Patch("antitamper", [
+		Write(0x47130, b"\x1f\x20\x03\xd5"),
+		Write(0x474b8, b"\x3e\xfe\xff\x17"),
+		Write(0x47464, b"\x3a\x00\x00\x14"),
+		Write(0x47744, b"\x0a\x00\x00\x14"),
+		Write(0x4779c, b"\x1f\x20\x03\xd5"),
+		Write(0x475b4, b"\xff\xfd\xff\x17"),
+		Write(0x46360, b"\x13\x00\x00\x14"),
+	]),
+	Patch("premium", [
+		Write(0x5ace0, b"\x1f\x20\x03\xd5"),
+		Write(0x598cc, b"\x14\x00\x00\x14"),
+		Write(0x59720, b"\xa0\xc2\x22\x39"),
+		Write(0x58da8, b"\x36\x00\x00\x14"),
+		Write(0x57864, b"\xbc\x00\x00\x14"),
+		Write(0x566ec, b"\x04\x00\x00\x14"),
+	], notice = PREMIUM_NOTICE),
+	Patch("encryption", [
+		Write(0x567e8, b"\xc0\x03\x5f\xd6"),
+		Write(0x5672c, b"\xc0\x03\x5f\xd6"),
+	]),
+	Patch("key", [
+		Encode(0x1f3ca8, lambda key, old: key, size = 24, decode = lambda data: data.rstrip(b"\x00").decode("utf-8", errors = "replace"), sections = DATA),
+	], parse = parse_key),
+	Patch("balls", [
+		# Somehow, this works.
+		Encode(0x57cf4, mov, decode = read_mov),
+		Encode(0x57ff8, u32, decode = read_u32, sections = DATA),
+	], parse = parse_balls),
+	Patch("hit", [
+		Encode(0x715f0, subs, decode = read_subs), # Patch the number of balls to subtract from the score
+		Encode(0x71624, mov, decode = read_mov), # Patch the number of balls to drop
+		# This changes from "cmp w23,#0xa" to "cmp w23,w1" so that we don't
+		# need to make a specific patch for the comparision.
+		Write(0x7162c, b"\xff\x02\x01\x6b", original = b"\xff\x2a\x00\x71"),
+	], parse = parse_hit),
+	Patch("fov", [
+		Encode(0x1c945c, f32, decode = read_f32, sections = DATA),
+	], parse = parse_fov),
+	Patch("seconds", [
+		# Smash Hit normalises the value to the range [0.0, 1.0] so we need to take the inverse
+		Encode(0x73f80, lambda value, old: f32(1 / value, old), decode = lambda data: 1 / read_f32(data), sections = DATA),
+	], parse = parse_seconds),
+	Patch("checkpoints", [
+		# Internally, checkpoint balls and streaks are stored across 13 checkpoints across 6 modes.
+		# We need to change so that they're stored across 26 checkpoints across the first 3 modes (training, classic and mayhem).
+		
+		# Player::load
+		Write(0x574d0, b"\x3f\x67\x00\x71"), # cmp w25,#25
+		Write(0x57564, b"\x41\x03\x80\x52"), # mov w1,#26
+		
+		# Player::save
+		Write(0x57ac4, b"\x1f\x6b\x00\x71"), # cmp w24,#26
+		Write(0x57ad0, b"\x1f\x0c\x00\x71"), # cmp w0,#3 (saving now stops at mayhem instead of co-op)
+		Write(0x57aec, b"\x00\xa0\x01\x91"), # add x0,x0,#104 (26*4=104)
+		
+		# Player::reportCheckpoint
+		Write(0x57bac, b"\x5f\x60\x00\x71"), # cmp w2,#24
+		Write(0x57bb8, b"\x43\x03\x80\x52"), # mov w3,#26
+		
+		# Player::getHighScore
+		Write(0x57c10, b"\x5f\x60\x00\x71"), # cmp w2,#24
+		Write(0x57c20, b"\x42\x03\x80\xd2"), # mov x2,#26
+		Write(0x57c24, b"\x62\x7c\x02\x9b"), # mul x2,x3,x2
+		
+		# Player::getHighScoreStreak
+		Write(0x57c40, b"\x7f\x60\x00\x71"), # cmp w3,#24
+		Write(0x57c4c, b"\x42\x03\x80\xd2"), # mov x2,#26
+		Write(0x57c50, b"\x62\x7c\x02\x9b"), # mul x2,x3,x2
+		
+		# Player::loadCheckpoint
+		Write(0x57c84, b"\x1f\x60\x00\x71"), # cmp w0,#24
+		Write(0x57c94, b"\x43\x03\x80\x52"), # mov w3,#26
+		
+		# Distance scaling below endless mode which is the last checkpoint
+		Encode(0x6b418, lambda value, old: cmp(value - 2, old), decode = lambda data: read_cmp(data) + 2), # w0,#value-2
+		
+		# This is in an unused function but I will patch it anyways.
+		Encode(0x58010, mov, decode = read_mov),
+		
+		# Change the special cases for zen/versus/co-op menu meshes from 14/15/16 to 27/28/29
+		Write(0x78658, b"\x1f\x6f\x00\x71"), # cmp w24,#27
+		Write(0x78660, b"\x1f\x73\x00\x71"), # cmp w24,#28
+		Write(0x78668, b"\x1f\x77\x00\x71"), # cmp w24,#29
+		Write(0x7b450, b"\x66\x03\x80\x52"), # mov w6,#27
+		Write(0x7b444, b"\x86\x03\x80\x52"), # mov w6,#28
+		Write(0x799e0, b"\xa6\x03\x80\x52"), # mov w6,#29
+		
+		# Number of meshes rendered in training/classic/mayhem mode menus
+		Encode(0x799e8, mov, decode = read_mov),
+	], parse = parse_checkpoints),
+	Patch("realpaths_segments", [
+		Write(0x2119f8, b"\x00", sections = DATA),
+	]),
+	Patch("realpaths", [
+		Write(0x2118e8, b"\x00", sections = DATA),
+		Write(0x1f48c0, b"\x00", sections = DATA),
+	]),
+	Patch("package", [
+		### This was the THIRD ATTEMPT to make it work.
+		# It works by chaining it on after luaopen_base
+		# This one worked, even if its the worst hack :D
+		Write(0xa71b8, b"\xe0\x03\x13\xaa"), # Preserve param_1
+		Write(0xa71c8, b"\xb8\x0e\x00\x14"), # Chain to luaopen_package
+		Write(0xaaef4, b"\xe0\x03\x13\xaa"), # Preserve param_1
+		Write(0xaaf08, b"\xb1\xf0\xff\x17"), # Chain to luaopen_io
+		Write(0xa748c, b"\xe0\x03\x13\xaa"), # Preserve param_1
+		Write(0xa74a0, b"\xd1\xfe\xff\x17"), # Chain to luaopen_os
+		Write(0xa7004, b"\xa0\x00\x80\x52"), # Set return to 5 (2 + 1 + 1 + 1 = 5)
+		Write(0xa7010, b"\xc0\x03\x5f\xd6"), # Make sure last is return (not really needed)
+	]),
+	Patch("vertical", [
+		Write(0x46828, b"\x47\x00\x00\x14"), # Patch an if (gWidth < gHeight)
+		Write(0x4693c, b"\x71\x00\x00\x14"), # Another if ...
+		Write(0x46a48, b"\x1f\x20\x03\xd5"),
+	]),
+	Patch("roomlength", [
+		Write(0x6b6d4, b"\x1f\x20\x03\xd5"), # Patch to use length property instead of 200 in versus/co-op
+	]),
+	Patch("sprites", [
+		Encode(0x4e9ac, lambda n_rows, old: mov(n_rows, b"\x02\x01\x80\x52"), decode = lambda data: (read_mov(data) // 8).bit_length() - 1),
+		Write(0x4e9c0, b"\x03\x01\x80\x52"),
+		
+		# Menu clouds
+		# Overwrite 2 unused nops in 0x44134 and 0x44138
+		Write(0x7a9fc, b"\xc3\xb9\xe4\x1c", original = b"\x03\x10\x2a\x1e"), # ldr s3,0x144134 (was fmov s3,0.25)
+		Write(0x7aab0, b"\x22\xb4\xe4\x1c", original = b"\x02\x10\x2a\x1e"), # ldr s2,0x144134 (was fmov s2,0.25)
+		Write(0x7ab58, b"\x00\xaf\xe4\x1c", original = b"\x00\x10\x28\x1e"), # ldr s0,0x144138 (was fmov s0,0.125)
+		Write(0x7abfc, b"\xe0\xa9\xe4\x1c", original = b"\x00\x10\x28\x1e"), # ldr s0,0x144138 (was fmov s0,0.125)
+		Encode(0x44134, lambda n_rows, old: f32(2 / n_rows, old), sections = DATA),
+		Encode(0x44138, lambda n_rows, old: f32(1 / n_rows, old), sections = DATA),
+	], parse = parse_sprites),
+	
+	# From patch2.py
+	Patch("bosses", [
+		Write(0x6b84c, b"\x0f\x00\x00\x14"),
+	]),
+	Patch("training_rng", [
+		Write(0x190c00, b"\x3c\x00\x00\x14"),
+	]),
+	Patch("training_ballcount", [
+		Write(0x6ba5c, b"\x06\x00\x00\x14"),
+	]),
+	Patch("low_quality_decals", [
+		Write(0x17d31c, b"\x1f\x20\x03\xd5"),
+	]),
+	Patch("variable_framerate", [
+		# gGame->timeStep = gGame->frameTime instead of gGame->timeStep = 0.0166667
+		Write(0x1e39f8, b"\x00\x54\x44\xf9"),
+		Write(0x1e39fc, b"\x00\x00\x40\xf9"),
+		Write(0x1e3a00, b"\x01\x60\x41\xb9"),
+		
+		Write(0x1e810c, b"\x1f\x20\x03\xd5"), # update only once
+		Write(0x475a0, b"\x1f\x20\x03\xd5"), # remove frame limiter
+	]),
+])
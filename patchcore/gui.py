@@ -0,0 +1,377 @@
+"""
+Tk front end shared by the patcher scripts
+
+This is only imported when a GUI is actually started, so the rest of
+patchcore can be used without Tk or a display.
+"""
+
+import concurrent.futures
+import os
+import queue
+import tkinter
+import tkinter.ttk as ttk
+import tkinter.messagebox
+import tkinter.filedialog
+
+from patchcore.cache import PlanCache, normalise
+from patchcore.games import GAMES
+from patchcore.presets import Preset, loadPreset, presetDir
+from patchcore import ui
+
+class Window():
+	"""
+	Window thing
+	"""
+	
+	def __init__(self, title, size, class_name = "Application"):
+		"""
+		Initialise the window
+		"""
+		
+		self.window = tkinter.Tk(className = class_name)
+		self.window.title(title)
+		self.window.geometry(size)
+		
+		self.position = -25
+		self.gap = 35
+		
+		# Main frame
+		ttk.Frame(self.window)
+	
+	def getYPos(self, flush = False):
+		self.position += self.gap if not flush else 0
+		
+		return self.position
+	
+	def label(self, content):
+		"""
+		Create a label
+		"""
+		
+		label = tkinter.Label(self.window, text = content)
+		label.place(x = 10, y = self.getYPos())
+		
+		return label
+	
+	def button(self, content, action, inline = False):
+		button = tkinter.Button(self.window, text = content, command = action)
+		
+		if (not inline):
+			button.place(x = 10, y = self.getYPos())
+		else:
+			button.place(x = 300, y = self.getYPos(True))
+		
+		return button
+	
+	def progressbar(self):
+		"""
+		Create a progress bar
+		"""
+		
+		bar = ttk.Progressbar(self.window, orient = "horizontal", length = 480, mode = "determinate")
+		bar.place(x = 10, y = self.getYPos())
+		
+		return bar
+	
+	def textbox(self, inline = False):
+		"""
+		Create a textbox
+		"""
+		
+		entry = tkinter.Entry(self.window, width = (70 if not inline else 28))
+		
+		if (not inline):
+			entry.place(x = 10, y = self.getYPos())
+		else:
+			entry.place(x = 300, y = self.getYPos(True))
+		
+		return entry
+	
+	def checkbox(self, content, default = False):
+		"""
+		Create a tickbox
+		"""
+		
+		var = tkinter.IntVar()
+		
+		tick = tkinter.Checkbutton(self.window, text = content, variable = var, onvalue = 1, offvalue = 0)
+		tick.place(x = 10, y = self.getYPos())
+		
+		var.set(1 if default else 0)
+		
+		return var
+	
+	def main(self):
+		self.window.mainloop()
+
+class Messages():
+	"""
+	patchcore.ui backend for worker threads. Tk can only be used from the
+	thread running the mainloop, so messages are put on the event queue and
+	shown from there.
+	"""
+	
+	def __init__(self, events):
+		self.events = events
+	
+	def showinfo(self, title, message):
+		self.events.put(("message", tkinter.messagebox.showinfo, title, message))
+	
+	def showwarning(self, title, message):
+		self.events.put(("message", tkinter.messagebox.showwarning, title, message))
+	
+	def showerror(self, title, message):
+		self.events.put(("message", tkinter.messagebox.showerror, title, message))
+
+class Runner():
+	"""
+	Patches a list of files on worker threads. Results come back to the Tk
+	thread as ("done", path, error or None, summary) events on the events
+	queue, where summary says what happened to each patch.
+	"""
+	
+	def __init__(self, apply, events, jobs = None):
+		self.apply = apply
+		self.events = events
+		self.jobs = jobs or min(8, os.cpu_count() or 1)
+		self.pool = None
+		self.futures = []
+	
+	def start(self, paths, patches, plans = None):
+		self.pool = concurrent.futures.ThreadPoolExecutor(self.jobs)
+		self.futures = [self.pool.submit(self.run, path, patches, plans) for path in paths]
+		self.pool.shutdown(wait = False)
+	
+	def run(self, path, patches, plans):
+		try:
+			plan = self.apply(path, patches, plans = plans)
+			self.events.put(("done", path, None, plan.summary() or f"{len(plan)} writes (cached)"))
+		except Exception as e:
+			self.events.put(("done", path, str(e), None))
+	
+	def cancel(self):
+		"""
+		Cancel the files that haven't been started. Files that are being
+		patched are finished, so none are left half patched.
+		"""
+		
+		for future in self.futures:
+			future.cancel()
+	
+	def finished(self):
+		return all(future.done() for future in self.futures)
+
+def gui(title, size, game_title, library, options, apply, default_paths = None):
+	"""
+	Show the patcher window. options is a list of (patch name, checkbox text,
+	takes a value, ticked by default) and apply is called with the file path
+	and the patches dict, on a worker thread, for each selected file. When
+	the options are the same as a loaded preset, apply is also given a
+	patchcore.cache.PlanCache as plans.
+	"""
+	
+	w = Window(title, size)
+	events = queue.Queue()
+	runner = Runner(apply, events)
+	
+	# Messages from the patches can come from any thread
+	ui.setBackend(Messages(events))
+	
+	w.label(f"This tool will let you add common patches to {game_title}'s main binary.")
+	
+	filetypes = (("Shared objects", "*.so"), ("Android packages", "*.apk"), ("All files", "*.*"))
+	paths = list(default_paths or tkinter.filedialog.askopenfilenames(title = f"Pick {library} (or more than one)", filetypes = filetypes))
+	
+	files_label = w.label("")
+	
+	def showFiles():
+		files_label.config(text = f"{len(paths)} file{'s' if len(paths) != 1 else ''} selected")
+	
+	def addFiles():
+		"""
+		Callback to run when the "Add files..." button is clicked
+		"""
+		
+		for path in tkinter.filedialog.askopenfilenames(title = f"Pick {library}", filetypes = filetypes):
+			if (path not in paths):
+				paths.append(path)
+		
+		showFiles()
+	
+	showFiles()
+	add_button = w.button("Add files...", addFiles, True)
+	
+	game = next((name for (name, g) in GAMES.items() if g.library == library), None)
+	preset_files = (("Presets", "*.json"), ("All files", "*.*"))
+	loaded = {"preset": None}
+	
+	def loadClicked():
+		"""
+		Callback to run when the "Load preset..." button is clicked
+		"""
+		
+		path = tkinter.filedialog.askopenfilename(title = "Load preset", initialdir = presetDir(), filetypes = preset_files)
+		
+		if (not path):
+			return
+		
+		try:
+			preset = loadPreset(path)
+			
+			if (preset.game not in (None, game)):
+				raise Exception(f"The preset {preset.name} is for {preset.game}, not {game}.")
+			
+			for (name, field) in fields.items():
+				if (name.endswith("_val")):
+					field.delete(0, "end")
+					field.insert(0, preset.patches.get(name, ""))
+				else:
+					field.set(1 if preset.patches.get(name) else 0)
+			
+			loaded["preset"] = preset
+			status.config(text = f"Loaded preset {preset.name}")
+		except Exception as e:
+			tkinter.messagebox.showerror("Error", str(e))
+	
+	def saveClicked():
+		"""
+		Callback to run when the "Save preset..." button is clicked
+		"""
+		
+		os.makedirs(presetDir(), exist_ok = True)
+		path = tkinter.filedialog.asksaveasfilename(title = "Save preset", initialdir = presetDir(), defaultextension = ".json", filetypes = preset_files)
+		
+		if (not path):
+			return
+		
+		try:
+			preset = Preset(os.path.splitext(os.path.basename(path))[0], game, {name: field.get() for (name, field) in fields.items()})
+			preset.save(path)
+			
+			loaded["preset"] = preset
+			status.config(text = f"Saved preset {preset.name}")
+		except Exception as e:
+			tkinter.messagebox.showerror("Error", str(e))
+	
+	w.button("Load preset...", loadClicked)
+	w.button("Save preset...", saveClicked, True)
+	
+	w.label("(Note: If you have issues typing in boxes, try clicking off and on the window first.)")
+	w.label("Please select what patches you would like to apply:")
+	
+	fields = {}
+	
+	for (name, text, has_value, default) in options:
+		fields[name] = w.checkbox(text, default = default)
+		
+		if (has_value):
+			fields[name + "_val"] = w.textbox(True)
+	
+	state = {"total": 0, "done": 0, "failed": [], "shown": set()}
+	
+	def x():
+		"""
+		Callback to run when the "Patch game binary!" button is clicked
+		"""
+		
+		if (not paths):
+			tkinter.messagebox.showerror("Error", f"No {library} files have been selected.")
+			return
+		
+		# Tk variables can only be read here, so the worker threads get a copy
+		patches = {name: field.get() for (name, field) in fields.items()}
+		
+		state.update(total = len(paths), done = 0, failed = [], shown = set(), summaries = {})
+		progress.config(maximum = len(paths), value = 0)
+		status.config(text = f"Patching {len(paths)} file{'s' if len(paths) != 1 else ''}...")
+		patch_button.config(state = "disabled")
+		add_button.config(state = "disabled")
+		cancel_button.config(state = "normal")
+		
+		# A preset that hasn't been changed can reuse its compiled writes
+		preset = loaded["preset"]
+		plans = PlanCache() if (preset and normalise(patches) == preset.patches) else None
+		
+		runner.start(list(paths), patches, plans)
+		w.window.after(50, poll)
+	
+	def poll():
+		"""
+		Handle events from the worker threads, and finish up once they are done
+		"""
+		
+		# Checked first, since a worker always queues its result before it is done
+		finished = runner.finished()
+		
+		while (True):
+			try:
+				event = events.get_nowait()
+			except queue.Empty:
+				break
+			
+			if (event[0] == "message"):
+				kind, title, message = event[1:]
+				
+				# The same warning comes from every file, so only show it once
+				if ((title, message) not in state["shown"]):
+					state["shown"].add((title, message))
+					kind(title, message)
+			elif (event[0] == "done"):
+				path, error, summary = event[1:]
+				state["done"] += 1
+				
+				if (error):
+					state["failed"].append(f"{os.path.basename(path)}: {error}")
+				else:
+					state["summaries"].setdefault(summary, []).append(os.path.basename(path))
+				
+				progress.config(value = state["done"])
+				status.config(text = f"Patched {state['done']} of {state['total']} files")
+		
+		if (not finished):
+			w.window.after(50, poll)
+			return
+		
+		patch_button.config(state = "normal")
+		add_button.config(state = "normal")
+		cancel_button.config(state = "disabled")
+		
+		skipped = state["total"] - state["done"]
+		status.config(text = f"Patched {state['done'] - len(state['failed'])} of {state['total']} files" + (f", {skipped} cancelled" if skipped else ""))
+		
+		if (state["failed"]):
+			tkinter.messagebox.showerror("Error", "\n".join(state["failed"]))
+		elif (not skipped):
+			# Files patched the same way are listed together
+			summaries = state["summaries"]
+			details = next(iter(summaries)) if len(summaries) == 1 else "\n".join(f"{', '.join(sorted(names))}: {summary}" for (summary, names) in summaries.items())
+			message = f"Your {library.removesuffix('.so')} has been patched succesfully!" if state["total"] == 1 else f"All {state['total']} files have been patched succesfully!"
+			tkinter.messagebox.showinfo("Success", f"{message}\n\n{details}")
+	
+	def cancel():
+		"""
+		Callback to run when the "Cancel" button is clicked
+		"""
+		
+		runner.cancel()
+		status.config(text = "Cancelling...")
+	
+	patch_button = w.button("Patch game binary!", x)
+	cancel_button = w.button("Cancel", cancel, True)
+	cancel_button.config(state = "disabled")
+	progress = w.progressbar()
+	status = w.label("")
+	
+	w.main()
+
+def main(*args, **kwargs):
+	"""
+	Run the GUI, showing any errors in a message box
+	"""
+	
+	ui.setBackend(tkinter.messagebox)
+	
+	try:
+		gui(*args, **kwargs)
+	except Exception as e:
+		tkinter.messagebox.showerror("Fatal error", str(e))
@@ -0,0 +1,216 @@
+"""
+Undo journals: the bytes a patch run replaced, so it can be reverted
+
+A journal is a few kilobytes of JSON with the (offset, original bytes, new
+bytes) of every write and the digests of the library before and after, so
+history can be kept for many builds without keeping a pristine copy of each.
+Journals are stored by the digest of the patched library, so reverting a
+file only needs the file itself.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import sys
+
+from patchcore.apk import ABI_DIR, Apk, isApk, openLibrary
+from patchcore.file import File, bufferDigest
+from patchcore.output import atomicOutput, atomicPath
+from patchcore import defaultCacheDir
+
+class Journal():
+	"""
+	A list of (offset, original, new) records for a library, and the
+	digests of the library before and after they were written
+	"""
+	
+	def __init__(self, game, before, after = None, records = None):
+		self.game = game
+		self.before = before
+		self.after = after
+		self.records = records or []
+	
+	@classmethod
+	def start(cls, f, plan):
+		"""
+		Start a journal for a plan that is about to be applied to a file
+		"""
+		
+		journal = cls(plan.game, bufferDigest(f.map))
+		journal.records = [(offset, f.read(offset, len(data)), data) for (offset, data, name) in plan.writes]
+		
+		return journal
+	
+	def finish(self, f):
+		"""
+		Finish the journal once the plan has been flushed to the file
+		"""
+		
+		self.after = bufferDigest(f.map)
+		
+		# Writes that didn't change anything don't need to be undone
+		self.records = [(offset, old, new) for (offset, old, new) in self.records if old != new]
+	
+	def toJSON(self):
+		return json.dumps({
+			"game": self.game,
+			"before": self.before,
+			"after": self.after,
+			"records": [[offset, old.hex(), new.hex()] for (offset, old, new) in self.records],
+		})
+	
+	@classmethod
+	def fromJSON(cls, text):
+		info = json.loads(text)
+		records = [(offset, bytes.fromhex(old), bytes.fromhex(new)) for (offset, old, new) in info["records"]]
+		return cls(info["game"], info["before"], info["after"], records)
+	
+	def save(self, path = None):
+		"""
+		Save the journal, by default in the journal store, returning its path
+		"""
+		
+		path = path or journalPath(self.after)
+		os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok = True)
+		
+		# A half written journal couldn't revert anything
+		with atomicPath(path) as temp:
+			with open(temp, "w") as f:
+				f.write(self.toJSON())
+		
+		return path
+	
+	def revert(self, f):
+		"""
+		Put the original bytes back in an open file and check that the result
+		is the original library. Only the journalled bytes are read and
+		written until the final digest check.
+		"""
+		
+		for (offset, old, new) in self.records:
+			if (f.read(offset, len(new)) != new):
+				raise Exception(f"The bytes at {hex(offset)} aren't the ones this journal wrote, so it can't be used to revert this file.")
+		
+		for (offset, old, new) in self.records:
+			f.patch(offset, old)
+		
+		f.flush()
+		
+		if (bufferDigest(f.map) != self.before):
+			# Put it back the way it was rather than leaving something unknown
+			for (offset, old, new) in self.records:
+				f.patch(offset, new)
+			
+			f.flush()
+			
+			raise Exception("Reverting didn't give the original library, so the file has been left patched.")
+
+def journalPath(digest):
+	return os.path.join(defaultCacheDir(), "journals", f"{digest}.json")
+
+def loadJournal(path):
+	with open(path, "r") as f:
+		return Journal.fromJSON(f.read())
+
+def findJournal(digest):
+	"""
+	Get the stored journal for a patched library digest, or None
+	"""
+	
+	try:
+		return loadJournal(journalPath(digest))
+	except FileNotFoundError:
+		return None
+
+@contextlib.contextmanager
+def openPatched(location, output = None, library = None):
+	"""
+	Open a library (or the ARM64 library in an APK) for reverting, writing
+	the result to output if given
+	"""
+	
+	if (isApk(location)):
+		if (not library):
+			# Find the library that has a journal
+			with Apk(location) as archive:
+				for entry in archive.entries:
+					if (entry.name.startswith(ABI_DIR) and findJournal(bufferDigest(archive.read(entry)))):
+						library = entry.name[len(ABI_DIR):]
+						break
+				else:
+					raise Exception(f"None of the libraries in {location} have a journal.")
+		
+		with openLibrary(location, library, output) as f:
+			yield f
+	elif (output):
+		with atomicOutput(location, output) as temp:
+			with File(temp) as f:
+				yield f
+	else:
+		with File(location) as f:
+			yield f
+
+def revertFile(location, journal = None, output = None, every = False):
+	"""
+	Revert a patched library using the given journal, or the stored journal
+	for its digest. With every, keep reverting while there are journals for
+	the result, undoing several patch runs. Returns the journals used. For an
+	APK only the library is reverted; the APK still has to be signed again.
+	"""
+	
+	used = []
+	
+	with openPatched(location, output) as f:
+		while (True):
+			current = journal or findJournal(bufferDigest(f.map))
+			journal = None
+			
+			if (not current):
+				if (not used):
+					raise Exception(f"There is no journal for {location}.")
+				
+				break
+			
+			current.revert(f)
+			used.append(current)
+			
+			if (not every):
+				break
+	
+	return used
+
+def main(argv = None):
+	parser = argparse.ArgumentParser(prog = "python -m patchcore.journal", description = "Revert patched libraries using their undo journals.")
+	commands = parser.add_subparsers(dest = "command", required = True)
+	
+	revert = commands.add_parser("revert", help = "Put the original bytes back")
+	revert.add_argument("-j", "--journal", default = None, help = "Journal to use (by default the stored one for the file)")
+	revert.add_argument("-o", "--output", default = None, help = "Write the reverted file here instead of in place")
+	revert.add_argument("--all", dest = "every", action = "store_true", help = "Undo every journalled patch run, not just the last one")
+	revert.add_argument("file", help = "Patched library or APK")
+	
+	show = commands.add_parser("show", help = "List the writes in a journal")
+	show.add_argument("journal", help = "Journal file")
+	
+	args = parser.parse_args(argv)
+	
+	try:
+		if (args.command == "revert"):
+			journal = loadJournal(args.journal) if args.journal else None
+			used = revertFile(args.file, journal, args.output, args.every)
+			print(f"Reverted {len(used)} patch run{'s' if len(used) != 1 else ''}, {sum(len(j.records) for j in used)} writes")
+		else:
+			journal = loadJournal(args.journal)
+			print(f"{journal.game}\t{journal.before} -> {journal.after}")
+			
+			for (offset, old, new) in journal.records:
+				print(f"{hex(offset)}\t{old.hex()}\t{new.hex()}")
+	except Exception as e:
+		print(f"Error: {e}", file = sys.stderr)
+		return 1
+	
+	return 0
+
+if (__name__ == "__main__"):
+	sys.exit(main())
@@ -0,0 +1,119 @@
+"""
+Copy-on-write output: patched files are written next to the destination
+and renamed over it, so the input is never left half patched
+"""
+
+import contextlib
+import os
+import shutil
+import tempfile
+
+try:
+	import fcntl
+except ImportError:
+	fcntl = None
+
+# From linux/fs.h
+FICLONE = 0x40049409
+
+def cloneFile(src, dst):
+	"""
+	Copy a file, sharing the data with a reflink if the filesystem supports it
+	and otherwise letting the kernel do the copy. Returns how it was copied.
+	"""
+	
+	with open(src, "rb") as i, open(dst, "wb") as o:
+		if (fcntl):
+			try:
+				fcntl.ioctl(o.fileno(), FICLONE, i.fileno())
+				return "reflink"
+			except OSError:
+				pass
+		
+		if (hasattr(os, "copy_file_range")):
+			try:
+				remaining = os.fstat(i.fileno()).st_size
+				
+				while (remaining > 0):
+					copied = os.copy_file_range(i.fileno(), o.fileno(), remaining)
+					
+					if (copied == 0):
+						break
+					
+					remaining -= copied
+				
+				return "copy_file_range"
+			except OSError:
+				i.seek(0)
+				o.seek(0)
+				o.truncate()
+		
+		shutil.copyfileobj(i, o, 1 << 20)
+		return "copy"
+
+def copyRange(src, dst, offset, length):
+	"""
+	Copy length bytes from offset in the file descriptor src to the current
+	position of dst, in the kernel where possible
+	"""
+	
+	if (hasattr(os, "copy_file_range")):
+		try:
+			while (length > 0):
+				copied = os.copy_file_range(src, dst, length, offset)
+				
+				if (copied == 0):
+					raise Exception("The file ended before everything was copied.")
+				
+				offset += copied
+				length -= copied
+			
+			return
+		except OSError:
+			pass
+	
+	while (length > 0):
+		data = os.pread(src, min(length, 1 << 20), offset)
+		
+		if (not data):
+			raise Exception("The file ended before everything was copied.")
+		
+		offset += len(data)
+		length -= len(data)
+		
+		while (data):
+			data = data[os.write(dst, data):]
+
+@contextlib.contextmanager
+def atomicPath(dst):
+	"""
+	Give the path of a new temporary file in the same directory as dst, and
+	rename it over dst if the block finishes without an exception
+	"""
+	
+	fd, temp = tempfile.mkstemp(prefix = ".", suffix = ".tmp", dir = os.path.dirname(os.path.abspath(dst)))
+	os.close(fd)
+	
+	try:
+		yield temp
+		
+		os.replace(temp, dst)
+	except BaseException:
+		if (os.path.exists(temp)):
+			os.unlink(temp)
+		
+		raise
+
+@contextlib.contextmanager
+def atomicOutput(src, dst):
+	"""
+	Clone src to a temporary file in the same directory as dst and give its
+	path, then rename it over dst if the block finishes without an exception.
+	src and dst can be the same file.
+	"""
+	
+	with atomicPath(dst) as temp:
+		cloneFile(src, temp)
+		shutil.copymode(src, temp)
+		
+		yield temp
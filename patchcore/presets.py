@@ -0,0 +1,141 @@
+"""
+Named presets: saved selections of patches and their values
+
+A preset is a JSON file with the game and a patches dict like the one the
+GUI builds ({"antitamper": true, "balls": true, "balls_val": "10"}).
+Presets are kept in the presets directory under the config directory, but
+any path to a preset file works too. Applying a preset goes through a
+patchcore.cache.PlanCache, so after the first time it is used on a build
+its writes are just replayed.
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+
+from patchcore.cache import normalise
+from patchcore.games import GAMES
+from patchcore.registry import parseSelection
+from patchcore import defaultConfigDir
+
+class Preset():
+	"""
+	A named selection of patches for a game
+	"""
+	
+	def __init__(self, name, game, patches):
+		self.name = name
+		self.game = game
+		self.patches = normalise(patches)
+	
+	def toJSON(self):
+		return json.dumps({"game": self.game, "patches": self.patches}, indent = "\t")
+	
+	@classmethod
+	def fromJSON(cls, name, text):
+		info = json.loads(text)
+		
+		if (type(info) != dict or type(info.get("patches")) != dict):
+			raise Exception(f"The preset {name} isn't valid.")
+		
+		return cls(name, info.get("game"), info["patches"])
+	
+	def save(self, path = None):
+		"""
+		Save the preset, by default in the presets directory, returning its
+		path
+		"""
+		
+		path = path or presetPath(self.name)
+		os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok = True)
+		
+		with open(path, "w") as f:
+			f.write(self.toJSON())
+		
+		return path
+
+def presetDir():
+	return os.path.join(defaultConfigDir(), "presets")
+
+def presetPath(name):
+	return os.path.join(presetDir(), f"{name}.json")
+
+def loadPreset(name):
+	"""
+	Load a preset by name from the presets directory, or from a path
+	"""
+	
+	path = name if (os.sep in name or name.endswith(".json")) else presetPath(name)
+	
+	try:
+		with open(path, "r") as f:
+			return Preset.fromJSON(os.path.splitext(os.path.basename(path))[0], f.read())
+	except FileNotFoundError:
+		raise Exception(f"There is no preset called {name}.")
+
+def listPresets(game = None):
+	"""
+	Get the presets in the presets directory, optionally only for one game
+	"""
+	
+	presets = []
+	
+	for path in sorted(glob.glob(os.path.join(presetDir(), "*.json"))):
+		try:
+			preset = loadPreset(path)
+		except Exception:
+			continue
+		
+		if (game is None or preset.game in (None, game)):
+			presets.append(preset)
+	
+	return presets
+
+def main(argv = None):
+	parser = argparse.ArgumentParser(prog = "python -m patchcore.presets", description = "Save and list patch presets.")
+	commands = parser.add_subparsers(dest = "command", required = True)
+	
+	save = commands.add_parser("save", help = "Save a preset")
+	save.add_argument("-g", "--game", required = True, help = "Which game the preset is for")
+	save.add_argument("-p", "--patch", action = "append", default = [], metavar = "NAME[=VALUE]", help = "A patch to include, with an optional value (can be given many times)")
+	save.add_argument("name", help = "Name of the preset")
+	
+	show = commands.add_parser("show", help = "Show the patches in a preset")
+	show.add_argument("name", help = "Name of (or path to) the preset")
+	
+	commands.add_parser("list", help = "List the saved presets")
+	
+	args = parser.parse_args(argv)
+	
+	try:
+		if (args.command == "save"):
+			if (args.game not in GAMES):
+				raise Exception(f"Unknown game {args.game}.")
+			
+			patches = parseSelection(args.patch)
+			unknown = [name for name in patches if not name.endswith("_val") and name not in GAMES[args.game].patches]
+			
+			if (unknown):
+				raise Exception(f"Unknown patches for {args.game}: {', '.join(unknown)}")
+			
+			print(Preset(args.name, args.game, patches).save())
+		elif (args.command == "show"):
+			preset = loadPreset(args.name)
+			print(f"{preset.name} ({preset.game})")
+			
+			for (name, value) in preset.patches.items():
+				if (not name.endswith("_val")):
+					print(f"\t{name}" + (f" = {preset.patches[name + '_val']}" if name + "_val" in preset.patches else ""))
+		else:
+			for preset in listPresets():
+				print(f"{preset.name}\t{preset.game}\t{' '.join(name for name in preset.patches if not name.endswith('_val'))}")
+	except Exception as e:
+		print(f"Error: {e}", file = sys.stderr)
+		return 1
+	
+	return 0
+
+if (__name__ == "__main__"):
+	sys.exit(main())
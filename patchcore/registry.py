@@ -0,0 +1,689 @@
+"""
+Declarative patch definitions and compiled write plans
+
+Each game has a set of patches, and each patch is a list of sites: either
+fixed bytes (Write) or bytes computed from the patch value and the bytes
+already at that location (Encode). Selecting some patches and compiling them
+against a file gives a Plan, a sorted list of writes that can be inspected,
+saved and applied in one pass.
+
+A site can also name where it is as a symbol plus an offset into it, like
+Player::load+0x40. Builds that have the symbol use that instead of the raw
+offset, so the patch still finds its place when code moves between builds.
+The raw offset is used for builds without the symbol, like stripped ones.
+"""
+
+import bisect
+import copy
+import json
+import os
+import struct
+
+from patchcore.file import File, fileDigest
+from patchcore.output import atomicOutput
+from patchcore.journal import Journal
+from patchcore import apk, arm64, elf, trace, ui, verify
+
+class Write():
+	"""
+	Write some fixed bytes at an offset
+	
+	sections are the ELF sections the site can be in (see patchcore.elf),
+	.text unless it is data. symbol is an optional symbol+offset name for the
+	site, used instead of offset in builds that have the symbol.
+	"""
+	
+	def __init__(self, offset, data, original = None, sections = elf.TEXT, symbol = None):
+		self.offset = offset
+		self.data = data
+		self.size = len(data)
+		self.original = original
+		self.sections = sections
+		self.symbol = symbol
+	
+	def build(self, f, value):
+		return self.data
+	
+	def buildFrom(self, old, value):
+		return self.data
+	
+	def needsCheck(self, original, data, value):
+		return True
+
+class Encode():
+	"""
+	Write bytes made by an encoder from the patch value and the old bytes
+	
+	decode optionally goes the other way, from the bytes in a patched file to
+	the value the user gave, so the value can be recovered later. sections
+	and symbol are like Write's.
+	"""
+	
+	def __init__(self, offset, encode, size = 4, original = None, decode = None, sections = elf.TEXT, symbol = None):
+		self.offset = offset
+		self.encode = encode
+		self.size = size
+		self.original = original
+		self.decode = decode
+		self.sections = sections
+		self.symbol = symbol
+	
+	def build(self, f, value):
+		return self.buildFrom(f.read(self.offset, self.size), value)
+	
+	def buildFrom(self, old, value):
+		data = self.encode(value, old)
+		
+		if (len(data) != self.size):
+			raise Exception(f"Encoder for {hex(self.offset)} made {len(data)} bytes instead of {self.size}.")
+		
+		return data
+	
+	def buildMany(self, f, values):
+		"""
+		Build the bytes for each of a list of values, all at once if the
+		encoder has an array version
+		"""
+		
+		old = f.read(self.offset, self.size)
+		encode = arm64.MANY_ENCODERS.get(self.encode)
+		
+		if (encode is None):
+			return [self.buildFrom(old, value) for value in values]
+		
+		data = arm64.words_to_bytes_arm64(encode(struct.unpack("<I", old)[0], values))
+		
+		return [data[i:i + 4] for i in range(0, len(data), 4)]
+	
+	def needsCheck(self, original, data, value):
+		# Only if the bytes kept from the file are different from the original
+		return self.buildFrom(original, value) != data
+
+class Patch():
+	"""
+	A named patch made of some sites
+	
+	parse is given the patch value (usually a string from the GUI) and returns
+	the value passed to the encoders, or None to skip the patch. notice is a
+	(title, message) warning shown whenever the patch is used.
+	"""
+	
+	def __init__(self, name, sites, parse = None, notice = None):
+		self.name = name
+		self.sites = sites
+		self.parse = parse
+		self.notice = notice
+
+class SiteIndex():
+	"""
+	An interval index over the byte ranges of every site in a set of patches
+	
+	Sites are kept sorted by offset, so finding the sites that touch a range
+	is a binary search plus a short walk back over sites that started before
+	it. Pairs of patches whose sites overlap are found once when the index is
+	built; two fixed writes that agree on the bytes they share don't count.
+	"""
+	
+	def __init__(self, patches):
+		self.sites = sorted(((site.offset, site.offset + site.size, patch.name, site) for patch in patches for site in patch.sites), key = lambda s: (s[0], s[1]))
+		self.starts = [s[0] for s in self.sites]
+		self.longest = max((end - start for (start, end, name, site) in self.sites), default = 0)
+		self.conflicts = {}
+		
+		for (i, (start, end, name, site)) in enumerate(self.sites):
+			for (other_start, other_end, other_name, other_site) in self.sites[i + 1:bisect.bisect_left(self.starts, end)]:
+				if (other_name == name or self.agree(site, other_site)):
+					continue
+				
+				self.conflicts.setdefault(frozenset((name, other_name)), other_start)
+	
+	def agree(self, a, b):
+		"""
+		Check if two sites write the same bytes where they overlap, which can
+		only be known for fixed writes
+		"""
+		
+		if (not isinstance(a, Write) or not isinstance(b, Write)):
+			return False
+		
+		start = max(a.offset, b.offset)
+		end = min(a.offset + a.size, b.offset + b.size)
+		
+		return a.data[start - a.offset:end - a.offset] == b.data[start - b.offset:end - b.offset]
+	
+	def find(self, offset, size = 1):
+		"""
+		Get the (start, end, patch name, site) of each site that overlaps the
+		given range
+		"""
+		
+		first = bisect.bisect_right(self.starts, offset - self.longest)
+		last = bisect.bisect_left(self.starts, offset + size)
+		
+		return [s for s in self.sites[first:last] if s[1] > offset]
+	
+	def checkSelection(self, names):
+		"""
+		Raise an error if any of the named patches write over each other
+		"""
+		
+		names = sorted(set(names))
+		found = []
+		
+		for (i, a) in enumerate(names):
+			for b in names[i + 1:]:
+				offset = self.conflicts.get(frozenset((a, b)))
+				
+				if (offset is not None):
+					found.append(f"{a} and {b} (at {hex(offset)})")
+		
+		if (found):
+			raise Exception(f"These patches can't be used together because they change the same code: {', '.join(found)}.")
+
+class Game():
+	"""
+	A game library and the patches for it
+	"""
+	
+	def __init__(self, name, title, library, version_offset, versions, patches):
+		self.name = name
+		self.title = title
+		self.library = library
+		self.version_offset = version_offset
+		self.versions = versions
+		self.patches = {patch.name: patch for patch in patches}
+		self.index = SiteIndex(patches)
+	
+	def locate(self, f):
+		"""
+		Get a copy of the game with the sites that have a symbol moved to
+		where it is in a file. Sites whose symbol the file doesn't have keep
+		their offset. The game itself is returned if no site moves.
+		"""
+		
+		named = [site for patch in self.patches.values() for site in patch.sites if site.symbol]
+		
+		if (not named):
+			return self
+		
+		try:
+			layout = elf.Elf(f)
+		except Exception:
+			return self
+		
+		offsets = {}
+		
+		for site in named:
+			try:
+				offsets[id(site)] = layout.resolve(site.symbol)
+			except Exception:
+				pass
+		
+		if (all(offsets.get(id(site), site.offset) == site.offset for site in named)):
+			return self
+		
+		patches = []
+		
+		for patch in self.patches.values():
+			sites = []
+			
+			for site in patch.sites:
+				if (offsets.get(id(site), site.offset) != site.offset):
+					moved = copy.copy(site)
+					moved.offset = offsets[id(site)]
+					site = moved
+				
+				sites.append(site)
+			
+			patches.append(Patch(patch.name, sites, patch.parse, patch.notice))
+		
+		return Game(self.name, self.title, self.library, self.version_offset, self.versions, patches)
+	
+	def getVersion(self, f):
+		"""
+		Get the version string of a file
+		"""
+		
+		return f.read(self.version_offset, 5).decode("utf-8", errors = "replace")
+	
+	def checkVersion(self, f):
+		"""
+		Make sure the file is one of the supported versions
+		"""
+		
+		ver = self.getVersion(f)
+		
+		if (ver not in self.versions):
+			names = " or ".join(f"version {v}" for v in self.versions)
+			raise Exception(f"Sorry, this doesn't seem to be {names} for ARM64 devices. Make sure you have selected the ARM64 {self.library} from {' or '.join(self.versions)} and try again.")
+		
+		return ver
+
+class Plan():
+	"""
+	A sorted list of (offset, data, patch name) writes, and a list of
+	(offset, original, patch name) checks for the sites whose original bytes
+	are known
+	"""
+	
+	def __init__(self, game, writes, checks = None):
+		self.game = game
+		self.writes = mergeWrites(writes)
+		self.checks = checks or []
+		
+		# Patch name to "already applied", "applied now" or "partially
+		# applied", filled in by compilePlan
+		self.status = {}
+		
+		# Selected patches whose value was rejected, so they have no writes
+		self.skipped = []
+	
+	def __len__(self):
+		return len(self.writes)
+	
+	def missing(self, f):
+		"""
+		Get the writes whose bytes aren't in a file yet
+		"""
+		
+		return [(offset, data, name) for (offset, data, name) in self.writes if f.read(offset, len(data)) != data]
+	
+	def apply(self, f):
+		"""
+		Queue the writes that would change a file, returning how many there
+		are. Bytes that are already there are left alone so their pages
+		aren't dirtied.
+		"""
+		
+		missing = self.missing(f)
+		
+		for (offset, data, name) in missing:
+			f.patch(offset, data)
+		
+		return len(missing)
+	
+	def summary(self):
+		"""
+		Get a short description of what happened to each patch
+		"""
+		
+		return ", ".join(f"{name} {status}" for (name, status) in self.status.items())
+	
+	def describe(self):
+		"""
+		Get a human readable listing of the plan
+		"""
+		
+		return "\n".join(f"{hex(offset)}\t{data.hex()}\t{name}" for (offset, data, name) in self.writes)
+	
+	def toJSON(self):
+		return json.dumps({
+			"game": self.game,
+			"writes": [[offset, data.hex(), name] for (offset, data, name) in self.writes],
+			"checks": [[offset, original.hex(), name] for (offset, original, name) in self.checks],
+		})
+	
+	@classmethod
+	def fromJSON(cls, text):
+		info = json.loads(text)
+		writes = [(offset, bytes.fromhex(data), name) for (offset, data, name) in info["writes"]]
+		checks = [(offset, bytes.fromhex(original), name) for (offset, original, name) in info.get("checks", [])]
+		return cls(info["game"], writes, checks)
+
+def mergeWrites(writes):
+	"""
+	Sort writes by offset and drop exact duplicates. Different data written
+	over the same bytes is an error.
+	"""
+	
+	result = []
+	
+	for (offset, data, name) in sorted(writes, key = lambda w: (w[0], -len(w[1]))):
+		if (result):
+			last_offset, last_data, last_name = result[-1]
+			
+			if (offset < last_offset + len(last_data)):
+				# Fine as long as the new write is inside the old one and agrees with it
+				inner = last_data[offset - last_offset:offset - last_offset + len(data)]
+				
+				if (offset + len(data) <= last_offset + len(last_data) and inner == data):
+					continue
+				
+				raise Exception(f"Patches {last_name} and {name} both write to {hex(offset)} with different data.")
+		
+		result.append((offset, data, name))
+	
+	return result
+
+def selected(patches):
+	"""
+	Get the names of the selected patches in a patches dict
+	"""
+	
+	return [p for p in patches if not p.endswith("_val") and patches[p] == True]
+
+def parseSelection(items):
+	"""
+	Turn a list of "name" or "name=value" strings into a patches dict like the
+	one the GUI builds
+	"""
+	
+	patches = {}
+	
+	for item in items:
+		name, sep, value = item.partition("=")
+		patches[name] = True
+		
+		if (sep):
+			patches[name + "_val"] = value
+	
+	return patches
+
+def compilePlan(game, f, patches, originals = None):
+	"""
+	Compile the selected patches into a plan for the given file. Values are
+	parsed and warnings shown here, and nothing is written to the file.
+	Sites outside the ELF sections they were made for, encoded sites that aren't at the
+	instruction they encode into, and branches or literal loads that land
+	outside the library, are rejected. Selected patches whose value is
+	rejected by their parser are listed in plan.skipped.
+	originals is an optional dict of offset to recorded original bytes, for
+	sites that don't have them in their definition. Sites with a symbol are
+	compiled at the symbol's offset in this file.
+	"""
+	
+	game = game.locate(f)
+	writes = []
+	checks = []
+	skipped = []
+	sites = []
+	names = selected(patches)
+	
+	# Reject conflicting selections before any values are parsed or warnings shown
+	game.index.checkSelection(names)
+	
+	for name in names:
+		patch = game.patches[name]
+		value = patches.get(name + "_val", None)
+		
+		with trace.span(f"patch {name}"):
+			if (patch.notice):
+				ui.showwarning(*patch.notice)
+			
+			if (patch.parse):
+				value = patch.parse(value)
+				
+				if (value is None):
+					skipped.append(name)
+					continue
+			
+			for site in patch.sites:
+				data = site.build(f, value)
+				writes.append((site.offset, data, name))
+				sites.append((site, name))
+				
+				original = site.original or (originals or {}).get(site.offset)
+				
+				if (original and site.needsCheck(original, data, value)):
+					checks.append((site.offset, original, name))
+	
+	# Sites outside the sections they were made for mean this isn't the
+	# expected build
+	with trace.span("section check"):
+		elf.checkSites(f, sites)
+	
+	with trace.span("target check"):
+		verify.checkEncodings(f, sites)
+		verify.checkTargets(f, writes)
+	
+	plan = Plan(game.name, writes, checks)
+	plan.status = patchStatus(f, writes)
+	plan.skipped = skipped
+	
+	return plan
+
+def compileSweep(game, f, patches, name, values, originals = None):
+	"""
+	Compile a plan for each of a list of values of one patch, with the other
+	selected patches the same in all of them. Values are parsed like in
+	compilePlan, and each site is encoded for every value at once. Values the
+	parser rejects get None instead of a plan.
+	"""
+	
+	game = game.locate(f)
+	patch = game.patches[name]
+	game.index.checkSelection(selected(patches) + [name])
+	base = compilePlan(game, f, {**patches, name: False}, originals)
+	
+	if (patch.notice):
+		ui.showwarning(*patch.notice)
+	
+	parsed = [patch.parse(value) if patch.parse else value for value in values]
+	good = [value for value in parsed if value is not None]
+	sites = []
+	
+	with trace.span(f"sweep {name}", values = len(good)):
+		for site in patch.sites:
+			original = site.original or (originals or {}).get(site.offset)
+			built = site.buildMany(f, good) if isinstance(site, Encode) else [site.data] * len(good)
+			sites.append((site, original, built))
+	
+	# The offsets are the same for every value, so the sections only need
+	# checking once
+	if (good):
+		elf.checkSites(f, [(site, name) for site in patch.sites])
+		verify.checkEncodings(f, [(site, name) for site in patch.sites])
+	
+	plans = []
+	i = 0
+	
+	for value in parsed:
+		if (value is None):
+			plans.append(None)
+			continue
+		
+		writes = [(site.offset, built[i], name) for (site, original, built) in sites]
+		checks = [(site.offset, original, name) for (site, original, built) in sites if original and site.needsCheck(original, built[i], value)]
+		verify.checkTargets(f, writes)
+		
+		plan = Plan(game.name, base.writes + writes, base.checks + checks)
+		plan.status = {**base.status, **patchStatus(f, writes)}
+		plan.skipped = base.skipped
+		plans.append(plan)
+		i += 1
+	
+	return plans
+
+def patchStatus(f, writes):
+	"""
+	Work out whether each patch in a list of writes is already in a file
+	"""
+	
+	found = {}
+	
+	for (offset, data, name) in writes:
+		done, total = found.get(name, (0, 0))
+		found[name] = (done + (f.read(offset, len(data)) == data), total + 1)
+	
+	return {name: "already applied" if done == total else "applied now" if done == 0 else "partially applied" for (name, (done, total)) in found.items()}
+
+def sameFile(a, b):
+	return os.path.abspath(a) == os.path.abspath(b)
+
+def sameOutput(plan, location, output):
+	"""
+	Check if output already has exactly the bytes that writing a plan to a
+	copy of location would give it
+	"""
+	
+	try:
+		with File(location, writable = False) as f, File(output, writable = False) as o:
+			if (f.size != o.size or plan.missing(o)):
+				return False
+			
+			# Everything between the writes has to match the input
+			position = 0
+			
+			for (offset, data, name) in plan.writes + [(f.size, b"", None)]:
+				if (offset > position and f.map[position:offset] != o.map[position:offset]):
+					return False
+				
+				position = max(position, offset + len(data))
+			
+			return True
+	except (OSError, ValueError):
+		return False
+
+def writePlan(plan, location, output = None, check = True, library = None, journal = None, sync = False):
+	"""
+	Write a plan to a file, either in place or, if output is given, into a
+	new copy that is renamed to output once it is complete. With check the
+	sites are checked before writing and read back afterwards. If location
+	is an APK, the plan is written to the library with the given file name
+	inside it. journal is passed on to writeChecked. Files that already have
+	every write are left untouched when output is location, and so are
+	outputs that already have the bytes the copy would get. With sync, the
+	written pages are synced to disk before returning.
+	"""
+	
+	if (output and sameFile(output, location) and not apk.isApk(location)):
+		with File(location, writable = False) as f:
+			if (not plan.missing(f)):
+				return
+	
+	if (apk.isApk(location)):
+		if (not library):
+			raise Exception(f"Can't tell which library in {location} to patch.")
+		
+		with apk.openLibrary(location, library, output, sync) as f:
+			writeChecked(f, plan, check, journal)
+	elif (output is None):
+		with File(location, sync = sync) as f:
+			writeChecked(f, plan, check, journal)
+	elif (not sameOutput(plan, location, output)):
+		with atomicOutput(location, output) as temp:
+			with File(temp, sync = sync) as f:
+				writeChecked(f, plan, check, journal)
+
+def writeChecked(f, plan, check = True, journal = None):
+	"""
+	Apply and flush a plan on an open file, checking the sites before and
+	after if asked to. If journal is given, an undo journal is saved to that
+	path, or to the journal store if it is True.
+	"""
+	
+	if (check):
+		with trace.span("preflight"):
+			verify.preflight(f, plan)
+	
+	if (journal):
+		with trace.span("journal"):
+			undo = Journal.start(f, plan)
+	
+	with trace.span("apply"):
+		changed = plan.apply(f)
+	
+	f.flush()
+	
+	if (check):
+		with trace.span("readback"):
+			verify.readback(f, plan)
+	
+	# Nothing to undo, and saving would replace the journal of the run that
+	# did patch it
+	if (journal and changed):
+		with trace.span("journal"):
+			undo.finish(f)
+			undo.save(None if journal is True else journal)
+
+def applyPatches(game, location, patches, output = None, cache = None, check = True, journal = None, plans = None, sync = False):
+	"""
+	Apply patches to a given library file, returning the plan that was used.
+	If output is given the patched file is written there (which can be the
+	same as location) and the input is left untouched on errors. location
+	can also be an APK, in which case its ARM64 library is patched in memory
+	and a new APK is written. If a
+	patchcore.cache.Cache is given, it is checked before patching and the
+	result is stored in it afterwards. With check, the original bytes at
+	each site are checked (where they are known) and the writes are read
+	back. With journal (True or a path), an undo journal is saved; the cache
+	is then only written to, since a cached output has nothing to journal.
+	
+	Writes whose bytes are already in the file are skipped, and a file that
+	already has every patch isn't touched at all. plan.status says which
+	patches were already applied.
+	
+	If a patchcore.cache.PlanCache is given as plans, the plan for this
+	build is taken from it when the same patches have been compiled before.
+	With sync, the patched pages are synced to disk (with fsync) before
+	returning, so a crash or power loss can't leave a half written file.
+	"""
+	
+	with trace.span("applyPatches", game = game.name, path = location):
+		return _applyPatches(game, location, patches, output, cache, check, journal, plans, sync)
+
+def planFor(game, f, patches, check = True, plans = None):
+	"""
+	Check the version of a file and get the plan for it, from plans (a
+	patchcore.cache.PlanCache) if it has been compiled before. Stored plans
+	skip value parsing and warnings completely.
+	"""
+	
+	with trace.span("version check"):
+		version = game.checkVersion(f)
+	
+	if (plans):
+		with trace.span("plan lookup"):
+			plan = plans.fetch(game.name, version, patches)
+		
+		if (plan):
+			status = patchStatus(f, plan.writes)
+			plan.status = {name: status[name] for name in selected(patches) if name in status}
+			return plan
+	
+	# Stored plans always have their checks, in case they are used with check
+	originals = verify.loadOriginals(game.name, version) if (check or plans) else None
+	plan = compilePlan(game, f, patches, originals)
+	
+	# A plan missing a patch would leave it out silently every time it is
+	# replayed, so only complete plans are stored
+	if (plans and not plan.skipped):
+		plans.store(game.name, version, patches, plan)
+	
+	return plan
+
+def _applyPatches(game, location, patches, output, cache, check, journal, plans, sync):
+	if (cache):
+		key = cache.key(game.name, fileDigest(location), patches)
+	
+	if (cache and not journal):
+		with trace.span("cache lookup"):
+			plan = cache.fetch(key, output or location, location)
+		
+		if (plan):
+			return plan
+	
+	if (apk.isApk(location)):
+		with apk.openLibrary(location, game.library, output, sync) as f:
+			plan = planFor(game, f, patches, check, plans)
+			writeChecked(f, plan, check, journal)
+	elif (output is None):
+		with File(location, sync = sync) as f:
+			plan = planFor(game, f, patches, check, plans)
+			writeChecked(f, plan, check, journal)
+	else:
+		# writePlan does the preflight, so it isn't done twice
+		with File(location, writable = False) as f:
+			plan = planFor(game, f, patches, check, plans)
+			unchanged = not plan.missing(f)
+		
+		# Replacing the file with an identical copy would still bump its mtime
+		if (not (unchanged and sameFile(output, location))):
+			writePlan(plan, location, output, check, journal = journal, sync = sync)
+	
+	# An output missing a patch mustn't be served as if it had everything
+	if (cache and not plan.skipped):
+		with trace.span("cache store"):
+			cache.store(key, output or location, plan)
+	
+	return plan
@@ -0,0 +1,485 @@
+"""
+Finding patch sites by byte signatures instead of fixed offsets
+
+A signature is the bytes around a patch site with a mask of which bits have
+to match. The site's own bytes and the immediate fields of instructions
+(branch targets, literal offsets, constants) are masked out, so the same
+signature still matches after code moves around in a new build.
+
+Signatures are learnt from a build where the offsets are known, then used to
+find the sites in other builds. Branches and literal loads written by a
+patch refer to code or data relative to themselves, so what they refer to
+gets a signature too, and they are re-encoded to point at wherever it is in
+the other build. Patches whose targets can't be found there are skipped. Each signature remembers the ELF section its
+site was in, and is only searched for in that section of other builds, so
+code is never matched in data. All signatures for a section are searched for
+in one pass, and the offsets found are cached by the file's digest.
+
+Batch patching and the daemon take a signature file, and use it to patch
+builds whose version they don't know.
+
+Examples:
+	python -m patchcore.signature learn -g smashhit libsmashhit-1.4.3.so smashhit.sig.json
+	python -m patchcore.signature resolve smashhit.sig.json libsmashhit-new.so
+	python -m patchcore.batch -g smashhit --signatures smashhit.sig.json -p antitamper libsmashhit-new.so
+"""
+
+import argparse
+import copy
+import hashlib
+import json
+import os
+import re
+import struct
+import sys
+
+from patchcore.apk import isApk
+from patchcore.arm64 import immediate_mask_arm64, retarget_arm64, target_arm64
+from patchcore.cache import defaultCacheDir
+from patchcore.elf import Elf
+from patchcore.file import File, fileDigest
+from patchcore.games import GAMES
+from patchcore.output import atomicPath
+from patchcore.registry import Game, Patch, Write
+
+CONTEXT = 16
+MAX_CONTEXT = 256
+MIN_ANCHOR = 4
+
+class Signature():
+	"""
+	A masked byte pattern, with the offset of the site inside it and the name
+	of the section it was found in (or None if that isn't known)
+	"""
+	
+	def __init__(self, name, pattern, mask, site, section = None):
+		self.name = name
+		self.pattern = pattern
+		self.mask = mask
+		self.site = site
+		self.section = section
+		
+		self.mask_int = int.from_bytes(mask, "little")
+		self.pattern_int = int.from_bytes(pattern, "little") & self.mask_int
+		self.anchor, self.anchor_offset = findAnchor(pattern, mask)
+	
+	def matches(self, data, start):
+		"""
+		Check if the signature matches data at start
+		"""
+		
+		window = data[start:start + len(self.pattern)]
+		
+		return len(window) == len(self.pattern) and (int.from_bytes(window, "little") & self.mask_int) == self.pattern_int
+	
+	def toDict(self):
+		return {"pattern": self.pattern.hex(), "mask": self.mask.hex(), "site": self.site, "section": self.section}
+	
+	@classmethod
+	def fromDict(cls, name, info):
+		return cls(name, bytes.fromhex(info["pattern"]), bytes.fromhex(info["mask"]), info["site"], info.get("section"))
+
+def findAnchor(pattern, mask):
+	"""
+	Find the longest run of fully matched bytes in a pattern, which is what
+	gets searched for before checking the whole signature
+	"""
+	
+	best = (0, 0)
+	start = None
+	
+	for i in range(len(mask) + 1):
+		if (i < len(mask) and mask[i] == 0xff):
+			if (start is None):
+				start = i
+		elif (start is not None):
+			if (i - start > best[1] - best[0]):
+				best = (start, i)
+			
+			start = None
+	
+	if (best[1] - best[0] < MIN_ANCHOR):
+		raise Exception(f"Signature doesn't have {MIN_ANCHOR} fixed bytes in a row to search for.")
+	
+	return (pattern[best[0]:best[1]], best[0])
+
+def makeSignature(f, name, offset, size, context = CONTEXT, section = None):
+	"""
+	Make a signature for a site from the bytes around it in a file
+	"""
+	
+	start = max(offset - context, 0)
+	start -= start % 4
+	end = min(offset + size + context, f.size)
+	end -= end % 4
+	
+	pattern = f.read(start, end - start)
+	mask = bytearray()
+	
+	for i in range(start, end, 4):
+		word = struct.unpack("<I", pattern[i - start:i - start + 4])[0]
+		mask += struct.pack("<I", immediate_mask_arm64(word))
+	
+	# The site itself can be anything, it might already be patched
+	mask[offset - start:offset - start + size] = bytes(size)
+	
+	return Signature(name, pattern, bytes(mask), offset - start, section)
+
+def scan(data, signatures, start = 0, end = None):
+	"""
+	Search data (bytes or a memory map) for all signatures in one pass,
+	returning a dict of signature name to a list of matching site offsets
+	"""
+	
+	by_anchor = {}
+	
+	for sig in signatures:
+		by_anchor.setdefault(sig.anchor, []).append(sig)
+	
+	# At each position the regex reports the longest anchor that matches, and
+	# any shorter anchor matching there is a prefix of it, so check those too.
+	candidates = {}
+	
+	for anchor in by_anchor:
+		candidates[anchor] = [sig for other in by_anchor if anchor.startswith(other) for sig in by_anchor[other]]
+	
+	# The lookahead makes overlapping anchors all get found
+	regex = re.compile(b"(?=(" + b"|".join(re.escape(a) for a in sorted(by_anchor, key = len, reverse = True)) + b"))", re.DOTALL)
+	
+	found = {sig.name: [] for sig in signatures}
+	
+	for m in regex.finditer(data, start, len(data) if end is None else end):
+		for sig in candidates[m.group(1)]:
+			sig_start = m.start() - sig.anchor_offset
+			
+			if (sig_start >= 0 and sig.matches(data, sig_start)):
+				found[sig.name].append(sig_start + sig.site)
+	
+	return found
+
+def sectionsOf(f):
+	"""
+	Get an Elf for a file if it has section headers, otherwise None
+	"""
+	
+	try:
+		layout = Elf(f)
+		
+		if (layout.getSections()):
+			return layout
+	except Exception:
+		pass
+	
+	return None
+
+def scanFile(f, signatures):
+	"""
+	Search a File for signatures like scan. If the file has section headers,
+	signatures that know their section are only searched for inside it.
+	"""
+	
+	layout = sectionsOf(f)
+	groups = {}
+	
+	for sig in signatures:
+		groups.setdefault(sig.section if layout else None, []).append(sig)
+	
+	found = {}
+	
+	for (name, group) in groups.items():
+		if (name is None):
+			found.update(scan(f.map, group))
+		else:
+			section = layout.section(name)
+			found.update(scan(f.map, group, section.offset, min(section.end, f.size)))
+	
+	return found
+
+def siteName(patch, index):
+	return f"{patch.name}.{index}"
+
+def targetName(site_name, index):
+	return f"{site_name}+{index}"
+
+def siteTargets(site):
+	"""
+	Get the (index in the data, offset from the instruction, size) of each
+	branch and literal load a site writes. Encoded sites keep the
+	instruction that was there, so they don't have any.
+	"""
+	
+	if (not isinstance(site, Write)):
+		return []
+	
+	found = []
+	
+	for i in range(-site.offset % 4, len(site.data) - 3, 4):
+		target = target_arm64(struct.unpack_from("<I", site.data, i)[0])
+		
+		if (target and target[2]):
+			found.append((i, target[1], target[2]))
+	
+	return found
+
+def segmentsOf(f):
+	"""
+	Get an Elf for a file if it has program headers, otherwise None
+	"""
+	
+	try:
+		layout = Elf(f)
+		
+		if (layout.getSegments()):
+			return layout
+	except Exception:
+		pass
+	
+	return None
+
+def addressOf(layout, offset):
+	"""
+	Get the address a file offset is loaded at, which is the offset itself
+	if the file doesn't have program headers
+	"""
+	
+	return offset if layout is None else layout.offsetToAddress(offset)
+
+def learn(game, location):
+	"""
+	Learn signatures for every site of a game from a build where the offsets
+	in the registry are right. Each signature is grown until it only matches
+	once in that build.
+	"""
+	
+	with File(location, writable = False) as f:
+		game.checkVersion(f)
+		layout = sectionsOf(f)
+		segments = segmentsOf(f)
+		
+		sites = [("version", game.version_offset, 8)]
+		targets = []
+		
+		for patch in game.locate(f).patches.values():
+			for (i, site) in enumerate(patch.sites):
+				sites.append((siteName(patch, i), site.offset, site.size))
+				
+				for (index, delta, size) in siteTargets(site):
+					address = addressOf(segments, site.offset + index)
+					offset = address + delta if segments is None else segments.addressToOffset(address + delta)
+					
+					if (offset is not None):
+						targets.append((targetName(siteName(patch, i), index), offset, size))
+		
+		target_names = {name for (name, offset, size) in targets}
+		context = CONTEXT
+		signatures = {}
+		pending = sites + targets
+		
+		while (pending):
+			for (name, offset, size) in pending:
+				section = layout.sectionAt(offset) if layout else None
+				signatures[name] = makeSignature(f, name, offset, size, context, section.name if section else None)
+			
+			found = scanFile(f, [signatures[name] for (name, offset, size) in pending])
+			pending = [(name, offset, size) for (name, offset, size) in pending if found[name] != [offset]]
+			context *= 2
+			
+			if (pending and context > MAX_CONTEXT):
+				failed = [name for (name, offset, size) in pending if name not in target_names]
+				
+				if (failed):
+					raise Exception(f"Couldn't make unique signatures for {', '.join(failed)}.")
+				
+				# The patches that refer to these are skipped in other builds
+				for (name, offset, size) in pending:
+					del signatures[name]
+				
+				pending = []
+	
+	return {
+		"game": game.name,
+		"signatures": {name: sig.toDict() for (name, sig) in signatures.items() if name not in target_names},
+		"targets": {name: sig.toDict() for (name, sig) in signatures.items() if name in target_names},
+	}
+
+def resolve(info, location, cache_dir = None):
+	"""
+	Find every site from a learnt signature set in a file, returning a dict of
+	site name to offset. Targets are included if they are found, but don't
+	have to be. Results are cached by the file's digest and the signatures'.
+	"""
+	
+	signatures = [Signature.fromDict(name, sig) for (name, sig) in info["signatures"].items()]
+	targets = [Signature.fromDict(name, sig) for (name, sig) in info.get("targets", {}).items()]
+	cache_path = None
+	
+	if (cache_dir):
+		# Another signature file can find different sites in the same build
+		key = hashlib.sha256(json.dumps(info, sort_keys = True).encode("utf-8")).hexdigest()[:16]
+		cache_path = os.path.join(cache_dir, "sites", f"{info['game']}-{fileDigest(location)}-{key}.json")
+		
+		try:
+			with open(cache_path, "r") as f:
+				return json.load(f)
+		except (FileNotFoundError, ValueError):
+			pass
+	
+	with File(location, writable = False) as f:
+		found = scanFile(f, signatures + targets)
+	
+	missing = [sig.name for sig in signatures if len(found[sig.name]) != 1]
+	
+	if (missing):
+		raise Exception(f"Couldn't find a unique match for {', '.join(missing)}.")
+	
+	offsets = {name: offsets[0] for (name, offsets) in found.items() if len(offsets) == 1}
+	
+	if (cache_path):
+		os.makedirs(os.path.dirname(cache_path), exist_ok = True)
+		
+		with atomicPath(cache_path) as temp:
+			with open(temp, "w") as f:
+				json.dump(offsets, f)
+	
+	return offsets
+
+def retarget(site, name, offset, offsets, layout):
+	"""
+	Get the data for a site moved to offset, with its branches and literal
+	loads pointing at where their targets were found, or None if one of them
+	wasn't found or is out of reach
+	"""
+	
+	data = bytearray(site.data)
+	
+	for (index, delta, size) in siteTargets(site):
+		target = offsets.get(targetName(name, index))
+		
+		if (target is None):
+			return None
+		
+		source = addressOf(layout, offset + index)
+		destination = addressOf(layout, target)
+		
+		if (source is None or destination is None):
+			return None
+		
+		word = retarget_arm64(struct.unpack_from("<I", data, index)[0], destination - source)
+		
+		if (word is None):
+			return None
+		
+		struct.pack_into("<I", data, index, word)
+	
+	return bytes(data)
+
+def skipAll(value):
+	return None
+
+def relocate(game, offsets, version, layout = None):
+	"""
+	Make a copy of a game with its sites moved to the resolved offsets.
+	layout is the Elf of the build the offsets are for, which is needed to
+	re-encode branches and literal loads that cross segments. Patches that
+	refer to something that wasn't found are skipped whenever they are used.
+	"""
+	
+	patches = []
+	
+	for patch in game.patches.values():
+		sites = []
+		lost = False
+		
+		for (i, site) in enumerate(patch.sites):
+			moved = copy.copy(site)
+			moved.offset = offsets[siteName(patch, i)]
+			
+			if (siteTargets(site)):
+				data = retarget(site, siteName(patch, i), moved.offset, offsets, layout)
+				
+				if (data is None):
+					lost = True
+				else:
+					moved.data = data
+			
+			sites.append(moved)
+		
+		if (lost):
+			patches.append(Patch(patch.name, sites, skipAll, (game.title, f"The {patch.name} patch branches to or loads from code or data that couldn't be found in this build, so it is skipped.")))
+		else:
+			patches.append(Patch(patch.name, sites, patch.parse, patch.notice))
+	
+	return Game(game.name, game.title, game.library, offsets["version"], (version,), patches)
+
+def locateGame(info, location, cache_dir = None):
+	"""
+	Get a game's patch set with the sites found in the given file
+	"""
+	
+	game = GAMES[info["game"]]
+	offsets = resolve(info, location, cache_dir)
+	
+	with File(location, writable = False) as f:
+		version = f.read(offsets["version"], 5).decode("utf-8", errors = "replace")
+		
+		return relocate(game, offsets, version, segmentsOf(f))
+
+def loadSignatures(path):
+	"""
+	Load a signature file written by learn
+	"""
+	
+	with open(path, "r") as f:
+		return json.load(f)
+
+def gameForBuild(game, location, info, cache_dir = None):
+	"""
+	Get the patch set to use for a library: the game itself if it knows the
+	library's version, otherwise a copy with the sites found from info (a
+	loaded signature file). APKs are always patched with the game itself.
+	"""
+	
+	if (info is None or info["game"] != game.name or isApk(location)):
+		return game
+	
+	with File(location, writable = False) as f:
+		if (game.getVersion(f) in game.versions):
+			return game
+	
+	return locateGame(info, location, cache_dir or defaultCacheDir())
+
+def main(argv = None):
+	parser = argparse.ArgumentParser(prog = "python -m patchcore.signature", description = "Learn and find patch site signatures.")
+	commands = parser.add_subparsers(dest = "command", required = True)
+	
+	learn_command = commands.add_parser("learn", help = "Learn signatures from a build the offsets are known for")
+	learn_command.add_argument("-g", "--game", required = True, choices = list(GAMES), help = "Which game the library is for")
+	learn_command.add_argument("library", help = "Reference library")
+	learn_command.add_argument("signatures", help = "Signature file to write")
+	
+	resolve_command = commands.add_parser("resolve", help = "Find the patch sites in a library")
+	resolve_command.add_argument("signatures", help = "Signature file")
+	resolve_command.add_argument("library", help = "Library to search")
+	
+	args = parser.parse_args(argv)
+	
+	try:
+		if (args.command == "learn"):
+			info = learn(GAMES[args.game], args.library)
+			
+			with open(args.signatures, "w") as f:
+				json.dump(info, f, indent = "\t")
+		else:
+			with open(args.signatures, "r") as f:
+				info = json.load(f)
+			
+			for (name, offset) in resolve(info, args.library, defaultCacheDir()).items():
+				print(f"{name}\t{hex(offset)}")
+	except Exception as e:
+		print(f"Error: {e}", file = sys.stderr)
+		return 1
+	
+	return 0
+
+if (__name__ == "__main__"):
+	sys.exit(main())
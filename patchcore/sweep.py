@@ -0,0 +1,103 @@
+"""
+Making many variants of a library that only differ in one patch value
+
+Making a mod for every ball count or field of view compiles the same patch
+for hundreds of values. The patch's sites are encoded for all of the values
+at once (ARM64 immediates with NumPy if it is installed), and then each
+variant is written to its own file.
+
+Example:
+	python -m patchcore.sweep -g smashhit -p antitamper balls 1..500 libsmashhit.so variants
+"""
+
+import argparse
+import os
+import sys
+import time
+
+from patchcore.file import File
+from patchcore.games import GAMES
+from patchcore import loadNumpy, registry, verify
+
+def expandValues(spec):
+	"""
+	Turn a list of values like "1..500" or "10,20,30" (or both, separated by
+	commas) into a list of value strings like the ones the GUI gives
+	"""
+	
+	values = []
+	
+	for item in spec.split(","):
+		start, sep, end = item.partition("..")
+		
+		if (sep):
+			values += [str(value) for value in range(int(start), int(end) + 1)]
+		else:
+			values.append(item)
+	
+	return values
+
+def variantPath(directory, location, name, value):
+	stem, ext = os.path.splitext(os.path.basename(location))
+	
+	return os.path.join(directory, f"{stem}-{name}-{value}{ext}")
+
+def main(argv = None):
+	parser = argparse.ArgumentParser(prog = "python -m patchcore.sweep", description = "Make a patched library for each of many values of one patch.")
+	parser.add_argument("-g", "--game", required = True, choices = list(GAMES), help = "Which game the library is for")
+	parser.add_argument("-p", "--patch", action = "append", default = [], metavar = "NAME[=VALUE]", help = "Another patch to apply to every variant, with an optional value (can be given many times)")
+	parser.add_argument("name", help = "The patch to make variants of")
+	parser.add_argument("values", help = "Its values, like 1..500 or 10,20,30")
+	parser.add_argument("library", help = "Unpatched library")
+	parser.add_argument("output_dir", help = "Directory to write the variants to")
+	args = parser.parse_args(argv)
+	
+	game = GAMES[args.game]
+	patches = registry.parseSelection(args.patch)
+	unknown = [p for p in registry.selected(patches) + [args.name] if p not in game.patches]
+	
+	if (unknown):
+		parser.error(f"unknown patches: {', '.join(unknown)}")
+	
+	try:
+		values = expandValues(args.values)
+	except ValueError as e:
+		parser.error(f"bad values: {e}")
+	
+	failed = 0
+	
+	try:
+		with File(args.library, writable = False) as f:
+			version = game.checkVersion(f)
+			
+			# Importing NumPy isn't part of compiling
+			loadNumpy()
+			start = time.perf_counter()
+			plans = registry.compileSweep(game, f, patches, args.name, values, verify.loadOriginals(game.name, version))
+			elapsed = time.perf_counter() - start
+		
+		skipped = next((plan.skipped for plan in plans if plan), [])
+		
+		# Every variant would be missing them
+		if (skipped):
+			raise Exception(f"Not writing any variants, because these patches' values were rejected: {', '.join(skipped)}.")
+		
+		os.makedirs(args.output_dir, exist_ok = True)
+		
+		for (value, plan) in zip(values, plans):
+			if (plan is None):
+				print(f"{value}\tSkipped, the value was rejected", file = sys.stderr)
+				failed += 1
+				continue
+			
+			registry.writePlan(plan, args.library, variantPath(args.output_dir, args.library, args.name, value))
+	except Exception as e:
+		print(f"Error: {e}", file = sys.stderr)
+		return 1
+	
+	print(f"Compiled {len(values)} variants in {elapsed * 1000:.1f} ms, wrote {len(values) - failed} to {args.output_dir}", file = sys.stderr)
+	
+	return 1 if failed else 0
+
+if (__name__ == "__main__"):
+	sys.exit(main())
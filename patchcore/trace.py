@@ -0,0 +1,151 @@
+"""
+Optional timing and I/O instrumentation
+
+Tracing is off unless a Tracer is active:
+
+	with Tracer() as tracer:
+		registry.applyPatches(game, path, patches)
+	
+	tracer.save("summary.json", "trace.json")
+
+Each span records its wall time and the file reads, queued writes, written
+runs, bytes and newly dirtied pages inside it. The summary is plain JSON and
+the timeline uses the Chrome trace event format (load it in
+chrome://tracing or Perfetto). When no tracer is active, span() returns a
+shared do-nothing context and the file hooks are a single check.
+"""
+
+import contextlib
+import json
+import mmap
+import os
+import threading
+import time
+
+PAGE_SIZE = mmap.PAGESIZE
+
+COUNTERS = ("reads", "read_bytes", "writes", "write_bytes", "runs", "pages_dirtied")
+
+current = None
+
+NULL_SPAN = contextlib.nullcontext()
+
+def span(name, **args):
+	"""
+	Time a block under the active tracer, if there is one
+	"""
+	
+	if (current is None):
+		return NULL_SPAN
+	
+	return current.span(name, **args)
+
+class Tracer():
+	"""
+	Collects spans and I/O counts while it is active
+	"""
+	
+	def __init__(self):
+		self.events = []
+		self.totals = dict.fromkeys(COUNTERS, 0)
+		self.pages = set()
+		self.previous = None
+	
+	def __enter__(self):
+		global current
+		
+		self.previous = current
+		current = self
+		
+		return self
+	
+	def __exit__(self, exc_type, exc_value, traceback):
+		global current
+		
+		current = self.previous
+	
+	def read(self, location, length):
+		self.totals["reads"] += 1
+		self.totals["read_bytes"] += length
+	
+	def write(self, location, length):
+		self.totals["writes"] += 1
+		self.totals["write_bytes"] += length
+	
+	def run(self, path, offset, length):
+		"""
+		Count a run of bytes written to a file at flush time
+		"""
+		
+		self.totals["runs"] += 1
+		
+		for page in range(offset // PAGE_SIZE, (offset + length - 1) // PAGE_SIZE + 1):
+			if ((path, page) not in self.pages):
+				self.pages.add((path, page))
+				self.totals["pages_dirtied"] += 1
+	
+	@contextlib.contextmanager
+	def span(self, name, **args):
+		before = dict(self.totals)
+		start = time.perf_counter()
+		
+		try:
+			yield
+		finally:
+			end = time.perf_counter()
+			
+			args.update({key: self.totals[key] - before[key] for key in COUNTERS})
+			
+			self.events.append({
+				"name": name,
+				"ph": "X",
+				# perf_counter is system wide, so events from worker processes line up
+				"ts": start * 1e6,
+				"dur": (end - start) * 1e6,
+				"pid": os.getpid(),
+				"tid": threading.get_ident(),
+				"args": args,
+			})
+	
+	def toDict(self):
+		return {"events": self.events, "totals": self.totals}
+	
+	def merge(self, info):
+		"""
+		Add the events and totals from another tracer's toDict(), for example
+		from a worker process
+		"""
+		
+		self.events += info["events"]
+		
+		for key in COUNTERS:
+			self.totals[key] += info["totals"][key]
+	
+	def summary(self):
+		"""
+		Get the total I/O and the calls, wall time and I/O of each span name
+		"""
+		
+		spans = {}
+		
+		for event in self.events:
+			info = spans.setdefault(event["name"], dict({"calls": 0, "wall_ms": 0.0}, **dict.fromkeys(COUNTERS, 0)))
+			info["calls"] += 1
+			info["wall_ms"] += event["dur"] / 1000
+			
+			for key in COUNTERS:
+				info[key] += event["args"].get(key, 0)
+		
+		return {"totals": self.totals, "spans": spans}
+	
+	def chromeTrace(self):
+		return {"traceEvents": self.events, "displayTimeUnit": "ms"}
+	
+	def save(self, summary_path = None, trace_path = None):
+		if (summary_path):
+			with open(summary_path, "w") as f:
+				json.dump(self.summary(), f, indent = "\t")
+		
+		if (trace_path):
+			with open(trace_path, "w") as f:
+				json.dump(self.chromeTrace(), f)
@@ -0,0 +1,38 @@
+"""
+Warnings and errors shown while patching
+
+Patches report problems through these functions instead of calling
+tkinter.messagebox directly, so they also work without a GUI. The GUI sets
+tkinter.messagebox as the backend, otherwise messages go to stderr.
+"""
+
+import sys
+
+backend = None
+
+def setBackend(new):
+	"""
+	Set the object used to show messages. It needs showinfo, showwarning and
+	showerror functions taking a title and a message, like tkinter.messagebox.
+	"""
+	
+	global backend
+	backend = new
+
+def showinfo(title, message):
+	if (backend):
+		return backend.showinfo(title, message)
+	
+	print(f"{title}: {message}", file = sys.stderr)
+
+def showwarning(title, message):
+	if (backend):
+		return backend.showwarning(title, message)
+	
+	print(f"Warning: {title}: {message}", file = sys.stderr)
+
+def showerror(title, message):
+	if (backend):
+		return backend.showerror(title, message)
+	
+	print(f"Error: {title}: {message}", file = sys.stderr)
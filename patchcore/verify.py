@@ -0,0 +1,294 @@
+"""
+Checking patch sites before and after writing
+
+Before anything is written, the bytes at every site with a known original
+are compared against it. A site passes if it still has the original bytes or
+already has the patched bytes; encoded sites that only differ from the
+original in the encoded value aren't checked at all. After writing, every
+write is read back.
+
+Originals are given in the patch definitions where they are known, and can
+be recorded for every site from an unpatched build into the shared cache
+directory:
+	python -m patchcore.verify record libsmashhit.so
+
+Even without originals, sites encoded into an ARM64 instruction's immediate
+(like the MOV of the balls patch) are checked to hold an instruction with
+that immediate field, since the encoder would garble anything else.
+"""
+
+import argparse
+import json
+import os
+import struct
+import sys
+
+from patchcore import defaultCacheDir, loadNumpy
+from patchcore.arm64 import ENCODER_FIELDS, decode_arm64, immediate_fields_arm64, target_arm64, targets_arm64, words_arm64
+from patchcore.elf import SHF_EXECINSTR, Elf
+from patchcore.file import File
+
+loaded_originals = {}
+
+def compareSites(f, sites):
+	"""
+	Compare a list of (offset, expected bytes) against a File, returning the
+	indexes of the sites that differ. Sites are a few scattered words, so
+	reading each one is quicker than gathering them into arrays, even for
+	thousands of sites. Reads go through File.read, so they include pending
+	writes and are counted by traces.
+	"""
+	
+	return [i for (i, (offset, expected)) in enumerate(sites) if f.read(offset, len(expected)) != expected]
+
+def preflight(f, plan):
+	"""
+	Make sure the sites in a plan have the bytes they are expected to have,
+	raising an exception listing every site that doesn't
+	"""
+	
+	if (not plan.checks):
+		return
+	
+	mismatched = compareSites(f, [(offset, original) for (offset, original, name) in plan.checks])
+	
+	if (not mismatched):
+		return
+	
+	data = {offset: new for (offset, new, name) in plan.writes}
+	problems = []
+	
+	for i in mismatched:
+		offset, original, name = plan.checks[i]
+		found = f.read(offset, len(original))
+		
+		if (found == data.get(offset)):
+			continue
+		
+		problems.append(f"{hex(offset)} ({name}): expected {original.hex()}, found {found.hex()}")
+	
+	if (problems):
+		raise Exception("This file doesn't have the expected bytes at some patch sites, so it might be a different build or already modified:\n" + "\n".join(problems))
+
+def readback(f, plan):
+	"""
+	Make sure every write in a plan made it to the file
+	"""
+	
+	mismatched = compareSites(f, [(offset, data) for (offset, data, name) in plan.writes])
+	
+	if (mismatched):
+		raise Exception("Some patches didn't get written: " + ", ".join(f"{hex(plan.writes[i][0])} ({plan.writes[i][2]})" for i in mismatched))
+
+def checkEncodings(f, sites):
+	"""
+	Make sure every (site, patch name) whose encoder writes an ARM64
+	immediate field is at an instruction that has that field, raising an
+	exception listing every site that isn't
+	"""
+	
+	problems = []
+	
+	for (site, name) in sites:
+		field = ENCODER_FIELDS.get(getattr(site, "encode", None))
+		
+		if (field is None):
+			continue
+		
+		word = struct.unpack("<I", f.read(site.offset, 4))[0]
+		
+		if (field not in immediate_fields_arm64(word)):
+			problems.append(f"{hex(site.offset)} ({name}): found {word:08x}, which doesn't have a {field[0]}-bit immediate at bit {field[1]}")
+	
+	if (problems):
+		raise Exception("Some patch sites don't have the instruction they encode into, so this library doesn't look like the one the patches were made for:\n" + "\n".join(problems))
+
+def openLayout(f):
+	"""
+	Get a patchcore.elf.Elf for a file, or None if it isn't a 64-bit ELF file
+	with section headers, in which case its code can't be checked
+	"""
+	
+	try:
+		layout = Elf(f)
+		
+		if (layout.getSections()):
+			return layout
+	except Exception:
+		pass
+	
+	return None
+
+def outside(addresses, ranges):
+	"""
+	Get which of an array (or list) of addresses aren't in any of the (start,
+	end) ranges
+	"""
+	
+	numpy = loadNumpy() if not isinstance(addresses, list) else None
+	
+	if (numpy is None):
+		return [not any(start <= a < end for (start, end) in ranges) for a in addresses]
+	
+	inside = numpy.zeros(len(addresses), dtype = bool)
+	
+	for (start, end) in ranges:
+		inside |= (addresses >= start) & (addresses < end)
+	
+	return ~inside
+
+def checkTargets(f, writes):
+	"""
+	Decode the instructions written to executable sections and make sure
+	that branches land in executable segments and literal loads in loaded
+	ones, raising an exception listing every write that doesn't. A wrong
+	branch would otherwise only show up as a crash.
+	"""
+	
+	layout = openLayout(f)
+	
+	if (layout is None):
+		return
+	
+	code = layout.ranges(executable = True)
+	loaded = layout.ranges()
+	problems = []
+	
+	for (offset, data, name) in writes:
+		section = layout.sectionAt(offset)
+		
+		if (section is None or not section.flags & SHF_EXECINSTR):
+			continue
+		
+		# Only whole, aligned words can be instructions
+		for i in range(-offset % 4, len(data) - 3, 4):
+			word = struct.unpack_from("<I", data, i)[0]
+			target = target_arm64(word)
+			
+			if (target is None):
+				continue
+			
+			kind, delta, size = target
+			address = section.address + offset + i - section.offset + delta
+			
+			if (outside([address], code if kind == "code" else loaded)[0]):
+				problems.append(f"{hex(offset + i)} ({name}): {decode_arm64(word)} to {hex(address)}, which isn't in {'an executable' if kind == 'code' else 'a loaded'} segment")
+	
+	if (problems):
+		raise Exception("Some patches branch or load from outside of the library:\n" + "\n".join(problems))
+
+def scanCode(f):
+	"""
+	Check every branch and literal load in the executable sections of a
+	library, returning a list of (offset, word, target address) for the ones
+	that land outside of the segments they should
+	"""
+	
+	layout = openLayout(f)
+	
+	if (layout is None):
+		raise Exception(f"{f.path} isn't a 64-bit ELF file with section headers.")
+	
+	code = layout.ranges(executable = True)
+	loaded = layout.ranges()
+	problems = []
+	
+	for section in layout.getSections():
+		if (not section.flags & SHF_EXECINSTR):
+			continue
+		
+		words = words_arm64(f.read(section.offset, section.size - section.size % 4))
+		indexes, targets, branches = targets_arm64(words, section.address)
+		
+		numpy = loadNumpy() if not isinstance(targets, list) else None
+		
+		if (numpy is None):
+			bad = [i for (i, wrong_code, wrong_data, branch) in zip(range(len(indexes)), outside(targets, code), outside(targets, loaded), branches) if (wrong_code if branch else wrong_data)]
+		else:
+			bad = numpy.flatnonzero(numpy.where(branches, outside(targets, code), outside(targets, loaded)))
+		
+		for i in bad:
+			problems.append((section.offset + int(indexes[i]) * 4, int(words[indexes[i]]), int(targets[i])))
+	
+	return problems
+
+def originalsPath(game, version):
+	return os.path.join(defaultCacheDir(), "originals", f"{game}-{version}.json")
+
+def loadOriginals(game, version):
+	"""
+	Load the recorded original bytes for a build as a dict of offset to bytes,
+	or None if there aren't any
+	"""
+	
+	key = (game, version)
+	
+	if (key not in loaded_originals):
+		try:
+			with open(originalsPath(game, version), "r") as f:
+				loaded_originals[key] = {int(offset): bytes.fromhex(data) for (offset, data) in json.load(f).items()}
+		except FileNotFoundError:
+			loaded_originals[key] = None
+	
+	return loaded_originals[key]
+
+def recordOriginals(game, location):
+	"""
+	Record the bytes at every site of a game from an unpatched build
+	"""
+	
+	with File(location, writable = False) as f:
+		version = game.checkVersion(f)
+		originals = {}
+		
+		for patch in game.locate(f).patches.values():
+			for site in patch.sites:
+				originals[site.offset] = f.read(site.offset, site.size)
+	
+	path = originalsPath(game.name, version)
+	os.makedirs(os.path.dirname(path), exist_ok = True)
+	
+	with open(path, "w") as f:
+		json.dump({str(offset): data.hex() for (offset, data) in sorted(originals.items())}, f, indent = "\t")
+	
+	loaded_originals[(game.name, version)] = originals
+	
+	return path
+
+def main(argv = None):
+	from patchcore.fingerprint import gameFor
+	
+	parser = argparse.ArgumentParser(prog = "python -m patchcore.verify", description = "Record the original bytes at patch sites, or check the code of patched libraries.")
+	commands = parser.add_subparsers(dest = "command", required = True)
+	
+	record = commands.add_parser("record", help = "Record the original bytes from unpatched libraries")
+	record.add_argument("files", nargs = "+", help = "Unpatched library files")
+	
+	scan = commands.add_parser("scan", help = "Check that every branch and literal load in the code lands inside the library")
+	scan.add_argument("files", nargs = "+", help = "Library files")
+	
+	args = parser.parse_args(argv)
+	failed = 0
+	
+	for path in args.files:
+		try:
+			if (args.command == "record"):
+				print(f"{path}\t{recordOriginals(gameFor(path), path)}")
+				continue
+			
+			with File(path, writable = False) as f:
+				problems = scanCode(f)
+			
+			print(f"{path}\t{'OK' if not problems else f'{len(problems)} bad targets'}")
+			failed += bool(problems)
+			
+			for (offset, word, target) in problems:
+				print(f"\t{hex(offset)}\t{word:08x}\t{decode_arm64(word)} to {hex(target)}")
+		except Exception as e:
+			print(f"{path}\tError: {e}", file = sys.stderr)
+			failed += 1
+	
+	return 1 if failed else 0
+
+if (__name__ == "__main__"):
+	sys.exit(main())
@@ -0,0 +1,255 @@
+"""
+Watch a base library and a preset, and keep a patched output up to date
+
+Every time the preset is saved, only the patches that were added or whose
+values changed are compiled again, and only the bytes that differ are
+written to the output, so a tweak to a value shows up in the output in a few
+milliseconds. If the base library changes, the output is rebuilt from it.
+
+Changes are found by polling the stat of the two files, which is cheap, and
+only hashing their contents when the stat changes. Writes are checked like a
+normal apply: sites are preflighted against the base and read back after.
+"""
+
+import argparse
+import hashlib
+import os
+import sys
+import time
+
+from patchcore.apk import isApk, openLibrary
+from patchcore.file import File, fileDigest
+from patchcore.fingerprint import gameFor
+from patchcore.games import GAMES
+from patchcore.output import atomicOutput
+from patchcore.presets import loadPreset, presetPath
+from patchcore.registry import Plan, compilePlan, selected, writeChecked
+from patchcore import verify
+
+def statKey(path):
+	"""
+	Get the parts of a file's stat that change when it is written or replaced
+	"""
+	
+	try:
+		info = os.stat(path)
+	except FileNotFoundError:
+		return None
+	
+	return (info.st_mtime_ns, info.st_size, info.st_ino)
+
+def mergeSpans(writes):
+	"""
+	Merge the ranges of a list of (offset, data, name) writes into a sorted
+	list of (start, end) spans
+	"""
+	
+	spans = []
+	
+	for (offset, data, name) in sorted(writes, key = lambda w: w[0]):
+		end = offset + len(data)
+		
+		if (spans and offset <= spans[-1][1]):
+			spans[-1][1] = max(spans[-1][1], end)
+		else:
+			spans.append([offset, end])
+	
+	return spans
+
+class Watcher():
+	"""
+	Keeps output patched with the preset at preset_path applied to base
+	"""
+	
+	def __init__(self, base, preset_path, output, game = None):
+		self.base = base
+		self.preset_path = preset_path
+		self.output = output
+		self.game = game
+		
+		# (patch name, value) to the (writes, checks) it compiled to for the
+		# current base
+		self.compiled = {}
+		self.plan = None
+		
+		self.stats = {}
+		self.digests = {}
+		self.output_stat = None
+	
+	def changed(self):
+		"""
+		Get the watched files whose contents have changed since they were last
+		looked at. Files whose stat hasn't changed aren't read.
+		"""
+		
+		result = []
+		
+		for path in (self.base, self.preset_path):
+			key = statKey(path)
+			
+			if (key is None or key == self.stats.get(path)):
+				continue
+			
+			self.stats[path] = key
+			
+			if (path == self.base):
+				digest = fileDigest(path)
+			else:
+				with open(path, "rb") as f:
+					digest = hashlib.sha256(f.read()).hexdigest()
+			
+			if (digest != self.digests.get(path)):
+				self.digests[path] = digest
+				result.append(path)
+		
+		return result
+	
+	def openBase(self, game):
+		if (isApk(self.base)):
+			return openLibrary(self.base, game.library)
+		
+		return File(self.base, writable = False)
+	
+	def rebuild(self, base_changed):
+		"""
+		Bring the output up to date, returning the names of the patches that
+		had to be compiled again and of those that were left out because
+		their value was rejected
+		"""
+		
+		preset = loadPreset(self.preset_path)
+		
+		if (not self.game):
+			self.game = GAMES[preset.game] if preset.game in GAMES else gameFor(self.base)
+		
+		game = self.game
+		names = selected(preset.patches)
+		game.index.checkSelection(names)
+		
+		if (base_changed):
+			self.compiled = {}
+		
+		selection = {name: preset.patches.get(name + "_val") for name in names}
+		recompiled = [name for name in names if (name, selection[name]) not in self.compiled]
+		
+		skipped = []
+		
+		with self.openBase(game) as base:
+			version = game.checkVersion(base)
+			originals = verify.loadOriginals(game.name, version)
+			
+			for name in recompiled:
+				patches = {name: True, name + "_val": selection[name]} if selection[name] is not None else {name: True}
+				compiled = compilePlan(game, base, patches, originals)
+				
+				# Rejected values aren't kept, so they are reported on every save
+				# until they are fixed
+				if (compiled.skipped):
+					skipped.append(name)
+				else:
+					self.compiled[(name, selection[name])] = (compiled.writes, compiled.checks)
+			
+			used = [self.compiled[(name, selection[name])] for name in names if name not in skipped]
+			plan = Plan(game.name, [w for (writes, checks) in used for w in writes], [c for (writes, checks) in used for c in checks])
+			
+			# The output can only be updated in place if it is what was last written
+			if (base_changed or isApk(self.output) or self.plan is None or statKey(self.output) != self.output_stat):
+				self.writeFull(game, plan)
+			else:
+				self.writeChanges(base, plan)
+		
+		self.plan = plan
+		self.output_stat = statKey(self.output)
+		
+		return ([name for name in recompiled if name not in skipped], skipped)
+	
+	def writeFull(self, game, plan):
+		if (isApk(self.base)):
+			with openLibrary(self.base, game.library, self.output) as f:
+				writeChecked(f, plan)
+		else:
+			with atomicOutput(self.base, self.output) as temp:
+				with File(temp) as f:
+					writeChecked(f, plan)
+	
+	def writeChanges(self, base, plan):
+		"""
+		Write only the bytes that differ between the old and new plans. Where
+		they differ, the bytes go back to the base first, so the new plan is
+		preflighted against the base and read back like a full write. Bytes
+		that the old plan wrote and the new one doesn't stay as the base's.
+		"""
+		
+		with File(self.output) as f:
+			for (start, end) in mergeSpans(self.plan.writes + plan.writes):
+				data = base.read(start, end - start)
+				wanted = bytearray(data)
+				
+				for (offset, patch, name) in plan.writes:
+					if (start <= offset < end):
+						wanted[offset - start:offset - start + len(patch)] = patch
+				
+				if (f.read(start, end - start) != wanted):
+					f.patch(start, data)
+			
+			writeChecked(f, plan)
+	
+	def watch(self, interval = 0.1, out = sys.stdout):
+		"""
+		Rebuild whenever the base or preset changes, until interrupted
+		"""
+		
+		while (True):
+			changed = self.changed()
+			
+			if (changed):
+				# Wait for editors that save in several steps to finish
+				time.sleep(interval)
+				changed += [path for path in self.changed() if path not in changed]
+				
+				start = time.perf_counter()
+				
+				try:
+					recompiled, skipped = self.rebuild(self.base in changed)
+					print(f"Rebuilt {self.output} in {(time.perf_counter() - start) * 1000:.1f} ms" + (f" (compiled {', '.join(recompiled)})" if recompiled else " (nothing to compile)"), file = out, flush = True)
+					
+					if (skipped):
+						print(f"Error: these patches weren't applied because their values were rejected: {', '.join(skipped)}", file = out, flush = True)
+				except Exception as e:
+					# Keep watching, the next save might fix it, but rebuild
+					# everything then since it isn't known what was written
+					self.compiled = {}
+					self.plan = None
+					print(f"Error: {e}", file = out, flush = True)
+			
+			time.sleep(interval)
+
+def main(argv = None):
+	parser = argparse.ArgumentParser(prog = "python -m patchcore.watch", description = "Keep a patched library up to date with a base library and a preset.")
+	parser.add_argument("-g", "--game", default = None, choices = list(GAMES), help = "Which game the library is for (default: the preset's, or detect it)")
+	parser.add_argument("-p", "--preset", required = True, help = "Preset file to watch")
+	parser.add_argument("-o", "--output", required = True, help = "Patched library (or APK) to keep up to date")
+	parser.add_argument("-i", "--interval", type = float, default = 0.1, help = "Seconds between checks (default: 0.1)")
+	parser.add_argument("base", help = "Unpatched library (or APK) to watch")
+	args = parser.parse_args(argv)
+	
+	if (os.path.abspath(args.base) == os.path.abspath(args.output)):
+		parser.error("the output can't be the base library")
+	
+	if (isApk(args.base) != isApk(args.output)):
+		parser.error("the base and output must both be libraries or both be APKs")
+	
+	preset_path = args.preset if os.path.exists(args.preset) else presetPath(args.preset)
+	
+	watcher = Watcher(args.base, preset_path, args.output, GAMES[args.game] if args.game else None)
+	print(f"Watching {args.base} and {preset_path}, press Ctrl+C to stop", file = sys.stderr)
+	
+	try:
+		watcher.watch(args.interval)
+	except KeyboardInterrupt:
+		pass
+	
+	return 0
+
+if (__name__ == "__main__"):
+	sys.exit(main())